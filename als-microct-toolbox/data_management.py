@@ -12,10 +12,275 @@ import dxchange
 import h5py
 
 import glob
+import copy
+import json
+import errno
+import shutil
+import hashlib
+import threading
+import collections
+import sqlite3
+import io
+import concurrent.futures as cf
 
 import getpass  # allows commandline password input
 
 import requests  # tools for web requests/communication with online APIs
+from urllib3.util.retry import Retry
+
+SPOT_DefaultURL = "https://portal-auth.nersc.gov"
+
+# Datasets up to this size (bytes) are opened from memory by SpotSession.open_dataset
+MemoryDownloadLimit = 4 * 1024 ** 3
+
+# Seconds that cached responses of each SPOT endpoint stay valid (0 = never cached)
+CacheTTL = {"search": 60, "dataset": 300, "attributes": 3600, "listimages": 3600}
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of SPOT JSON responses with per-endpoint time-to-live.
+
+    Entries are kept in memory and, if cacheDir is given, also written to
+    disk so they are reused by later sessions. The files on disk are limited
+    to maxDiskBytes (least recently used are removed first) and expired files
+    are removed when they are found. Every get returns a copy of the cached
+    response, so callers may change it.
+
+    Attributes
+        ----------
+        ttl : dict
+            Seconds that responses of each endpoint stay valid.
+        maxEntries : int
+            Number of responses kept in memory, least recently used are evicted.
+        cacheDir : str
+            Directory for the on-disk copy of the cache, None for memory only.
+        maxDiskBytes : int
+            Total size of the files in cacheDir, least recently used are removed.
+        hits : int
+            Number of requests answered from the cache.
+        misses : int
+            Number of requests sent to SPOT.
+
+    """
+
+    def __init__(self, ttl=None, maxEntries=1024, cacheDir=None, maxDiskBytes=64 * 1024 ** 2):
+        self.ttl = dict(CacheTTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+        self.maxEntries = maxEntries
+        self.cacheDir = cacheDir
+        self.maxDiskBytes = maxDiskBytes
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()  # key: (endpoint, expires, value)
+        self.lock = threading.Lock()
+        self.diskBytes = 0
+        if cacheDir is not None:
+            if not os.path.exists(cacheDir):
+                os.makedirs(cacheDir)
+            self._purge_disk()
+
+    @staticmethod
+    def key(url, params=None, account=None):
+        """Cache key of a request, account is the SPOT user the response was returned to."""
+        return json.dumps([account, url, sorted((params or {}).items())])
+
+    def get(self, endpoint, key):
+        """Returns (True, copy of value) for a valid cached response, (False, None) otherwise."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.cacheDir is not None:
+                entry = self._read_disk(endpoint, key)
+                if entry is not None:
+                    self._store(key, entry)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, copy.deepcopy(entry[2])
+            if entry is not None:
+                # expired
+                del self.entries[key]
+                if self.cacheDir is not None:
+                    self._remove_disk(self._disk_path(endpoint, key))
+            self.misses += 1
+            return False, None
+
+    def put(self, endpoint, key, value):
+        """Stores a copy of a response if its endpoint is cached."""
+        ttl = self.ttl.get(endpoint, 0)
+        if ttl <= 0:
+            return
+        entry = (endpoint, time.time() + ttl, copy.deepcopy(value))
+        with self.lock:
+            self._store(key, entry)
+            if self.cacheDir is not None:
+                path = self._disk_path(endpoint, key)
+                self._remove_disk(path)
+                with open(path, "w") as f:
+                    json.dump(entry, f)
+                self.diskBytes += os.path.getsize(path)
+                if self.diskBytes > self.maxDiskBytes:
+                    self._purge_disk()
+
+    def invalidate(self, endpoint=None, key=None):
+        """Removes cached responses: one key, all of one endpoint, or everything."""
+        with self.lock:
+            for k in list(self.entries.keys()):
+                if (key is None or k == key) and (endpoint is None or self.entries[k][0] == endpoint):
+                    del self.entries[k]
+            if self.cacheDir is not None:
+                pattern = "*" if key is None else hashlib.sha1(key.encode()).hexdigest()
+                for path in glob.glob(os.path.join(self.cacheDir, (endpoint or "*") + "_" + pattern + ".json")):
+                    self._remove_disk(path)
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    def _disk_path(self, endpoint, key):
+        return os.path.join(self.cacheDir, endpoint + "_" + hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _read_disk(self, endpoint, key):
+        path = self._disk_path(endpoint, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                entry = tuple(json.load(f))
+        except (ValueError, IOError, OSError):
+            return None
+        # the modification time orders the files for _purge_disk
+        os.utime(path, None)
+        return entry
+
+    def _remove_disk(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self.diskBytes = max(self.diskBytes - size, 0)
+
+    def _purge_disk(self):
+        # removes expired files, then least recently used files until the rest fit in maxDiskBytes
+        now = time.time()
+        files = []
+        for path in glob.glob(os.path.join(self.cacheDir, "*.json")):
+            try:
+                with open(path, "r") as f:
+                    expires = json.load(f)[1]
+                files.append((os.path.getmtime(path), os.path.getsize(path), path, expires))
+            except (ValueError, IndexError, IOError, OSError):
+                files.append((0, 0, path, 0))
+        self.diskBytes = sum(size for mtime, size, path, expires in files)
+        for mtime, size, path, expires in sorted(files):
+            if expires <= now or self.diskBytes > self.maxDiskBytes:
+                self._remove_disk(path)
+
+
+class SpotHTTPSession(requests.Session):
+    """requests.Session for SPOT with a sized keep-alive pool, retries and re-authentication.
+
+    GET requests failing with a connection error or a 5xx status are retried with
+    exponential backoff. A 401 response (for example once the session cookie has
+    expired) logs in again with the stored credentials and repeats the request once.
+    The time to response of every request is recorded per endpoint.
+
+    Attributes
+        ----------
+        URL_authentication : str
+            Login address of SPOT.
+        latency : dict
+            [count, total seconds, maximum seconds] per endpoint.
+
+    """
+
+    def __init__(self, URL_authentication, poolSize=10, retries=3, backoff=0.5):
+        super(SpotHTTPSession, self).__init__()
+        self.URL_authentication = URL_authentication
+        self.retries = retries
+        self.backoff = backoff
+        self.credentials = None
+        self.latency = {}
+        self.authCount = 0
+        self.authLock = threading.Lock()
+        self.latencyLock = threading.Lock()
+        self.poolLock = threading.Lock()
+        self.poolSize = 0
+        self.set_pool_size(poolSize)
+
+    def set_pool_size(self, poolSize):
+        """Mounts an adapter keeping up to poolSize connections per host alive, if the pool is smaller.
+
+        Safe while other threads use the session: the adapters are replaced at
+        once, requests in progress finish on the adapter they started on.
+        """
+        with self.poolLock:
+            if poolSize <= self.poolSize:
+                return
+            retry = Retry(total=self.retries, backoff_factor=self.backoff, status_forcelist=(500, 502, 503, 504),
+                          raise_on_status=False)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=poolSize, max_retries=retry)
+            # not mount(), which reorders the adapters other threads may be looking up
+            self.adapters = collections.OrderedDict([("https://", adapter), ("http://", adapter)])
+            self.poolSize = poolSize
+
+    def login(self, username, password):
+        """Authenticates with SPOT and keeps the credentials for re-authentication."""
+        self.credentials = {"username": username, "password": password}
+        return self._login()
+
+    def _login(self):
+        r = self._timed_request("POST", self.URL_authentication, data=self.credentials)
+        self.authCount += 1
+        return r
+
+    def request(self, method, url, *args, **kwargs):
+        if self.credentials is None or url.startswith(self.URL_authentication):
+            return self._timed_request(method, url, *args, **kwargs)
+        authCount = self.authCount
+        r = self._timed_request(method, url, *args, **kwargs)
+        if r.status_code == 401:
+            logging.info("SPOT session expired, authenticating again")
+            self._reauthenticate(authCount)
+            r = self._timed_request(method, url, *args, **kwargs)
+        return r
+
+    def _reauthenticate(self, authCount):
+        # threads that failed with the same cookie log in only once
+        with self.authLock:
+            if self.authCount == authCount:
+                self._login()
+
+    def _timed_request(self, method, url, *args, **kwargs):
+        start = time.time()
+        try:
+            return super(SpotHTTPSession, self).request(method, url, *args, **kwargs)
+        finally:
+            self._record_latency(url, time.time() - start)
+
+    def _record_latency(self, url, seconds):
+        endpoint = endpoint_name(url)
+        with self.latencyLock:
+            count, total, maximum = self.latency.get(endpoint, (0, 0.0, 0.0))
+            self.latency[endpoint] = (count + 1, total + seconds, max(maximum, seconds))
+
+    def latency_stats(self):
+        """Returns {endpoint: {"count", "mean", "max"}} of the recorded request times in seconds."""
+        with self.latencyLock:
+            return {endpoint: {"count": count, "mean": total / count, "max": maximum}
+                    for endpoint, (count, total, maximum) in self.latency.items()}
+
+
+def endpoint_name(url):
+    """Name of the SPOT endpoint of a URL (ex. "search", "download", "auth")."""
+    parts = requests.utils.urlparse(url).path.strip("/").split("/")
+    if parts[:2] == ["als", "hdf"] and len(parts) > 2:
+        return parts[2]
+    return parts[1] if parts[:1] == ["als"] and len(parts) > 1 else "/".join(parts)
 
 
 class SpotSession:
@@ -25,23 +290,50 @@ class SpotSession:
         ----------
         username : str
             SPOT username for authentication.
+        session : SpotHTTPSession
+            HTTP session shared by all requests, see latency_stats() for request times.
+        cache : ResponseCache
+            Cache of metadata responses (search, derived datasets, attributes,
+            image lists), None if caching is off.
 
     """
 
-    def __init__(self, username='default', password=None):
+    def __init__(self, username='default', password=None, baseURL=SPOT_DefaultURL, cache=False, cacheDir=None,
+                 cacheTTL=None, cacheSize=1024, cacheDiskBytes=64 * 1024 ** 2, poolSize=10, retries=3, backoff=0.5):
         """Creates SPOT session class.
 
         Parameters
         ----------
         username : str
             SPOT username for authentication.
+        password : str
+            SPOT password, prompted for if not given.
+        baseURL : str
+            Address of the SPOT API server.
+        cache : bool
+            Cache metadata responses in memory (see ResponseCache).
+        cacheDir : str
+            Also keep cached responses in this directory (turns on cache).
+        cacheTTL : dict
+            Seconds that responses of each endpoint stay valid, overrides CacheTTL.
+        cacheSize : int
+            Number of responses kept in memory.
+        cacheDiskBytes : int
+            Total size of the responses kept in cacheDir.
+        poolSize : int
+            Number of keep-alive connections kept open to SPOT.
+        retries : int
+            Number of retries of requests failing with connection errors or 5xx status.
+        backoff : float
+            Backoff factor in seconds, retry n waits backoff * 2 ** (n - 1).
 
         """
 
         if password is None:
             password = getpass.getpass()
 
-        self.URL_authentication = "https://portal-auth.nersc.gov/als/auth"
+        self.URL_base = baseURL.rstrip("/")
+        self.URL_authentication = self.URL_base + "/als/auth"
         self.username = 'alvarorh'
         self.spot_username = username
         spot_password = password
@@ -49,11 +341,16 @@ class SpotSession:
         if username == 'default':  # if no additional usermane is given, spot username is stored to be used in file paths
             self.spot_username = self.username
 
-        s = requests.Session()
+        s = SpotHTTPSession(self.URL_authentication, poolSize=poolSize, retries=retries, backoff=backoff)
         r = s.get(self.URL_authentication)
-        r = s.post(self.URL_authentication, {"username": self.spot_username, "password": spot_password})
+        r = s.login(self.spot_username, spot_password)
         self.session = s
 
+        self.cache = None
+        if cache or cacheDir is not None:
+            self.cache = ResponseCache(ttl=cacheTTL, maxEntries=cacheSize, cacheDir=cacheDir,
+                                       maxDiskBytes=cacheDiskBytes)
+
     """
 POST
 URL:
@@ -100,12 +397,22 @@ EXAMPLE:
             print("Authentication required to start a new session")
             spot_username = input("username:")
             spot_password = getpass.getpass()
-            s = requests.Session()
-            r = s.post(self.URL_authentication, {"username": spot_username, "password": spot_password})
-            self.session = s
+            r = s.login(spot_username, spot_password)  # keeps the open connections of the session
         r = s.get(self.URL_authentication)
         return r.json()['auth']
 
+    def latency_stats(self):
+        """Request times per SPOT endpoint.
+
+        Returns
+        ------
+        dict
+            {endpoint: {"count": requests, "mean": seconds, "max": seconds}}
+
+        """
+
+        return self.session.latency_stats()
+
     # =============================================================================
     # Close session
     # Under development (almost works)
@@ -123,6 +430,41 @@ EXAMPLE:
         r = self.session.get(self.URL_authentication)
         return r.json()
 
+    # =============================================================================
+    # GET request returning JSON, answered from the cache when possible
+
+    def _get_json(self, endpoint, url, params=None):
+        """Sends a GET request and returns its JSON response, using the cache if enabled.
+
+        Parameters
+        ----------
+        endpoint : str
+            Name of the SPOT endpoint (key of CacheTTL).
+        url : str
+            Request URL.
+        params : dict
+            Query parameters.
+
+        Returns
+        ------
+        JSON object
+            Response of SPOT.
+
+        """
+
+        if self.cache is None:
+            return self.session.get(url, params=params).json()
+
+        key = ResponseCache.key(url, params, self.spot_username)
+        found, value = self.cache.get(endpoint, key)
+        if found:
+            return value
+        r = self.session.get(url, params=params)
+        value = r.json()
+        if r.status_code == 200:
+            self.cache.put(endpoint, key, value)
+        return value
+
     # =============================================================================
     # Search Datasets
     # tested, works properly, returns list of json oblejcts
@@ -149,11 +491,67 @@ EXAMPLE:
 
         """
 
-        self.URL_search = "https://portal-auth.nersc.gov/als/hdf/search"
-        self.PARAMS_search = {"limitnum": limitnum, "skipnum": skipnum, "sortterm": sortterm, "sorttype": sorttype,
-                              "search": search}
-        r = self.session.get(url=self.URL_search, params=self.PARAMS_search)
-        return r.json()  # returns list of JSON objects containing search results
+        self.URL_search = self.URL_base + "/als/hdf/search"
+        params = {"limitnum": limitnum, "skipnum": skipnum, "sortterm": sortterm, "sorttype": sorttype,
+                  "search": search}
+        self.PARAMS_search = params
+        return self._get_json("search", self.URL_search, params=params)  # returns list of JSON objects containing search results
+
+    def search_iter(self, search, pageSize=100, prefetch=4, sortterm="fs.stage_date", sorttype="desc",
+                    maxResults=None, stop=None):
+        """Yields all search results, fetching the following pages concurrently.
+
+        Up to prefetch pages are requested ahead of the page being consumed.
+        Pages are cached like search() results if the session has a cache.
+
+        Parameters
+        ----------
+        search : str
+            Query beamline or "end_station" (ex. "bl832")
+        pageSize : int
+            Number of results requested per page (limitnum).
+        prefetch : int
+            Number of pages requested at the same time.
+        sortterm: str
+            Database field on which to sort (commonly fs.stage_date or appmetadata.sdate).
+        sorttype: str
+            desc or asc
+        maxResults : int
+            Stop after this many results, None for all results.
+        stop : function
+            Takes a result and returns True to end the iteration before it is yielded.
+
+        Yields
+        ------
+        JSON object
+            Dataset matching the search.
+
+        """
+
+        executor = cf.ThreadPoolExecutor(max(1, prefetch))
+        pages = collections.deque()
+        nextPage = 0
+        count = 0
+        try:
+            while True:
+                while len(pages) < prefetch and (maxResults is None or nextPage * pageSize < maxResults):
+                    pages.append(executor.submit(self.search, search, limitnum=pageSize,
+                                                 skipnum=nextPage * pageSize, sortterm=sortterm, sorttype=sorttype))
+                    nextPage += 1
+                if not pages:
+                    return
+                page = pages.popleft().result()
+                for result in page:
+                    if (maxResults is not None and count >= maxResults) or (stop is not None and stop(result)):
+                        return
+                    count += 1
+                    yield result
+                if len(page) < pageSize:  # last page
+                    return
+        finally:
+            for future in pages:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     """
 GET
@@ -191,12 +589,10 @@ EXAMPLE:
 
         dataset = dataset.strip(".h5")
 
-        self.URL_DerivedDatasets = "https://portal-auth.nersc.gov/als/hdf/dataset"
+        self.URL_DerivedDatasets = self.URL_base + "/als/hdf/dataset"
         self.PARAMS_DerivedDatasets = {"dataset": dataset}
 
-        r = self.session.get(self.URL_DerivedDatasets, params=self.PARAMS_DerivedDatasets)
-
-        return r.json()
+        return self._get_json("dataset", self.URL_DerivedDatasets, params=self.PARAMS_DerivedDatasets)
 
     """
 GET
@@ -272,15 +668,13 @@ EXAMPLE:
 
         """
 
-        self.URL_attributes = "https://portal-auth.nersc.gov/als/hdf/attributes/als/bl832/"
+        self.URL_attributes = self.URL_base + "/als/hdf/attributes/als/bl832/"
 
         dataset, username = self.formatPath(dataset, username=username)
 
         URLstring = self.URL_attributes + username + "/" + dataset + "/raw/" + dataset + ".h5"
 
-        r = self.session.get(url=URLstring, params={"group": "/"})
-
-        return r.json()
+        return self._get_json("attributes", URLstring, params={"group": "/"})
 
     """
 GET
@@ -316,10 +710,9 @@ EXAMPLE:
         """
 
         dataset = dataset.strip(".h5")
-        self.URL_listImages = "https://portal-auth.nersc.gov/als/hdf/listimages/als/bl832/"
+        self.URL_listImages = self.URL_base + "/als/hdf/listimages/als/bl832/"
         URLstring = self.URL_listImages + username + "/" + dataset + "/raw/" + dataset + ".h5"
-        r = self.session.get(URLstring)
-        return r.json()
+        return self._get_json("listimages", URLstring)
 
     """
  GET
@@ -350,15 +743,26 @@ EXAMPLE:
         Returns
         ------
         JSON Array
-            Details of staging process.
+            Details of staging process. If SPOT answers with an HTTP error,
+            a dict with "error" and "status_code" (see stage_failed).
 
         """
 
         fileName, username = self.formatPath(dataset, username)
-        self.URL_stage = "https://portal-auth.nersc.gov/als/hdf/stageifneeded/als/bl832/"
+        self.URL_stage = self.URL_base + "/als/hdf/stageifneeded/als/bl832/"
         URL_string = self.URL_stage + username + "/" + fileName + "/raw/" + fileName + ".h5"
         r = self.session.get(url=URL_string)
-        return r.json()
+        try:
+            value = r.json()
+        except ValueError:
+            value = None
+        if r.status_code != 200:
+            logging.warning("stage request failed: {} HTTP {}".format(dataset, r.status_code))
+            error = value if isinstance(value, dict) else {}
+            error = dict(error, status_code=r.status_code)
+            error.setdefault("error", r.reason or "HTTP {}".format(r.status_code))
+            return error
+        return value
 
     """
  GET
@@ -372,11 +776,119 @@ EXAMPLE:
 % curl -k -b cookies.txt -X GET "https://portal-auth.nersc.gov/als/hdf/stageifneeded/als/bl832/hmwood/20130713_185717_Chilarchaea_quellon_F_9053427_IKI_/raw/20130713_185717_Chilarchaea_quellon_F_9053427_IKI_.h5"
     """
 
+    # =============================================================================
+    # Stage Many Datasets Concurrently
+
+    def stage_many(self, datasets, username='default', maxWorkers=8):
+        """Sends stage requests for a list of datasets concurrently.
+
+        Parameters
+        ----------
+        datasets : list
+            Names of existing datasets on SPOT.
+        username: str
+            Username associated with datasets.
+        maxWorkers : int
+            Maximum number of requests in flight.
+
+        Returns
+        ------
+        list
+            JSON response of each stage request, in the order of datasets.
+
+        """
+
+        if type(datasets) != list:
+            datasets = [datasets]
+
+        with cf.ThreadPoolExecutor(max(1, min(maxWorkers, len(datasets)))) as executor:
+            return list(executor.map(lambda dataset: self.stage(dataset, username), datasets))
+
+    # =============================================================================
+    # Stage Datasets and Wait Until They Are Online
+
+    def stage_iter(self, datasets, username='default', maxWorkers=8, pollInterval=5.0, maxInterval=120.0,
+                   timeout=None, ready=None):
+        """Stages datasets concurrently and yields each one as soon as it is online.
+
+        Stage requests are sent with bounded parallelism. Datasets that are
+        still being staged are polled again with exponential backoff. Because
+        datasets are yielded as they come online, processing of the first
+        datasets overlaps staging of the rest:
+
+            for dataset, r in s.stage_iter(fileList):
+                s.download(dataset)
+
+        Parameters
+        ----------
+        datasets : list
+            Names of existing datasets on SPOT.
+        username: str
+            Username associated with datasets.
+        maxWorkers : int
+            Maximum number of datasets staged/polled at the same time.
+        pollInterval : float
+            Seconds before the first poll, doubled after every poll.
+        maxInterval : float
+            Longest time between polls in seconds.
+        timeout : float
+            Seconds after which a dataset that is not online is given up on (logged, not yielded).
+        ready : function
+            Takes a stage response and returns True if the dataset is online,
+            defaults to stage_complete.
+
+        Yields
+        ------
+        dataset, JSON Array
+            Dataset name and its last stage response. Datasets whose stage
+            request fails (see stage_failed) are logged and not yielded.
+
+        """
+
+        if type(datasets) != list:
+            datasets = [datasets]
+        ready = stage_complete if ready is None else ready
+        stop = threading.Event()  # set when the consumer stops iterating
+
+        def stage_and_poll(dataset):
+            start = time.time()
+            interval = pollInterval
+            r = self.stage(dataset, username)
+            while not ready(r):
+                if stage_failed(r):
+                    return dataset, r, False
+                if timeout is not None and time.time() - start + interval > timeout:
+                    return dataset, r, False
+                if stop.wait(interval):
+                    return dataset, r, False
+                interval = min(interval * 2, maxInterval)
+                r = self.stage(dataset, username)
+            return dataset, r, not stage_failed(r)
+
+        executor = cf.ThreadPoolExecutor(max(1, min(maxWorkers, len(datasets))))
+        futures = []
+        try:
+            futures = [executor.submit(stage_and_poll, dataset) for dataset in datasets]
+            for future in cf.as_completed(futures):
+                dataset, r, online = future.result()
+                if online:
+                    yield dataset, r
+                elif stage_failed(r):
+                    logging.warning("staging failed: {} {}".format(dataset, r))
+                elif not stop.is_set():
+                    logging.warning("staging timed out: {} {}".format(dataset, r))
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
     # =============================================================================
     # Download Dataset
     # Tested, works properly
 
-    def download(self, dataset, username='default', downloadPath='default', downloadName='default'):
+    def download(self, dataset, username='default', downloadPath='default', downloadName='default',
+                 connections=4, resume=True, checksum=None):
         """Downloads dataset (HDF5 file)
 
         Parameters
@@ -389,6 +901,12 @@ EXAMPLE:
             Directory where to write file to.
         downloadName : str
             Name of file in specified directory.
+        connections : int
+            Number of parallel connections (HTTP range requests).
+        resume : bool
+            Continue an interrupted download from its partial file.
+        checksum : tuple
+            Optional (algorithm, hexdigest), e.g. ('md5', '...'), to verify the download.
 
         Returns
         ------
@@ -400,7 +918,7 @@ EXAMPLE:
         filename, username = self.formatPath(dataset, username=username)  # process input path
         downloadName = downloadName.strip('.h5')  # remove .h5 from output file name
 
-        self.URL_download = "https://portal-auth.nersc.gov/als/hdf/download/als/bl832/"
+        self.URL_download = self.URL_base + "/als/hdf/download/als/bl832/"
 
         if downloadPath == 'default':
             downloadPath = "./"
@@ -412,18 +930,12 @@ EXAMPLE:
             downloadPath = downloadPath + "/"
 
         URL_string = self.URL_download + username + "/" + filename + "/raw/" + filename + ".h5"
-
-        r = self.session.get(URL_string)
+        self.session.set_pool_size(connections)
 
         fileLocation = downloadPath + downloadName + ".h5"
 
-        location = open(fileLocation, "wb")
-
-        for chunk in r.iter_content(chunk_size=512):
-            if chunk:
-                location.write(chunk)
-
-        print('download  complete: ' + fileLocation)
+        download_file(self.session, URL_string, fileLocation, connections=connections, resume=resume,
+                      checksum=checksum)
 
         return fileLocation
 
@@ -439,6 +951,45 @@ EXAMPLE:
 % curl -k -b cookies.txt -X GET "https://portal-auth.nersc.gov/als/hdf/download/als/bl832/hmwood/20130713_185717_Chilarchaea_quellon_F_9053427_IKI_/raw/20130713_185717_Chilarchaea_quellon_F_9053427_IKI_.h" > file.h5
     """
 
+    # =============================================================================
+    # Open Dataset, in memory if it is small enough
+
+    def open_dataset(self, dataset, username='default', maxMemory=MemoryDownloadLimit, downloadPath='default',
+                     connections=4):
+        """Downloads a raw dataset and opens it with h5py, without a local file if it fits in memory.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of an existing dataset on SPOT.
+        username: str
+            Username associated with dataset.
+        maxMemory : int
+            Datasets up to this many bytes are kept in memory, larger ones are
+            downloaded to downloadPath.
+        downloadPath : str
+            Directory for datasets larger than maxMemory.
+        connections : int
+            Number of parallel connections.
+
+        Returns
+        ------
+        h5py.File
+            Opened dataset, can be passed to recon(inputData=...).
+
+        """
+
+        filename, username = self.formatPath(dataset, username=username)
+        URL_string = self.URL_base + "/als/hdf/download/als/bl832/" + username + "/" + filename + "/raw/" + \
+            filename + ".h5"
+
+        size = remote_size(self.session, URL_string)
+        if size is not None and size <= maxMemory:
+            return h5py.File(download_to_memory(self.session, URL_string, connections=connections), 'r')
+        logging.info("{} does not fit in memory, downloading to {}".format(filename, downloadPath))
+        return h5py.File(self.download(filename, username=username, downloadPath=downloadPath,
+                                       connections=connections), 'r')
+
     # =============================================================================
     # Download Rawdata For Individual Image
     # *** NOT TESTED ***
@@ -470,17 +1021,9 @@ EXAMPLE:
 
         filename, username = self.formatPath(dataset, username=username)
 
-        URL_download = "https://portal-auth.nersc.gov/als/hdf/rawdata"
-
-        data_paths = self.derived_datasets(filename)
+        URL_download = self.URL_base + "/als/hdf/rawdata"
 
-        for i in range(data_paths.__len__()):
-            path = data_paths[i]['path']
-
-            if path.find(kind) != -1:
-                break
-
-        image_list = self.list_images(filename, username)
+        path, image_list = self.image_paths(filename, username=username, kind=kind)
         image = image_list[number]
 
         if downloadPath == 'default':
@@ -494,17 +1037,10 @@ EXAMPLE:
 
         URLstring = URL_download + path
 
-        r = self.session.get(url=URLstring, params={"group": "/" + image})
-
         fileLocation = downloadPath + downloadName + '.tif'
 
-        location = open(fileLocation, "wb")
-
-        for chunk in r.iter_content(chunk_size=512):
-            if chunk:
-                location.write(chunk)
-
-        print('download  complete: ' + fileLocation)
+        download_file(self.session, URLstring, fileLocation, params={"group": "/" + image}, connections=1,
+                      resume=False)
 
         return fileLocation
 
@@ -522,33 +1058,93 @@ EXAMPLE:
     """
 
     # =============================================================================
-    # Get Download URLs for .tif and .png files for individual image
-    # TESTED, works properly.
+    # Download Many Images of a Dataset Concurrently
 
-    def download_URLS(self, dataset, username='default', kind='raw', number=0):
-        """Get download URLs for .tif and .png files for individual image.
+    def download_images(self, dataset, numbers=None, username='default', kind='raw', downloadPath='default',
+                        connections=8, asArray=False):
+        """Download a list or range of images of a dataset over concurrent pooled connections.
+
+        The derived dataset path and the image list are looked up once for all images.
 
         Parameters
         ----------
         dataset : str
             The name of an existing dataset on SPOT.
+        numbers : list or range
+            Image numbers in the list of images for the dataset, None for all images.
         username: str
             Username associated with dataset.
         kind : str
             Type of data (norm, sino, gridrec, imgrec, etc).
-        number : int
-            Specific image number in list of images for the dataset.
+        downloadPath : str
+            Directory where to write the images to (ignored if asArray is True).
+        connections : int
+            Number of images downloaded at the same time.
+        asArray : bool
+            Return the images as a 3D numpy array instead of writing files.
 
         Returns
         ------
-        JSON Array
-            Download URLs as JSON objects.
+        list or ndarray
+            Locations of the downloaded images in order of numbers, or the
+            images stacked along the first axis if asArray is True.
 
         """
 
         filename, username = self.formatPath(dataset, username=username)
 
-        URL_download = "https://portal-auth.nersc.gov/als/hdf/image"
+        path, image_list = self.image_paths(filename, username=username, kind=kind)
+        if numbers is None:
+            numbers = range(len(image_list))
+        images = [image_list[number] for number in numbers]
+
+        if downloadPath == 'default':
+            downloadPath = "./"
+        if not asArray and not os.path.exists(downloadPath):
+            os.makedirs(downloadPath)
+
+        URLstring = self.URL_base + "/als/hdf/rawdata" + path
+        self.session.set_pool_size(connections)
+
+        start = time.time()
+        with cf.ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = [executor.submit(self._fetch_image, URLstring, image,
+                                       None if asArray else os.path.join(downloadPath, os.path.basename(image)))
+                       for image in images]
+            try:
+                results = [future.result() for future in futures]
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        elapsed = max(time.time() - start, 1e-6)
+        logging.info("Downloaded {} images of {} in {:.1f} s ({:.1f} images/s)".format(
+            len(images), filename, elapsed, len(images) / elapsed))
+
+        if asArray:
+            return np.stack(results) if results else np.empty((0, 0, 0))
+        return results
+
+    def image_paths(self, dataset, username='default', kind='raw'):
+        """Finds the derived dataset of the given kind and the images within it.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of an existing dataset on SPOT.
+        username: str
+            Username associated with dataset.
+        kind : str
+            Type of data (norm, sino, gridrec, imgrec, etc).
+
+        Returns
+        ------
+        str, JSON List
+            Path of the derived dataset and paths to the images within it.
+
+        """
+
+        filename, username = self.formatPath(dataset, username=username)
 
         data_paths = self.derived_datasets(filename)
 
@@ -558,7 +1154,48 @@ EXAMPLE:
             if path.find(kind) != -1:
                 break
 
-        image_list = self.list_images(filename, username)
+        return path, self.list_images(filename, username)
+
+    def _fetch_image(self, URLstring, image, fileLocation=None):
+        # one image: written to fileLocation, or returned as an array if fileLocation is None
+        r = self.session.get(URLstring, params={"group": "/" + image})
+        r.raise_for_status()
+        if fileLocation is None:
+            return read_tiff_bytes(r.content)
+        with open(fileLocation, "wb") as f:
+            f.write(r.content)
+        return fileLocation
+
+    # =============================================================================
+    # Get Download URLs for .tif and .png files for individual image
+    # TESTED, works properly.
+
+    def download_URLS(self, dataset, username='default', kind='raw', number=0):
+        """Get download URLs for .tif and .png files for individual image.
+
+        Parameters
+        ----------
+        dataset : str
+            The name of an existing dataset on SPOT.
+        username: str
+            Username associated with dataset.
+        kind : str
+            Type of data (norm, sino, gridrec, imgrec, etc).
+        number : int
+            Specific image number in list of images for the dataset.
+
+        Returns
+        ------
+        JSON Array
+            Download URLs as JSON objects.
+
+        """
+
+        filename, username = self.formatPath(dataset, username=username)
+
+        URL_download = self.URL_base + "/als/hdf/image"
+
+        path, image_list = self.image_paths(filename, username=username, kind=kind)
         image = image_list[number]
 
         URLstring = URL_download + path
@@ -602,7 +1239,7 @@ EXAMPLE:
         raw_dataset = raw_dataset.strip('.h5')
         raw_dataset = raw_dataset.strip('/')
 
-        URL_download = "https://portal-auth.nersc.gov/als/hdf/tomopyjob"
+        URL_download = self.URL_base + "/als/hdf/tomopyjob"
 
         r = self.session.get(url=URL_download, params={"dataset": raw_dataset})
 
@@ -663,9 +1300,239 @@ def list_h5_files(searchDir):
     return (h5_list)
 
 
+# =============================================================================
+# Group attributes of raw datasets stored in their own DatasetCatalog column
+CatalogColumns = (("nslices", "INTEGER"), ("nangles", "INTEGER"), ("nrays", "INTEGER"), ("arange", "REAL"),
+                  ("pxsize", "REAL"), ("i0cycle", "INTEGER"), ("num_bright_field", "INTEGER"),
+                  ("num_dark_fields", "INTEGER"))
+
+
+class DatasetCatalog:
+    """SQLite index of the raw datasets (.h5 files) in local directories.
+
+    scan() reads the dataset group attributes of new or changed files (by
+    modification time and size) in parallel and stores them, so datasets can
+    be selected without opening each file.
+
+        catalog = DatasetCatalog("datasets.db")
+        catalog.scan("/data/raw")
+        rows = catalog.find(name="%10x%", after="2016-06", before="2016-07", nangles=(2001, None))
+        recon_batch(catalog.recon_inputs(rows, outputPath="/data/rec/"))
+
+    Attributes
+        ----------
+        dbPath : str
+            Location of the SQLite database file.
+
+    """
+
+    def __init__(self, dbPath):
+        self.dbPath = dbPath
+        self.db = sqlite3.connect(dbPath)
+        self.db.row_factory = sqlite3.Row
+        columns = "".join(", {} {}".format(name, kind) for name, kind in CatalogColumns)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS datasets (path TEXT PRIMARY KEY, name TEXT, directory TEXT, "
+                            "date TEXT, mtime REAL, size INTEGER" + columns + ", attrs TEXT)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS datasets_date ON datasets (date)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS datasets_nangles ON datasets (nangles)")
+
+    def scan(self, directories, recursive=True, maxWorkers=8):
+        """Adds new and changed .h5 files of the directories, removes files that are gone.
+
+        Parameters
+        ----------
+        directories : str or list
+            Directories to index.
+        recursive : bool
+            Also index subdirectories.
+        maxWorkers : int
+            Number of files read at the same time (separate processes).
+
+        Returns
+        ------
+        dict
+            Number of files "added", "updated", "unchanged", "removed" and "failed".
+
+        """
+
+        if type(directories) != list:
+            directories = [directories]
+
+        start_time = time.time()
+        found = {}
+        for directory in directories:
+            for path in _find_h5_files(directory, recursive):
+                stat = os.stat(path)
+                found[path] = (stat.st_mtime, stat.st_size)
+
+        known = {}
+        for directory in directories:
+            prefix = os.path.join(os.path.abspath(directory), "")
+            for row in self.db.execute("SELECT path, mtime, size FROM datasets WHERE substr(path, 1, ?) = ?",
+                                       (len(prefix), prefix)):
+                if recursive or os.path.join(os.path.dirname(row["path"]), "") == prefix:
+                    known[row["path"]] = (row["mtime"], row["size"])
+
+        todo = [path for path in found if known.get(path) != found[path]]
+        counts = {"added": 0, "updated": 0, "unchanged": len(found) - len(todo), "removed": 0, "failed": 0}
+        with self.db:
+            if todo:
+                with cf.ProcessPoolExecutor(max(1, min(maxWorkers, len(todo)))) as executor:
+                    for path, attrs in zip(todo, executor.map(read_dataset_attributes, todo, chunksize=8)):
+                        if attrs is None:
+                            counts["failed"] += 1
+                            continue
+                        counts["updated" if path in known else "added"] += 1
+                        self._store(path, found[path], attrs)
+            for path in known:
+                if path not in found:
+                    self.db.execute("DELETE FROM datasets WHERE path = ?", (path,))
+                    counts["removed"] += 1
+
+        logging.info("catalog scan of {} files in {:.1f} s: {}".format(len(found), time.time() - start_time, counts))
+        return counts
+
+    def find(self, name=None, after=None, before=None, where=None, params=(), **ranges):
+        """Selects datasets.
+
+        Parameters
+        ----------
+        name : str
+            SQL LIKE pattern of the dataset name (ex. "%10x%").
+        after : str
+            Datasets acquired at or after this date (ex. "2016-06" or "2016-06-10").
+        before : str
+            Datasets acquired before this date.
+        where : str
+            Additional SQL condition, with ? placeholders for params.
+        params : tuple
+            Values of the placeholders in where.
+        **ranges : tuple
+            (min, max) of a column of CatalogColumns, None for no limit (ex. nangles=(2001, None)).
+
+        Returns
+        ------
+        list
+            One dict per dataset with the catalog columns and "attrs", all
+            group attributes, ordered by date.
+
+        """
+
+        conditions = []
+        values = []
+        if name is not None:
+            conditions.append("name LIKE ?")
+            values.append(name)
+        if after is not None:
+            conditions.append("date >= ?")
+            values.append(after)
+        if before is not None:
+            conditions.append("date < ?")
+            values.append(before)
+        columns = [column for column, kind in CatalogColumns]
+        for column, (low, high) in ranges.items():
+            if column not in columns:
+                raise ValueError("unknown catalog column: {}".format(column))
+            if low is not None:
+                conditions.append(column + " >= ?")
+                values.append(low)
+            if high is not None:
+                conditions.append(column + " <= ?")
+                values.append(high)
+        if where is not None:
+            conditions.append("(" + where + ")")
+            values.extend(params)
+
+        query = "SELECT * FROM datasets"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = []
+        for row in self.db.execute(query + " ORDER BY date, name", values):
+            row = dict(row)
+            row["attrs"] = json.loads(row["attrs"])
+            rows.append(row)
+        return rows
+
+    def recon_inputs(self, rows, **arguments):
+        """Converts rows of find() into argument dicts for recon / recon_batch."""
+        inputs = []
+        for row in rows:
+            functioninput = {"filename": row["name"] + ".h5", "inputPath": row["directory"] + "/"}
+            functioninput.update(arguments)
+            inputs.append(functioninput)
+        return inputs
+
+    def close(self):
+        self.db.close()
+
+    def _store(self, path, stat, attrs):
+        name = os.path.splitext(os.path.basename(path))[0]
+        values = [path, name, os.path.dirname(path), dataset_date(name, stat[0]), stat[0], stat[1]]
+        values += [attrs.get(column) for column, kind in CatalogColumns]
+        values.append(json.dumps(attrs))
+        self.db.execute("INSERT OR REPLACE INTO datasets VALUES (" + ", ".join("?" * len(values)) + ")", values)
+
+
+def read_dataset_attributes(path):
+    """Returns the dataset group attributes of a raw .h5 file as a dict, None if it cannot be read."""
+    try:
+        with h5py.File(path, 'r') as f:
+            group = f[list(f.keys())[0]]
+            attrs = {}
+            for key, value in group.attrs.items():
+                if isinstance(value, bytes):
+                    value = value.decode(errors="replace")
+                elif isinstance(value, np.ndarray):
+                    value = value.tolist()
+                elif isinstance(value, np.generic):
+                    value = value.item()
+                attrs[key] = value
+    except (IOError, OSError, IndexError, AttributeError) as e:
+        logging.warning("cannot read {}: {}".format(path, e))
+        return None
+    for column, kind in CatalogColumns:  # attributes are often stored as strings
+        try:
+            attrs[column] = (int if kind == "INTEGER" else float)(float(attrs[column]))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return attrs
+
+
+def dataset_date(name, mtime=None):
+    """Acquisition date "YYYY-MM-DD HH:MM:SS" from a dataset name starting with YYYYMMDD_HHMMSS, else from mtime."""
+    try:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.strptime(name[:15], "%Y%m%d_%H%M%S"))
+    except ValueError:
+        if mtime is None:
+            return None
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
+
+
+def _find_h5_files(directory, recursive):
+    directory = os.path.abspath(directory)
+    if not recursive:
+        return sorted(glob.glob(os.path.join(directory, "*.h5")))
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(".h5"))
+    return sorted(paths)
+
+
 # =============================================================================
 NERSC_DefaultPath = "/global/project/projectdirs/als/spade/warehouse/als/bl832/"
 userDefault = "hsbarnard"
+ScratchCacheSize = 200 * 1024 ** 3  # default size limit of a ScratchCache in bytes
+
+
+def NERSC_RawPaths(filename, useraccount=userDefault, archivepath=NERSC_DefaultPath):
+    '''
+    Generates paths to the raw .h5 files in NERSC Archives (see NERSC_ArchivePath)
+    Input list of file names, returns list of file paths
+    '''
+    if type(filename) != list:
+        filename = [filename]
+    return [path + name + ".h5" for path, name in zip(NERSC_ArchivePath(filename, useraccount, archivepath), filename)]
 
 
 def NERSC_ArchivePath(filename, useraccount=userDefault, archivepath=NERSC_DefaultPath):
@@ -688,49 +1555,74 @@ def NERSC_ArchivePath(filename, useraccount=userDefault, archivepath=NERSC_Defau
 
 # =============================================================================
 
-def NERSC_StageData(filename, username='default'):
+def NERSC_StageData(filename, username='default', maxWorkers=8):
     '''
-    curl command sent to spot.nersc to stage data if stored on tape
-    requires credentials. Run the following command
-    > curl -k -c cookies.txt -X POST -d "username=[your_username]&password=[your_password]" https://portal-auth.nersc.gov/als/auth
+    Request sent to spot.nersc to stage data if stored on tape
+    requires credentials (prompted for).
+    Stage requests for all files are sent concurrently, see SpotSession.stage_iter
+    to wait for the files to come online.
     for more info: http://spot.nersc.gov/api.php
     '''
     # Prompts user for username and password
-
-    URL_authentication = "https://portal-auth.nersc.gov/als/auth"
     spot_username = input("username:")
     spot_password = getpass.getpass()
 
-    if username == 'default':  # if no additional usermane is given, spot username is stored to be used in file paths
-        username = spot_username
-
-    s = requests.Session()
-    r = s.post(URL_authentication, {"username": spot_username, "password": spot_password})
+    s = SpotSession(username=spot_username, password=spot_password)
 
     # Convert filename to list type if only one file name is given
     if type(filename) != list:
         filename = [filename]
 
-    baseURL = "https://portal-auth.nersc.gov/als/hdf/stageifneeded/als/bl832/"
-
-    r_list = []
+    r_list = s.stage_many(filename, username=username, maxWorkers=maxWorkers)
     for i in range(len(filename)):
-        r = s.get(baseURL + useraccount + "/" + filename[i] + "/raw/" + filename[i] + ".h5")
-        print(command_string)
-        r_list.append(r.json())
+        print(filename[i], r_list[i])
 
     return r_list  # return json
 
 
+# Status values of a stage response for data that is still on tape
+StageInProgress = ("staging", "unstaged", "pending", "queued", "restoring", "offline")
+
+
+def stage_complete(r):
+    '''
+    Returns True if a stageifneeded response says the dataset is on disk
+    (the response has no in-progress status, see StageInProgress, and is
+    not an error, see stage_failed)
+    '''
+    if stage_failed(r):
+        return False
+    if isinstance(r, dict):
+        status = str(r.get("status", "")).lower()
+        return status not in StageInProgress
+    return True
+
+
+def stage_failed(r):
+    '''
+    Returns True if a stage response is an error: no response, an HTTP
+    error status (SpotSession.stage adds "status_code") or an error payload
+    '''
+    if r is None:
+        return True
+    if isinstance(r, dict):
+        return "error" in r or int(r.get("status_code", 200)) >= 400
+    return False
+
+
 # =============================================================================
 
 def NERSC_RetreiveData(filename,
                        username,
                        destinationpath,
-                       archivepath=NERSC_DefaultPath):
+                       archivepath=NERSC_DefaultPath,
+                       maxWorkers=4,
+                       verify=True):
     '''
     Downloads raw tomography projection data in NERSC from NERSC Archives
     for a list of file names
+    Files are copied concurrently (see copy_files), files already present
+    at the destination with matching size and checksum are skipped.
     '''
 
     # Convert filename to list type if only one file name is given
@@ -741,17 +1633,626 @@ def NERSC_RetreiveData(filename,
     filePathIn = []
     filePathOut = []
     for i in range(len(filename)):
-        print(archivepath, useraccount, filename[i])
-        filePathIn.append(archivepath + useraccount + "/" + filename[i] + "/raw/" + filename[i] + ".h5")
-        filePathOut.append(destinationpath + filename[i] + ".h5")
+        print(archivepath, username, filename[i])
+        filePathIn.append(archivepath + username + "/" + filename[i] + "/raw/" + filename[i] + ".h5")
+        filePathOut.append(os.path.join(destinationpath, filename[i] + ".h5"))
     logging.info("file path list complete");
     print(filePathIn)
     logging.info("destination path list complete");
     print(filePathOut)
 
     # Copy Files to desintation
-    for i in range(len(filename)):
-        logging.info("begin transfer: " + filePathIn[i])
-        os.system("cp " + filePathIn[i] + " " + filePathOut[i])
-        logging.info("transfer complete: ")
+    return copy_files(filePathIn, filePathOut, maxWorkers=maxWorkers, verify=verify)
+
+
+# =============================================================================
+
+class ScratchCache:
+    """Copies datasets ahead of use from slow storage to a fast scratch directory.
+
+    While one dataset is processed, the next prefetch datasets are copied in
+    the background. Datasets that have been released are evicted, least
+    recently used first, to keep the cache under maxBytes. Room is reserved
+    in the order datasets are requested or prefetched; prefetches that do
+    not fit yet wait until a dataset is released. Copies keep their file
+    name, in a subdirectory per source directory. Files left in cacheDir
+    by an earlier run count towards maxBytes and are evicted first, unless
+    their dataset is requested again, which reuses them. Hits (dataset
+    already copied when requested) and the read time they saved are logged.
+
+        cache = ScratchCache("/local/scratch", maxBytes=200 * 1024 ** 3)
+        for source, path in cache.batch(NERSC_RawPaths(fileList)):
+            recon(os.path.basename(path), inputPath=os.path.dirname(path) + "/")
+
+    Attributes
+        ----------
+        cacheDir : str
+            Scratch directory holding the copies.
+        maxBytes : int
+            Size limit of the cache.
+        hits : int
+            Datasets already copied when requested.
+        misses : int
+            Datasets that had to be waited for.
+        savedTime : float
+            Seconds of copying done ahead of use.
+
+    """
+
+    def __init__(self, cacheDir, maxBytes=ScratchCacheSize, prefetch=2, verify=False):
+        """Creates a scratch cache.
+
+        Parameters
+        ----------
+        cacheDir : str
+            Scratch directory holding the copies, created if needed.
+        maxBytes : int
+            Size limit of the cache.
+        prefetch : int
+            Number of datasets copied ahead of the one in use.
+        verify : bool
+            Compare checksums of source and copy (size is always checked).
+
+        """
+
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.prefetchCount = prefetch
+        self.verify = verify
+        self.entries = collections.OrderedDict()  # source: {"path", "size", "seconds", "done"}
+        self.pending = {}  # source: future of the copy
+        self.deferred = collections.OrderedDict()  # source: size, prefetches waiting for room
+        self.used = 0
+        self.reserved = 0
+        self.hits = 0
+        self.misses = 0
+        self.savedTime = 0.0
+        self.lock = threading.Lock()
+        self.executor = cf.ThreadPoolExecutor(max(1, prefetch))
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+        self._add_leftovers()
+
+    def prefetch(self, sources):
+        """Starts copying datasets to the cache in the background.
+
+        Datasets that do not fit yet are copied once released datasets make room.
+        """
+        for source in sources:
+            try:
+                size = os.path.getsize(source)
+            except OSError:
+                continue  # reported when the dataset is requested
+            with self.lock:
+                if source in self.entries or source in self.pending or source in self.deferred:
+                    continue
+                # in order: nothing is prefetched ahead of a dataset still waiting for room
+                if self.deferred or not self._submit(source, size):
+                    self.deferred[source] = size
+
+    def get(self, source):
+        """Returns the path of the cached copy of a dataset, copying it now if needed.
+
+        The source path is returned if the dataset does not fit in the cache.
+        """
+        size = os.path.getsize(source)
+        with self.lock:
+            entry = self.entries.get(source)
+            future = self.pending.get(source)
+            if entry is not None:
+                entry["done"] = False  # in use again, not evicted
+                self.entries.move_to_end(source)
+            elif future is None:
+                self.deferred.pop(source, None)
+                if self._submit(source, size):
+                    future = self.pending[source]
+        if entry is None:
+            if future is None:
+                logging.info("{} does not fit in the scratch cache, reading in place".format(source))
+                self.misses += 1
+                return source
+            ready = future.done()
+            start = time.time()
+            future.result()
+            waited = time.time() - start
+            with self.lock:
+                entry = self.entries[source]
+            if not ready:
+                self.misses += 1
+                self.savedTime += max(entry["seconds"] - waited, 0)
+                logging.info("scratch cache miss: {} (waited {:.1f} s)".format(source, waited))
+                return entry["path"]
+        self.hits += 1
+        self.savedTime += entry["seconds"]
+        logging.info("scratch cache hit: {} ({:.1f} s of reading saved)".format(source, entry["seconds"]))
+        return entry["path"]
+
+    def release(self, source):
+        """Marks a dataset as completed, its copy may be evicted from now on.
+
+        Prefetches waiting for room are started if they fit now.
+        """
+        with self.lock:
+            if source in self.entries:
+                self.entries[source]["done"] = True
+            while self.deferred:
+                source, size = next(iter(self.deferred.items()))
+                if not self._submit(source, size):
+                    break
+                del self.deferred[source]
+
+    def batch(self, sources):
+        """Yields (source, cached path) for each dataset, prefetching the following ones.
+
+        Each dataset is released when the next one is requested.
+        """
+        try:
+            for i in range(len(sources)):
+                self.prefetch(sources[i:i + 1 + self.prefetchCount])
+                path = self.get(sources[i])
+                try:
+                    yield sources[i], path
+                finally:
+                    self.release(sources[i])
+        finally:
+            self.log_stats()
+
+    def log_stats(self):
+        """Logs hit rate and read time saved."""
+        requests = self.hits + self.misses
+        logging.info("scratch cache: {} hits, {} misses ({:.0f}% hit rate), {:.1f} s of reading saved".format(
+            self.hits, self.misses, 100. * self.hits / max(requests, 1), self.savedTime))
+
+    def close(self):
+        """Waits for copies in progress, prefetches still waiting for room are dropped."""
+        with self.lock:
+            self.deferred.clear()
+        self.executor.shutdown(wait=True)
+
+    def cache_path(self, source):
+        """Path of the copy of a dataset: its file name in a subdirectory named after its source directory."""
+        sourceDir = os.path.dirname(os.path.abspath(source))
+        return os.path.join(self.cacheDir, hashlib.sha1(sourceDir.encode()).hexdigest()[:16],
+                            os.path.basename(source))
+
+    def _add_leftovers(self):
+        # copies from an earlier run are released entries under their own path, unfinished ones are removed
+        for root, dirs, names in os.walk(self.cacheDir):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".part"):
+                    os.remove(path)
+                    continue
+                size = os.path.getsize(path)
+                self.used += size
+                self.entries[path] = {"path": path, "size": size, "seconds": 0.0, "done": True}
+
+    def _submit(self, source, size):
+        # called with the lock held, starts the copy if size bytes can be reserved
+        if not self._reserve(size):
+            return False
+        # a copy left by an earlier run is now covered by the reservation, the copy reuses it if unchanged
+        leftover = self.entries.pop(self.cache_path(source), None)
+        if leftover is not None:
+            self.used -= leftover["size"]
+        self.pending[source] = self.executor.submit(self._copy, source, size)
+        return True
+
+    def _copy(self, source, size):
+        destination = self.cache_path(source)
+        start = time.time()
+        try:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            _copy_verified(source, destination, self.verify, 'md5', sameTimes=True)
+        except Exception:
+            with self.lock:
+                self.reserved -= size
+                self.pending.pop(source, None)
+            raise
+        with self.lock:
+            self.reserved -= size
+            self.used += size
+            self.entries[source] = {"path": destination, "size": size, "seconds": time.time() - start,
+                                    "done": False}
+            self.pending.pop(source, None)
+
+    def _reserve(self, size):
+        # called with the lock held, evicts released datasets, least recently used first, until size bytes fit
+        while self.used + self.reserved + size > self.maxBytes:
+            evict = [source for source, entry in self.entries.items() if entry["done"]]
+            if not evict:
+                return False
+            entry = self.entries.pop(evict[0])
+            self.used -= entry["size"]
+            if os.path.exists(entry["path"]):
+                os.remove(entry["path"])
+            logging.info("scratch cache evicted {}".format(evict[0]))
+        self.reserved += size
+        return True
+
+
+# =============================================================================
+#
+
+"""
+Functions for transferring files
+"""
+
+# =============================================================================
+DownloadBlockSize = 16 * 1024 ** 2  # bytes per HTTP range request
+DownloadBufferSize = 1024 ** 2  # bytes read from the connection at a time
+
+
+def download_file(session, url, fileLocation, params=None, connections=4, resume=True, checksum=None,
+                  blockSize=DownloadBlockSize, retries=3):
+    """Downloads a file over HTTP using parallel range requests.
+
+    The file is split into blocks that are fetched over several connections
+    and written into ``fileLocation + '.part'``. Completed blocks are recorded
+    in ``fileLocation + '.part.json'`` so an interrupted download resumes where
+    it stopped. The partial file is renamed to fileLocation once its size (and
+    checksum, if given) are verified. Falls back to a single stream if the
+    server does not support range requests.
+
+    Parameters
+    ----------
+    session : requests.Session
+        Session used for the requests (authenticated SPOT session).
+    url : str
+        Address of the file.
+    fileLocation : str
+        Path of the downloaded file.
+    params : dict
+        Query parameters of the request.
+    connections : int
+        Number of parallel connections.
+    resume : bool
+        Continue from an existing partial file of the same download.
+    checksum : tuple
+        Optional (algorithm, hexdigest), e.g. ('md5', '...'), checked after download.
+    blockSize : int
+        Bytes per range request.
+    retries : int
+        Attempts per block before giving up.
+
+    Returns
+    ------
+    fileLocation
+        Where the downloaded file is located.
+
+    """
+
+    start_time = time.time()
+    partLocation = fileLocation + ".part"
+    stateLocation = fileLocation + ".part.json"
+
+    size = None
+    if connections > 1 or resume:
+        size = remote_size(session, url, params=params)
+
+    if size is None:
+        # no range support, single stream without resume
+        r = session.get(url, params=params, stream=True)
+        r.raise_for_status()
+        with open(partLocation, "wb") as location:
+            for chunk in r.iter_content(chunk_size=DownloadBufferSize):
+                if chunk:
+                    location.write(chunk)
+        r.close()
+        expected = r.headers.get("Content-Length")
+        if expected is not None and r.headers.get("Content-Encoding") is None:
+            _check_size(partLocation, int(expected))
+    else:
+        blocks = [(start, min(start + blockSize, size) - 1) for start in range(0, size, blockSize)]
+        state = {"url": url, "params": params, "size": size, "blockSize": blockSize, "done": []}
+        if resume and os.path.exists(partLocation) and os.path.exists(stateLocation):
+            with open(stateLocation, "r") as stateFile:
+                previous = json.load(stateFile)
+            if all(previous.get(key) == state[key] for key in ("url", "params", "size", "blockSize")):
+                state["done"] = previous["done"]
+                logging.info("resuming download: {} of {} blocks done".format(len(state["done"]), len(blocks)))
+        if not state["done"]:
+            with open(partLocation, "wb") as location:
+                location.truncate(size)
+
+        done = set(state["done"])
+        todo = [i for i in range(len(blocks)) if i not in done]
+        with cf.ThreadPoolExecutor(max(1, min(connections, len(todo)))) as executor:
+            futures = [executor.submit(_download_block, session, url, params, partLocation, blocks[i], retries)
+                       for i in todo]
+            block_index = dict(zip(futures, todo))
+            try:
+                for future in cf.as_completed(futures):
+                    future.result()
+                    state["done"].append(block_index[future])
+                    with open(stateLocation, "w") as stateFile:
+                        json.dump(state, stateFile)
+            except Exception:
+                # keep the blocks done so far for resuming, stop the rest
+                for future in futures:
+                    future.cancel()
+                raise
+        _check_size(partLocation, size)
+
+    if checksum is not None:
+        digest = file_checksum(partLocation, checksum[0])
+        if digest != checksum[1].lower():
+            os.remove(partLocation)
+            if os.path.exists(stateLocation):
+                os.remove(stateLocation)
+            raise IOError("checksum mismatch for {}: {} != {}".format(fileLocation, digest, checksum[1]))
+
+    os.replace(partLocation, fileLocation)
+    if os.path.exists(stateLocation):
+        os.remove(stateLocation)
+
+    elapsed = time.time() - start_time
+    megabytes = os.path.getsize(fileLocation) / 1024. ** 2
+    logging.info("download complete: {} ({:.1f} MB in {:.1f} s, {:.1f} MB/s)".format(
+        fileLocation, megabytes, elapsed, megabytes / max(elapsed, 1e-6)))
+
+    return fileLocation
+
+
+def download_to_memory(session, url, params=None, connections=4, blockSize=DownloadBlockSize, retries=3):
+    """Downloads a file over HTTP into memory using parallel range requests.
+
+    Parameters
+    ----------
+    session : requests.Session
+        Session used for the requests (authenticated SPOT session).
+    url : str
+        Address of the file.
+    params : dict
+        Query parameters of the request.
+    connections : int
+        Number of parallel connections.
+    blockSize : int
+        Bytes per range request.
+    retries : int
+        Attempts per block before giving up.
+
+    Returns
+    ------
+    io.BytesIO
+        Contents of the file, positioned at the start.
+
+    """
+
+    start_time = time.time()
+    size = remote_size(session, url, params=params)
+
+    if size is None:
+        r = session.get(url, params=params)
+        r.raise_for_status()
+        data = io.BytesIO(r.content)
+    else:
+        data = io.BytesIO()
+        if size > 0:
+            data.seek(size - 1)
+            data.write(b"\0")  # allocate the whole buffer once, blocks are written into it in place
+        view = data.getbuffer()
+        blocks = [(start, min(start + blockSize, size) - 1) for start in range(0, size, blockSize)]
+        try:
+            with cf.ThreadPoolExecutor(max(1, min(connections, len(blocks)))) as executor:
+                futures = [executor.submit(_download_block, session, url, params, view, block, retries)
+                           for block in blocks]
+                try:
+                    for future in cf.as_completed(futures):
+                        future.result()
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            view.release()
+    data.seek(0)
+
+    elapsed = time.time() - start_time
+    megabytes = len(data.getbuffer()) / 1024. ** 2
+    logging.info("download to memory complete: {} ({:.1f} MB in {:.1f} s, {:.1f} MB/s)".format(
+        url, megabytes, elapsed, megabytes / max(elapsed, 1e-6)))
+
+    return data
+
+
+def remote_size(session, url, params=None):
+    """Size in bytes of a remote file, None if the server does not support range requests."""
+    size = None
+    r = session.get(url, params=params, headers={"Range": "bytes=0-0"}, stream=True)
+    if r.status_code == 416:  # empty file, nothing to split
+        size = 0 if r.headers.get("Content-Range", "").endswith("/0") else None
+    else:
+        r.raise_for_status()
+    if r.status_code == 206 and "/" in r.headers.get("Content-Range", ""):
+        size = int(r.headers["Content-Range"].split("/")[-1])
+    r.close()
+    return size
+
+
+def read_tiff_bytes(data):
+    """Decodes a TIFF image held in memory (bytes) into a numpy array."""
+    try:
+        from skimage.external import tifffile
+    except ImportError:  # skimage.external was removed from newer scikit-image versions
+        import tifffile
+    return tifffile.imread(io.BytesIO(data))
+
+
+def _download_block(session, url, params, target, block, retries):
+    """Fetches one byte range (inclusive start, end) into the partial file or a memoryview."""
+
+    start, end = block
+    for attempt in range(retries):
+        try:
+            r = session.get(url, params=params, headers={"Range": "bytes={}-{}".format(start, end)}, stream=True)
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise IOError("server ignored range request for bytes {}-{}".format(start, end))
+            written = _write_response(r, target, start, end)
+            r.close()
+            if written != end - start + 1:
+                raise IOError("received {} of {} bytes for bytes {}-{}".format(written, end - start + 1, start, end))
+            return written
+        except (requests.exceptions.RequestException, IOError) as e:
+            if attempt == retries - 1:
+                raise
+            logging.info("retrying bytes {}-{}: {}".format(start, end, e))
+            time.sleep(2 ** attempt)
+
+
+def _write_response(r, target, start, end):
+    # writes a range response at offset start of a file (path) or memoryview, returns bytes written
+    written = 0
+    location = open(target, "r+b") if isinstance(target, str) else None
+    try:
+        if location is not None:
+            location.seek(start)
+        for chunk in r.iter_content(chunk_size=DownloadBufferSize):
+            if not chunk:
+                continue
+            if location is not None:
+                location.write(chunk)
+            elif start + written + len(chunk) <= end + 1:
+                target[start + written:start + written + len(chunk)] = chunk
+            written += len(chunk)
+    finally:
+        if location is not None:
+            location.close()
+    return written
+
+
+def _check_size(fileLocation, size):
+    """Raises IOError if the file does not have the expected size."""
+
+    actual = os.path.getsize(fileLocation)
+    if actual != size:
+        raise IOError("{} has {} bytes, expected {}".format(fileLocation, actual, size))
+
+
+def file_checksum(fileLocation, algorithm='md5', bufferSize=DownloadBlockSize):
+    """
+    Computes the hex digest of a file with the given hashlib algorithm
+    """
+
+    h = hashlib.new(algorithm)
+    with open(fileLocation, "rb") as f:
+        for data in iter(lambda: f.read(bufferSize), b""):
+            h.update(data)
+    return h.hexdigest()
+
+
+# =============================================================================
+CopyBlockSize = 64 * 1024 ** 2  # bytes per copy system call
+
+
+def copy_files(sourceList, destinationList, maxWorkers=4, verify=True, algorithm='md5'):
+    """Copies a list of files concurrently, skipping files already present.
+
+    A file is skipped if the destination exists with the same size and
+    checksum. Otherwise it is copied to ``destination + '.part'`` with the
+    kernel's copy paths (see copy_file), verified and renamed. Aggregate
+    throughput is logged when all copies are done.
+
+    Parameters
+    ----------
+    sourceList : list
+        Paths of the files to copy.
+    destinationList : list
+        Destination paths, one per source.
+    maxWorkers : int
+        Number of files copied at the same time.
+    verify : bool
+        Compare checksums of source and copy (size is always checked).
+    algorithm : str
+        hashlib algorithm used for checksums.
+
+    Returns
+    ------
+    list
+        'copied' or 'skipped' for each file.
+
+    """
+
+    if len(sourceList) != len(destinationList):
+        raise ValueError("need one destination per source file")
+
+    start_time = time.time()
+    with cf.ThreadPoolExecutor(max(1, min(maxWorkers, len(sourceList)))) as executor:
+        status = list(executor.map(lambda paths: _copy_verified(paths[0], paths[1], verify, algorithm),
+                                   zip(sourceList, destinationList)))
+
+    elapsed = time.time() - start_time
+    copied = [i for i in range(len(status)) if status[i] == 'copied']
+    megabytes = sum(os.path.getsize(destinationList[i]) for i in copied) / 1024. ** 2
+    logging.info("copied {} files ({:.1f} MB in {:.1f} s, {:.1f} MB/s), skipped {}".format(
+        len(copied), megabytes, elapsed, megabytes / max(elapsed, 1e-6), len(status) - len(copied)))
+    return status
+
+
+def _copy_verified(source, destination, verify, algorithm, sameTimes=False):
+    """Copies one file unless an identical copy exists, returns 'copied' or 'skipped'.
+
+    Copies get the modification time of their source. With sameTimes, an
+    existing copy of the same size and modification time is taken as
+    identical without reading the source to compare checksums.
+    """
+
+    stat = os.stat(source)
+    size = stat.st_size
+    if os.path.exists(destination) and os.path.getsize(destination) == size:
+        if (sameTimes and os.stat(destination).st_mtime_ns == stat.st_mtime_ns) or \
+                file_checksum(source, algorithm) == file_checksum(destination, algorithm):
+            logging.info("already present: " + destination)
+            return 'skipped'
+
+    logging.info("begin transfer: " + source)
+    partLocation = destination + ".part"
+    copy_file(source, partLocation)
+    _check_size(partLocation, size)
+    if verify and file_checksum(source, algorithm) != file_checksum(partLocation, algorithm):
+        os.remove(partLocation)
+        raise IOError("checksum mismatch copying {} to {}".format(source, destination))
+    os.utime(partLocation, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(partLocation, destination)
+    logging.info("transfer complete: " + destination)
+    return 'copied'
+
+
+def copy_file(source, destination, blockSize=CopyBlockSize):
+    """
+    Copies a file using the kernel's copy paths: copy_file_range (data is
+    not copied through user space, and file systems can copy server side),
+    then sendfile, then a buffered copy where those are not available
+    """
 
+    size = os.path.getsize(source)
+    with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        offset = 0
+        for kernel_copy in (_copy_file_range, _sendfile):
+            try:
+                while offset < size:
+                    n = kernel_copy(infd, outfd, offset, min(blockSize, size - offset))
+                    if n == 0:
+                        break
+                    offset += n
+                return offset
+            except (OSError, AttributeError) as e:
+                # not supported for these files, try the next method from where this one stopped
+                if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                                              errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF):
+                    raise
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        shutil.copyfileobj(fsrc, fdst, blockSize)
+    return size
+
+
+def _copy_file_range(infd, outfd, offset, count):
+    return os.copy_file_range(infd, outfd, count, offset, offset)
+
+
+def _sendfile(infd, outfd, offset, count):
+    os.lseek(outfd, offset, os.SEEK_SET)
+    return os.sendfile(outfd, infd, offset, count)
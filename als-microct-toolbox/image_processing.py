@@ -2,13 +2,24 @@
 import glob
 import numpy as np
 import os
+import re
+import json
+import time
+import threading
+import collections
+import concurrent.futures as cf
+import h5py
 from skimage import io
-import skimage.external.tifffile as skTiff
+try:
+    import skimage.external.tifffile as skTiff
+except ImportError: # skimage.external was removed in scikit-image 0.17, use the standalone package
+    import tifffile as skTiff
 import numexpr as ne # routines for the fast evaluation of array expressions elementwise by using a vector-based virtual machine
 # =============================================================================
 
 # -----------------------------------------------------------------------------
-# generates list of all files in a directory with the desired extension
+# generates list of all files in a directory with the desired extension,
+# in natural order (image_2 before image_10)
 def get_fileList(filepath='./', extensions=("tif","tiff")):
     filepath = filepath.rstrip('/')
     fileList=[]
@@ -16,11 +27,164 @@ def get_fileList(filepath='./', extensions=("tif","tiff")):
         searchterm = filepath+'/*.'+extensions[iExt]
         files = glob.glob(searchterm)
         fileList.extend(files)
+    fileList.sort(key=natural_sort_key)
     return(fileList)
 
+# -----------------------------------------------------------------------------
+# sort key comparing the numbers in strings by value
+def natural_sort_key(text):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', text)]
+
+# -----------------------------------------------------------------------------
+# reads a single image, tifffile for .tif files (faster, thread safe), skimage otherwise
+# calibrated: images written by write_EncodedStack (uint16 or float16) are returned as float32 physical values
+def read_Image(filepath,calibrated=True):
+    if filepath.lower().endswith(('.tif', '.tiff')):
+        with skTiff.TiffFile(filepath) as tif:
+            image = tif.asarray()
+            if calibrated:
+                image = apply_Calibration(image, get_Calibration(tif.pages[0]))
+        return image
+    return io.imread(filepath)
+
+# -----------------------------------------------------------------------------
+# calibration (dict with scale and offset: value = stored*scale + offset) stored by write_EncodedStack
+# in the description of a tiff page, None for other images
+def get_Calibration(page):
+    try:
+        calibration = json.loads(page.description)['calibration']
+        return {'scale': float(calibration['scale']), 'offset': float(calibration['offset'])}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+# -----------------------------------------------------------------------------
+# converts stored values to float32 physical values with a calibration from get_Calibration
+def apply_Calibration(image,calibration):
+    if calibration is None:
+        return image
+    image = image.astype(np.float32)
+    if calibration['scale'] != 1 or calibration['offset'] != 0:
+        scale, offset = np.float32(calibration['scale']), np.float32(calibration['offset'])
+        ne.evaluate('image*scale+offset', out=image)
+    return image
+
+# -----------------------------------------------------------------------------
+# reads rows xRange and columns yRange of an image
+# for tiff files only the data overlapping the region is read: uncompressed images are memory mapped,
+# compressed images decode only the strips or tiles that overlap the region
+# images written by write_EncodedStack are returned as float32 physical values
+def read_Region(filepath,xRange=(0,None),yRange=(0,None)):
+    if not filepath.lower().endswith(('.tif', '.tiff')):
+        return io.imread(filepath)[xRange[0]:xRange[1],yRange[0]:yRange[1]]
+    with skTiff.TiffFile(filepath) as tif:
+        page = tif.pages[0]
+        return apply_Calibration(read_PageRegion(tif,page,xRange,yRange), get_Calibration(page))
+
+# -----------------------------------------------------------------------------
+# stored values of rows xRange and columns yRange of a page of an open tifffile.TiffFile (see read_Region)
+def read_PageRegion(tif,page,xRange=(0,None),yRange=(0,None)):
+    if len(page.shape) != 2 or not hasattr(page, 'decode') or not hasattr(page, 'dataoffsets'):
+        # older tifffile or multi-sample image: decode the whole image
+        return page.asarray()[xRange[0]:xRange[1],yRange[0]:yRange[1]]
+    rows, cols = page.shape
+    x0, x1, _ = slice(xRange[0], xRange[1]).indices(rows)
+    y0, y1, _ = slice(yRange[0], yRange[1]).indices(cols)
+    x1, y1 = max(x0, x1), max(y0, y1)
+
+    if getattr(page, 'is_memmappable', False):
+        data = np.memmap(tif.filehandle.path, dtype=np.dtype(tif.byteorder + page.dtype.char), mode='r', offset=page.dataoffsets[0], shape=(rows, cols))
+        return data[x0:x1,y0:y1].astype(page.dtype)
+
+    if page.is_tiled:
+        segmentRows, segmentCols = page.tilelength, page.tilewidth
+    else:
+        segmentRows, segmentCols = min(page.rowsperstrip, rows), cols
+    segmentsPerRow = (cols + segmentCols - 1)//segmentCols
+    region = np.empty((x1-x0, y1-y0), dtype=page.dtype)
+    if region.size == 0:
+        return region
+    for segmentRow in range(x0//segmentRows, (x1-1)//segmentRows+1):
+        for segmentCol in range(y0//segmentCols, (y1-1)//segmentCols+1):
+            index = segmentRow*segmentsPerRow + segmentCol
+            tif.filehandle.seek(page.dataoffsets[index])
+            segment = page.decode(tif.filehandle.read(page.databytecounts[index]), index,
+                                  jpegtables=page.jpegtables)[0][0,:,:,0] # (planes, rows, cols, samples)
+            top, left = segmentRow*segmentRows, segmentCol*segmentCols
+            r0, r1 = max(x0, top), min(x1, top+segment.shape[0], rows)
+            c0, c1 = max(y0, left), min(y1, left+segment.shape[1], cols)
+            region[r0-x0:r1-x0,c0-y0:c1-y0] = segment[r0-top:r1-top,c0-left:c1-left]
+    return region
+
+# -----------------------------------------------------------------------------
+# writes a single image, tifffile for .tif files, skimage otherwise
+# description: text stored in the tiff ImageDescription tag instead of tifffile's shape metadata
+def write_Image(filepath,image,description=None):
+    if filepath.lower().endswith(('.tif', '.tiff')):
+        options = {} if description is None else {'description': description, 'metadata': None}
+        if hasattr(skTiff, 'imwrite'):
+            skTiff.imwrite(filepath,image,**options)
+        else:
+            skTiff.imsave(filepath,image,**options)
+    else:
+        io.imsave(filepath,image)
+
+# -----------------------------------------------------------------------------
+# compact encodings of float data, returns (encoded array, calibration)
+# 'uint16': data_min..data_max mapped linearly to 0..65535 (clipped), 'float16': half precision
+# the calibration (value = stored*scale + offset, unit) is what write_EncodedStack stores with the image
+def encode_Array(inputarray,outputType='uint16',data_min=-10.0,data_max=30.0,unit=None):
+    if outputType == 'float16':
+        encoded = inputarray.astype(np.float16)
+        calibration = {'encoding': 'float16', 'scale': 1.0, 'offset': 0.0}
+    elif outputType == 'uint16':
+        rec = inputarray.astype(np.float32,copy=False)
+        scale = (float(data_max)-float(data_min))/65535
+        mn = np.float32(data_min)
+        sc = np.float32(1/scale)
+        scl = '(0.5+(rec-mn)*sc)'
+        buffer = ne.evaluate('where({0}<0,0,where({0}>65535,65535,{0}))'.format(scl))
+        encoded = buffer.astype(np.uint16)
+        calibration = {'encoding': 'uint16', 'scale': scale, 'offset': float(data_min)}
+    else:
+        raise ValueError("outputType must be 'uint16' or 'float16', not {}".format(outputType))
+    if unit is not None:
+        calibration['unit'] = unit
+    return encoded, calibration
+
+# -----------------------------------------------------------------------------
+# writes the slices of stack encoded by encode_Array as fname_00000.tiff, ... (numbered from start,
+# as dxchange.write_tiff_stack), with the calibration in the description of each file so read_Image,
+# load_DataStack, TiffVolume and read_Region return physical values; maxWorkers slices are encoded and
+# written at the same time
+def write_EncodedStack(stack,fname,start=0,outputType='uint16',data_min=-10.0,data_max=30.0,unit=None,maxWorkers=8):
+    outputPath = os.path.dirname(fname)
+    if outputPath and not os.path.exists(outputPath):
+        try:
+            os.makedirs(outputPath)
+        except OSError: # created by another process in the meantime
+            pass
+
+    def write(iImage):
+        encoded, calibration = encode_Array(stack[iImage],outputType,data_min,data_max,unit)
+        write_Image(fname + '_' + '{:05d}'.format(start+iImage) + '.tiff', encoded,
+                    description=json.dumps({'calibration': calibration}))
+
+    process_Images(write, range(len(stack)), maxWorkers=maxWorkers)
+
+# -----------------------------------------------------------------------------
+# appends one page to an open tifffile.TiffWriter (save() in older tifffile versions)
+def write_Page(tif,image):
+    if hasattr(tif, 'write'):
+        tif.write(image, contiguous=True)
+    else:
+        tif.save(image)
+
 # -----------------------------------------------------------------------------
 # loads images in directory into a numpy array
-def load_DataStack(filepath='./',imagerange='all'):
+# the array keeps the data type of the images; images are read by maxWorkers threads
+# out: fill this array (shape (images, rows, cols)) instead of allocating one
+# memmap: allocate the array as a memory mapped .npy file at this path (np.load(memmap, mmap_mode='r') to reopen)
+def load_DataStack(filepath='./',imagerange='all',out=None,memmap=None,maxWorkers=8):
     #Imports Tomography Dataset
     fileList = get_fileList(filepath)
 
@@ -31,20 +195,34 @@ def load_DataStack(filepath='./',imagerange='all'):
         imageMin = imagerange[0]
         imageMax = imagerange[1]
 
-    image = io.imread(fileList[0])
-    rows,cols = image.shape
+    image = read_Image(fileList[imageMin])
+    shape = (imageMax-imageMin,) + image.shape
+
+    if out is not None:
+        if out.shape != shape:
+            raise ValueError("out has shape {}, images need {}".format(out.shape, shape))
+        dataset = out
+    elif memmap is not None:
+        dataset = np.lib.format.open_memmap(memmap, mode='w+', dtype=image.dtype, shape=shape)
+    else:
+        dataset = np.empty(shape, dtype=image.dtype)
+    dataset[0] = image
 
-    dataset = np.zeros((imageMax-imageMin,rows, cols))
+    def read_into(iImage):
+        dataset[iImage-imageMin] = read_Image(fileList[iImage])
 
-    for iImage in range(imageMin,imageMax):
-        dataset[iImage-imageMin,:,:] = io.imread(fileList[iImage])
-        print(iImage)
-    return dataset    
+    with cf.ThreadPoolExecutor(max(1, maxWorkers)) as executor:
+        list(executor.map(read_into, range(imageMin+1,imageMax)))
+    return dataset
 
 # -----------------------------------------------------------------------------
 
-def convert_DirectoryTo8Bit(inputpath='./', data_min=-10.0, data_max=10.0, outputpath=None,filename=None):
+# converts images in a directory to 8 bit (see convert_ArrayTo8bit) and saves them in outputpath
+# maxWorkers threads each read, convert and write one image at a time, so disk reads, conversion and writes overlap
+# stack: write a single multi-page tiff outputpath/filename.tiff instead of one file per image
+def convert_DirectoryTo8Bit(inputpath='./', data_min=-10.0, data_max=10.0, outputpath=None,filename=None,maxWorkers=8,stack=False):
 
+    start_time = time.time()
     fileList= get_fileList(inputpath)
 
     # Strip file extension, etc from first filename in list
@@ -61,42 +239,76 @@ def convert_DirectoryTo8Bit(inputpath='./', data_min=-10.0, data_max=10.0, outpu
     if not os.path.exists(outputpath):
         os.makedirs(outputpath)
 
-    for iImage in range(len(fileList)):
-        image32 = io.imread(fileList[iImage])
-        image8 = convert_ArrayTo8bit(image32,data_min,data_max)
+    buffers = threading.local() # conversion buffers, reused by each thread for all of its images
+
+    def convert(iImage):
+        image32 = read_Image(fileList[iImage])
+        if getattr(buffers, 'shape', None) != image32.shape:
+            buffers.shape = image32.shape
+            buffers.scaled = np.empty(image32.shape, dtype=np.float32)
+            buffers.image8 = np.empty(image32.shape, dtype=np.uint8)
+        image8 = convert_ArrayTo8bit(image32,data_min,data_max,out=None if stack else buffers.image8,buffer=buffers.scaled)
+        if stack:
+            return image8
         outputfilepath = outputpath.rstrip('/')+'/'+filename + '_' + '{:04d}'.format(iImage) + '.tiff'
-        io.imsave(outputfilepath,image8)
-        print(outputfilepath)
-        #print(iImage)
+        write_Image(outputfilepath,image8)
+
+    stackpath = outputpath.rstrip('/')+'/'+filename + '.tiff' if stack else None
+    process_Images(convert, range(len(fileList)), maxWorkers=maxWorkers, stackpath=stackpath)
 
-    print("conversion complete")
+    elapsed = time.time() - start_time
+    print("conversion complete: {} images in {:.1f} s ({:.1f} images/s)".format(len(fileList), elapsed, len(fileList)/max(elapsed, 1e-6)))
 
 # -----------------------------------------------------------------------------
+# calls func(index) for each index with maxWorkers threads
+# stackpath: func returns an image, the images are written in order as pages of one tiff file;
+# at most 2*maxWorkers images wait in memory to be written
+def process_Images(func, indices, maxWorkers=8, stackpath=None):
+    with cf.ThreadPoolExecutor(max(1, maxWorkers)) as executor:
+        if stackpath is None:
+            list(executor.map(func, indices))
+            return
+        with skTiff.TiffWriter(stackpath, bigtiff=True) as tif:
+            pending = collections.deque()
+            for index in indices:
+                pending.append(executor.submit(func, index))
+                if len(pending) >= 2*maxWorkers:
+                    write_Page(tif, pending.popleft().result())
+            while pending:
+                write_Page(tif, pending.popleft().result())
 
-def convert_ArrayTo8bit(inputarray,data_min,data_max):
+# -----------------------------------------------------------------------------
+# linear rescale of data_min..data_max to 0..255, clipped, cast to 8 bit
+# the scaling and clipping are a single numexpr pass; out (uint8) and buffer (float32) can be passed in to be reused
+# a TiffVolume is converted one slice at a time
+def convert_ArrayTo8bit(inputarray,data_min,data_max,out=None,buffer=None):
+    if isinstance(inputarray, TiffVolume):
+        if out is None:
+            out = np.empty(inputarray.shape, dtype=np.uint8)
+        for iImage in range(len(inputarray)):
+            convert_ArrayTo8bit(inputarray[iImage],data_min,data_max,out=out[iImage],buffer=buffer)
+        return out
     rec = inputarray.astype(np.float32,copy=False)
     df = np.float32(data_max-data_min)
     mn = np.float32(data_min)
-    scl = ne.evaluate('0.5+255*(rec-mn)/df',truediv=True)
-    ne.evaluate('where(scl<0,0,scl)',out=scl)
-    ne.evaluate('where(scl>255,255,scl)',out=scl)
-    return scl.astype(np.uint8)
+    scl = '(0.5+255*(rec-mn)/df)'
+    if buffer is None:
+        buffer = np.empty(rec.shape, dtype=np.float32)
+    ne.evaluate('where({0}<0,0,where({0}>255,255,{0}))'.format(scl),truediv=True,out=buffer,casting='unsafe')
+    if out is None:
+        out = np.empty(rec.shape, dtype=np.uint8)
+    np.copyto(out, buffer, casting='unsafe')
+    return out
 
 # -----------------------------------------------------------------------------
-
-def crop_Directory(inputpath='./',xRange=(0,None),yRange=(0,None),zRange=(0,None),outputpath=None):
+# crops images in a directory to xRange (rows), yRange (columns) and zRange (images, in natural file name order)
+# only images in zRange are opened, and only the strips/tiles of each image overlapping the crop are read (see read_Region)
+# maxWorkers images are cropped at the same time; stack: write a single multi-page tiff outputpath/filename.tiff
+# a range end of None means up to the end of that axis
+def crop_Directory(inputpath='./',xRange=(0,None),yRange=(0,None),zRange=(0,None),outputpath=None,filename=None,maxWorkers=8,stack=False):
 
     fileList= get_fileList(inputpath)
-
-    image = io.imread(fileList[0])
-
-    # if no input give set range to maximum
-    if xRange[1] == None:
-        xRange[1] = len(image[:,0])
-    if yRange[1] == None:
-        yRange[1] = len(image[0,:])
-    if zRange[1] == None:
-        zRange[1] = len(fileList)
+    zStart, zEnd, _ = slice(zRange[0], zRange[1]).indices(len(fileList))
 
     # Strip file extension, etc from first filename in list
     if filename == None:
@@ -107,55 +319,527 @@ def crop_Directory(inputpath='./',xRange=(0,None),yRange=(0,None),zRange=(0,None
 
     # Autogenerate output path
     if outputpath == None:
-        outputpath = inputpath.rstrip('/') + "_croppped/"
+        outputpath = inputpath.rstrip('/') + "_cropped/"
 
     # create output directory if it does not exist
     if not os.path.exists(outputpath):
         os.makedirs(outputpath)
 
     # crop and save images
-    for iImage in range(zRange[0],zRange[1]):
-        image = io.imread(fileList[iImage])
-        image_cropped = image[xRange[0]:xRange[1],yRange[0]:yRange[1]]
+    def crop(iImage):
+        image_cropped = read_Region(fileList[iImage],xRange,yRange)
+        if stack:
+            return image_cropped
         outputfilepath = outputpath.rstrip('/')+'/'+filename + '_' + '{:04d}'.format(iImage) + '.tiff'
-        io.imsave(outputfilepath,image_cropped)
-        print(outputfilepath)
-        #print(iImage)
+        write_Image(outputfilepath,image_cropped)
+
+    stackpath = outputpath.rstrip('/')+'/'+filename + '.tiff' if stack else None
+    process_Images(crop, range(zStart,zEnd), maxWorkers=maxWorkers, stackpath=stackpath)
+    print("crop complete: {} images to {}".format(max(zEnd-zStart,0), outputpath))
+
 # -----------------------------------------------------------------------------
 
+# crops a 2D image (x,y) or a 3D stack (z,x,y) as returned by load_DataStack; inputarray can be a TiffVolume,
+# then only the cropped region is read. A range end of None means up to the end of that axis
 def crop_Array(inputarray,xRange=(0,None),yRange=(0,None),zRange=(0,None)):
 
-    # if no input give set range to maximum
-    if xRange[1] == None:
-        xRange[1] = len(image[:,0])
-    if yRange[1] == None:
-        yRange[1] = len(image[0,:])
-    if inputarray.ndim==3 and zRange[1] == None:
-        zRange[1] = len(image[0,0,:])
-
     if inputarray.ndim == 2:
-        outputarray = image[xRange[0]:xRange[1],yRange[0]:yRange[1]]
+        outputarray = inputarray[xRange[0]:xRange[1],yRange[0]:yRange[1]]
     if inputarray.ndim == 3:
-        outputarray = image[xRange[0]:xRange[1],yRange[0]:yRange[1],zRange[0]:zRange[1]]
+        outputarray = inputarray[zRange[0]:zRange[1],xRange[0]:xRange[1],yRange[0]:yRange[1]]
+    return outputarray
 
 # -----------------------------------------------------------------------------
+# writes images one page at a time to a single BigTIFF file, so only one image is in memory at a time
+# images: any iterable of 2D images (3D array, memory map, TiffVolume, generator)
+def write_TiffStack(images,outputFile):
+    count = 0
+    with skTiff.TiffWriter(outputFile, bigtiff=True) as tif:
+        for image in images:
+            write_Page(tif, np.asarray(image))
+            count += 1
+    return count
 
+# -----------------------------------------------------------------------------
+# saves a 2D image or a stack of images (see write_TiffStack) as outputPath/filename.tiff
 def save_TiffStack(dataset,filename="image",outputPath="./"):
-    filename = filename.rstrip(".tiff")
-    filename = filename.rstrip(".tif")
-    outputFile = outputPath + filename + ".tiff"
+    for extension in (".tiff", ".tif"):
+        if filename.endswith(extension):
+            filename = filename[:-len(extension)]
+    outputFile = outputPath.rstrip('/') + '/' + filename + ".tiff"
     print("saving ... : " + outputFile)
-    skTiff.imsave(outputFile,dataset)
+    if getattr(dataset, 'ndim', None) == 2:
+        dataset = [dataset]
+    write_TiffStack(dataset,outputFile)
     print("save complete: " + outputFile)
 
+# -----------------------------------------------------------------------------
+# writes the images of a directory, in natural file name order, as pages of one BigTIFF file
+# (default: the directory name + ".tiff"); images are read by maxWorkers threads and written in order,
+# at most 2*maxWorkers images are in memory
+def convert_DirectoryToTiffStack(filepath='./',outputFile=None,maxWorkers=8):
+    fileList = get_fileList(filepath)
+    if outputFile == None:
+        outputFile = filepath.rstrip('/') + ".tiff"
+    print("saving ... : " + outputFile)
+    process_Images(lambda iImage: read_Image(fileList[iImage]), range(len(fileList)),
+                   maxWorkers=maxWorkers, stackpath=outputFile)
+    print("save complete: {} images to {}".format(len(fileList), outputFile))
 
 # -----------------------------------------------------------------------------
+# writes each image of a 3D array (or memory map, TiffVolume, multi-page tiff opened with
+# tifffile.memmap) to outputPath/filename_0000.tiff, ...; maxWorkers threads each read and write
+# one image at a time, so a memory map is never loaded at once
+def convert_ArrayToDirectory(dataset,filename="image",outputPath="./",maxWorkers=8):
+    if not os.path.exists(outputPath):
+        os.makedirs(outputPath)
 
-def convert_DirectoryToTiffStack(filepath='./'):
-    pass
+    def write(iImage):
+        outputfilepath = outputPath.rstrip('/')+'/'+filename + '_' + '{:04d}'.format(iImage) + '.tiff'
+        write_Image(outputfilepath,np.asarray(dataset[iImage]))
+
+    process_Images(write, range(len(dataset)), maxWorkers=maxWorkers)
+    print("save complete: {} images to {}".format(len(dataset), outputPath))
+
+
+# -----------------------------------------------------------------------------
+# Lazy view of a directory of slices as a 3D (z,y,x) array. Indexing reads only the slices it needs
+# (missing slices are read by maxWorkers threads) and keeps decoded slices in an LRU cache of at most
+# cacheSize bytes, so reconstructions larger than memory can be analyzed a piece at a time:
+#   volume = TiffVolume('rec20160610_150949_sample/', cacheSize=2*1024**3)
+#   region = volume[100:200, 500:800, ::2]
+#   image8 = convert_ArrayTo8bit(volume[1000], -10, 10)
+class TiffVolume(object):
+
+    def __init__(self, filepath='./', cacheSize=1024**3, maxWorkers=8, fileList=None):
+        self.fileList = get_fileList(filepath) if fileList is None else list(fileList)
+        if not self.fileList:
+            raise IOError("no images found in {}".format(filepath))
+        self.cacheSize = cacheSize
+        self.maxWorkers = maxWorkers
+        self.cache = collections.OrderedDict() # slice index: image
+        self.cacheBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        image = read_Image(self.fileList[0])
+        self.shape = (len(self.fileList),) + image.shape
+        self.dtype = image.dtype
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self.nbytes = self.size * self.dtype.itemsize
+        self._cache_put(0, image)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return "TiffVolume(shape={}, dtype={}, {} cached slices)".format(self.shape, self.dtype, len(self.cache))
+
+    def __iter__(self):
+        for iImage in range(len(self)):
+            yield self[iImage]
+
+    def __array__(self, dtype=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+    def astype(self, dtype, copy=True):
+        return self[:].astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i+1:]
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for TiffVolume")
+        region = key[1:]
+
+        if isinstance(key[0], (int, np.integer)):
+            iImage = int(key[0])
+            if iImage < 0:
+                iImage += len(self)
+            if not 0 <= iImage < len(self):
+                raise IndexError("slice {} out of range for {} slices".format(key[0], len(self)))
+            return self._read_slices([iImage])[iImage][region]
+
+        indices = np.arange(len(self))[key[0]]
+        images = self._read_slices(indices)
+        # shape of the region of one slice, computed without reading anything
+        regionShape = np.broadcast_to(np.zeros((), dtype=self.dtype), self.shape[1:])[region].shape
+        out = np.empty((len(indices),) + regionShape, dtype=self.dtype)
+        for i, iImage in enumerate(indices):
+            out[i] = images[iImage][region]
+        return out
+
+    # reads the slices, cached ones from the cache and the rest with a thread pool; returns {index: image}
+    def _read_slices(self, indices):
+        images = {}
+        missing = []
+        with self.lock:
+            for iImage in indices:
+                iImage = int(iImage)
+                if iImage in self.cache:
+                    self.cache.move_to_end(iImage)
+                    images[iImage] = self.cache[iImage]
+                    self.hits += 1
+                elif iImage not in missing:
+                    missing.append(iImage)
+            self.misses += len(missing)
+        if len(missing) == 1:
+            images[missing[0]] = read_Image(self.fileList[missing[0]])
+        elif missing:
+            with cf.ThreadPoolExecutor(max(1, min(self.maxWorkers, len(missing)))) as executor:
+                for iImage, image in zip(missing, executor.map(lambda i: read_Image(self.fileList[i]), missing)):
+                    images[iImage] = image
+        for iImage in missing:
+            self._cache_put(iImage, images[iImage])
+        return images
+
+    def _cache_put(self, iImage, image):
+        if image.nbytes > self.cacheSize:
+            return
+        with self.lock:
+            if iImage in self.cache:
+                return
+            image.setflags(write=False) # slices are handed out as views, keep the cached copy intact
+            self.cache[iImage] = image
+            self.cacheBytes += image.nbytes
+            while self.cacheBytes > self.cacheSize:
+                evicted, evictedImage = self.cache.popitem(last=False)
+                self.cacheBytes -= evictedImage.nbytes
+
+    # empties the slice cache
+    def clear_cache(self):
+        with self.lock:
+            self.cache.clear()
+            self.cacheBytes = 0
+
+
+# -----------------------------------------------------------------------------
+# Builds 2x, 4x, 8x, ... block averaged copies of a volume in one pass over its slabs (z,y,x), as
+# datasets "level1", "level2", ... of a chunked HDF5 file. Slabs are added in z order, in any size, and
+# are averaged and written by a background thread, so building overlaps reading or reconstructing the
+# next slab; at most queueSize slabs wait in memory (add() blocks when the builder falls behind).
+# Odd sizes are padded by repeating the last slice, row or column. Added slabs must not be modified.
+#   with PyramidBuilder('rec_pyramid.h5') as pyramid:
+#       for slab in slabs:
+#           pyramid.add(slab)
+#   preview = h5py.File('rec_pyramid.h5', 'r')['level3'][...]
+class PyramidBuilder(object):
+
+    def __init__(self, outputFile, levels=3, queueSize=2, chunkSize=64, start=0):
+        self.outputFile = outputFile
+        self.levels = levels
+        self.chunkSize = chunkSize
+        self.h5 = h5py.File(outputFile, 'w')
+        self.h5.attrs['start'] = start # z index of the first slice added
+        self.carry = [None] * (levels + 1) # unpaired last slice of each level
+        self.dtype = None
+        self.slices = 0
+        self.error = None
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.queueSize = queueSize
+        self.thread = threading.Thread(target=self._run, name='PyramidBuilder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # queues the next slab (z,y,x) or single slice (y,x)
+    def add(self, slab):
+        slab = np.asarray(slab)
+        if slab.ndim == 2:
+            slab = slab[np.newaxis]
+        with self.condition:
+            while len(self.queue) >= self.queueSize and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+            self.queue.append(slab)
+            self.condition.notify_all()
+
+    # averages the remaining slices, closes the file and returns the shapes of the levels
+    def close(self):
+        if self.thread is not None:
+            with self.condition:
+                self.queue.append(None)
+                self.condition.notify_all()
+            self.thread.join()
+            self.thread = None
+            self.h5.close()
+        if self.error is not None:
+            raise self.error
+        with h5py.File(self.outputFile, 'r') as h5:
+            return [h5['level{}'.format(level)].shape for level in range(1, self.levels+1) if 'level{}'.format(level) in h5]
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                slab = self.queue.popleft()
+                self.condition.notify_all()
+            if slab is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if self.dtype is None:
+                    self.dtype = slab.dtype
+                self.slices += len(slab)
+                self._reduce(slab.astype(np.float32), 1)
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+        if self.error is None:
+            try:
+                # an unpaired last slice is averaged with itself
+                for level in range(1, self.levels+1):
+                    carry, self.carry[level] = self.carry[level], None
+                    if carry is not None:
+                        self._reduce(np.concatenate([carry, carry]), level)
+                self.h5.attrs['slices'] = self.slices
+            except Exception as e:
+                self.error = e
+
+    # averages pairs of slices of data (float32) into the next level and passes the result on
+    def _reduce(self, data, level):
+        if self.carry[level] is not None:
+            data = np.concatenate([self.carry[level], data])
+            self.carry[level] = None
+        if len(data) % 2:
+            self.carry[level] = data[-1:].copy()
+            data = data[:-1]
+        if len(data) == 0:
+            return
+        pad = [(0, 0), (0, data.shape[1] % 2), (0, data.shape[2] % 2)]
+        if pad[1][1] or pad[2][1]:
+            data = np.pad(data, pad, mode='edge')
+        z, y, x = data.shape
+        reduced = data.reshape(z//2, 2, y//2, 2, x//2, 2).mean(axis=(1, 3, 5), dtype=np.float32)
+        self._write(reduced, level)
+        if level < self.levels:
+            self._reduce(reduced, level+1)
+
+    def _write(self, reduced, level):
+        name = 'level{}'.format(level)
+        if name not in self.h5:
+            chunks = (min(self.chunkSize, reduced.shape[0]),) + tuple(min(self.chunkSize*4, n) for n in reduced.shape[1:])
+            dataset = self.h5.create_dataset(name, shape=(0,) + reduced.shape[1:], maxshape=(None,) + reduced.shape[1:],
+                                             dtype=self.dtype, chunks=chunks)
+            dataset.attrs['factor'] = 2**level
+        dataset = self.h5[name]
+        if np.issubdtype(self.dtype, np.integer):
+            reduced = np.rint(reduced)
+        z = dataset.shape[0]
+        dataset.resize(z + len(reduced), axis=0)
+        dataset[z:] = reduced.astype(self.dtype)
+
+
+# -----------------------------------------------------------------------------
+# builds the pyramid (see PyramidBuilder) of a directory of slices, default output inputpath + "_pyramid.h5"
+# slabs of slabSize slices are read by maxWorkers threads while the previous slab is averaged
+def build_Pyramid(inputpath='./',outputFile=None,levels=3,slabSize=16,maxWorkers=8):
+    if outputFile == None:
+        outputFile = inputpath.rstrip('/') + "_pyramid.h5"
+    volume = TiffVolume(inputpath, cacheSize=0, maxWorkers=maxWorkers)
+    slabSize = max(slabSize, 2**levels)
+    with PyramidBuilder(outputFile, levels=levels) as pyramid:
+        for z in range(0, len(volume), slabSize):
+            pyramid.add(volume[z:z+slabSize])
+    print("pyramid complete: {}".format(outputFile))
+    return outputFile
 
 
 # -----------------------------------------------------------------------------
-def convert_ArrayToDirectory(dataset,filename="image",outputPath="./"):
-    pass
+# Min, max, mean, variance, histogram and percentiles of a volume, accumulated one slab at a time.
+# update() is thread safe; partial results of separate threads, processes or MPI ranks combine
+# with merge() (or reduce_MPI) to the counts of a single pass, as long as they use the same bins and
+# histRange. Values outside histRange are only counted (underflow, overflow); NaN and inf are skipped.
+# histRange defaults to the full range of integer data, and must be given for float data:
+#   stats = VolumeStats(bins=1000, histRange=(-10, 30))
+#   for slab in slabs:
+#       stats.update(slab)
+#   print(stats.mean, stats.std, stats.percentile([1, 99]))
+class VolumeStats(object):
+
+    def __init__(self, bins=1024, histRange=None):
+        self.bins = bins
+        self.histRange = None if histRange is None else (float(histRange[0]), float(histRange[1]))
+        self.histogram = None
+        self.underflow = 0
+        self.overflow = 0
+        self.count = 0
+        self.skipped = 0 # NaN and inf values
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared differences from the mean
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "VolumeStats(count={}, min={}, max={}, mean={}, std={})".format(self.count, self.min, self.max, self.mean, self.std)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def binEdges(self):
+        return np.linspace(self.histRange[0], self.histRange[1], self.bins + 1)
+
+    # adds the values of an array (a slab, a slice or a reconstructed chunk)
+    def update(self, data):
+        data = np.asarray(data)
+        if self.histRange is None:
+            if not np.issubdtype(data.dtype, np.integer):
+                raise ValueError("VolumeStats needs a histRange for {} data".format(data.dtype))
+            info = np.iinfo(data.dtype)
+            with self.lock:
+                if self.histRange is None:
+                    self.bins = min(self.bins, int(info.max) - int(info.min) + 1)
+                    self.histRange = (float(info.min), float(info.max) + 1)
+        partial = VolumeStats(self.bins, self.histRange)
+        partial._add(data)
+        self.merge(partial)
+        return self
+
+    def _add(self, data):
+        data = data.ravel()
+        if not np.issubdtype(data.dtype, np.integer):
+            finite = np.isfinite(data)
+            if not finite.all():
+                self.skipped = int(data.size - np.count_nonzero(finite))
+                data = data[finite]
+        self.count = int(data.size)
+        self.histogram = np.zeros(self.bins, dtype=np.int64)
+        if self.count == 0:
+            return
+        self.min = data.min().item()
+        self.max = data.max().item()
+        self.mean = float(np.mean(data, dtype=np.float64))
+        deviation = data.astype(np.float64) - self.mean
+        self.m2 = float(np.dot(deviation, deviation))
+        low, high = self.histRange
+        self.underflow = int(np.count_nonzero(data < low))
+        self.overflow = int(np.count_nonzero(data >= high))
+        inside = self.count - self.underflow - self.overflow
+        histogram, edges = np.histogram(data, bins=self.bins, range=(low, high))
+        # np.histogram counts values equal to high in the last bin, they are overflow here
+        histogram[-1] -= histogram.sum() - inside
+        self.histogram = histogram.astype(np.int64)
+
+    # adds the counts of another VolumeStats with the same bins and histRange
+    def merge(self, other):
+        if other.count == 0 and other.skipped == 0:
+            return self
+        with self.lock:
+            if self.histogram is None:
+                self.bins, self.histRange = other.bins, other.histRange
+                self.histogram = np.zeros(self.bins, dtype=np.int64)
+            if other.histogram is not None and (other.bins != self.bins or other.histRange != self.histRange):
+                raise ValueError("cannot merge histograms of {} bins over {} and {} bins over {}".format(
+                    self.bins, self.histRange, other.bins, other.histRange))
+            count = self.count + other.count
+            if other.count:
+                delta = other.mean - self.mean
+                self.mean += delta * other.count / count
+                self.m2 += other.m2 + delta * delta * self.count * other.count / count
+                self.histogram += other.histogram
+            self.count = count
+            self.skipped += other.skipped
+            self.underflow += other.underflow
+            self.overflow += other.overflow
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        return self
+
+    # merges the VolumeStats of all ranks of an mpi4py communicator; the merged result is returned on root
+    # (on all ranks if root is None), other ranks get None
+    def reduce_MPI(self, comm, root=0):
+        partials = comm.allgather(self) if root is None else comm.gather(self, root=root)
+        if partials is None:
+            return None
+        merged = VolumeStats(self.bins, self.histRange)
+        for partial in partials:
+            merged.merge(partial)
+        return merged
+
+    # q-th percentiles (0-100) estimated from the histogram, linear within a bin
+    def percentile(self, q):
+        qs = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.count == 0:
+            values = np.full(qs.shape, np.nan)
+        else:
+            cumulative = self.underflow + np.concatenate([[0], np.cumsum(self.histogram)])
+            edges = self.binEdges
+            values = np.empty(qs.shape)
+            for i, rank in enumerate(qs / 100.0 * self.count):
+                if rank <= self.underflow:
+                    values[i] = self.min
+                elif rank > cumulative[-1]:
+                    values[i] = self.max
+                else:
+                    iBin = min(max(np.searchsorted(cumulative, rank) - 1, 0), self.bins - 1)
+                    fraction = (rank - cumulative[iBin]) / max(self.histogram[iBin], 1)
+                    values[i] = edges[iBin] + fraction * (edges[iBin+1] - edges[iBin])
+            values = np.clip(values, self.min, self.max)
+        return values[0] if np.ndim(q) == 0 else values
+
+    # dict of the summary values
+    def summary(self, percentiles=(1, 50, 99)):
+        summary = {'count': self.count, 'skipped': self.skipped, 'min': self.min, 'max': self.max,
+                   'mean': self.mean, 'std': self.std, 'underflow': self.underflow, 'overflow': self.overflow}
+        for q, value in zip(percentiles, self.percentile(list(percentiles))):
+            summary['p{:g}'.format(q)] = value
+        return summary
+
 
+# -----------------------------------------------------------------------------
+# VolumeStats of a volume in one read: source is a directory of slices, an .h5 file (dataset: name of the
+# dataset in it, default the first 3D dataset), an h5py dataset, an array, memory map or TiffVolume
+# slabs of slabSize slices are read and added by maxWorkers threads
+def volume_Stats(source='./',bins=1024,histRange=None,dataset=None,slabSize=16,maxWorkers=8):
+    h5 = None
+    if isinstance(source, str):
+        if os.path.isdir(source):
+            source = TiffVolume(source, cacheSize=0, maxWorkers=1)
+        else:
+            h5 = h5py.File(source, 'r')
+            if dataset is None:
+                datasets = []
+                h5.visititems(lambda name, item: datasets.append(name) if isinstance(item, h5py.Dataset) and item.ndim == 3 else None)
+                if not datasets:
+                    h5.close()
+                    raise ValueError("no 3D dataset in {}".format(source))
+                dataset = datasets[0]
+            source = h5[dataset]
+    stats = VolumeStats(bins, histRange)
+    try:
+        process_Images(lambda z: stats.update(source[z:z+slabSize]), range(0, len(source), slabSize), maxWorkers=maxWorkers)
+    finally:
+        if h5 is not None:
+            h5.close()
+    return stats
@@ -16,6 +16,7 @@ import importlib
 import xlrd # for importing excel spreadsheets
 from ast import literal_eval # For converting string to tuple
 import glob
+import io
 
 try:
 	importlib.import_module('pyF3D')
@@ -131,6 +132,9 @@ def recon(
 	castTo8bit = False, # convert data to 8bit before writing
 	cast8bit_min=-10, # min value if converting to 8bit
 	cast8bit_max=30, # max value if converting to 8bit
+	outputType = 'float32', # 'float32', 'uint16' (outputMin..outputMax mapped linearly to 0..65535) or 'float16'. uint16 and float16 files store their calibration, image_processing reads them back as float32 1/cm values. Only 'float32' can be used with castTo8bit or doBilateralFilter, which write 8bit data
+	outputMin = -10, # value stored as 0 in uint16 output
+	outputMax = 30, # value stored as 65535 in uint16 output
 	useNormalize_nf = False, # normalize based on background intensity (nf)
 	chunk_proj = 100, # chunk size in projection direction
 	chunk_sino = 100, # chunk size in sinogram direction
@@ -145,8 +149,24 @@ def recon(
 	doBeamHardening = False, #turn on beam hardening correction, based on "Correction for beam hardening in computed tomography", Gabor Herman, 1979 Phys. Med. Biol. 24 81
 	BeamHardeningCoefficients = None, #6 values, tomo = a0 + a1*tomo + a2*tomo^2 + a3*tomo^3 + a4*tomo^4 + a5*tomo^5
 	projIgnoreList = None, #projections to be ignored in the reconstruction (for simplicity in the code, they will not be removed and will be processed as all other projections but will be set to zero absorption right before reconstruction.
+	inputData = None, #dataset already in memory: an open h5py.File (e.g. from SpotSession.open_dataset), a file-like object or bytes. If set, it is read instead of inputPath+filename, which is only used to name the output.
+	buildPyramid = False, #also write 2x, 4x and 8x block averaged copies of the reconstruction (outputFilename_pyramid.h5, see image_processing.PyramidBuilder), built from each chunk while the next one is reconstructed
+	preview = None, #quick look: binning factor (ex. 4). Every preview-th projection is read, detector pixels and slices are averaged in preview x preview blocks as they are read, and pxsize, cor, npad, tilt centers and angles are scaled to match. cor is given (and printed) in full resolution pixels. Output is named outputFilename_preview
+	roiX = None, #region of interest: (start, end) columns of the reconstructed slices to keep, None for all. Only this region is masked, post-processed and written
+	roiY = None, #region of interest: (start, end) rows of the reconstructed slices to keep, None for all
+	roiZ = None, #region of interest: (start, end) slices to reconstruct, instead of sinoused (giving both is an error). Sinogram rows outside of it are not read
+	volumeStats = None, #an image_processing.VolumeStats, updated with each reconstructed chunk as it is written (min, max, mean, histogram of the volume without reading it back). Without a histRange it gets outputMin..outputMax, or the uint8 range with castTo8bit or doBilateralFilter
 	*args, **kwargs):
 	
+	if roiZ is not None and sinoused is not None:
+		raise ValueError("give either roiZ or sinoused, not both")
+	if outputType not in ('float32', 'uint16', 'float16'):
+		raise ValueError("\'outputType\' must be one of: [ float32, uint16, float16 ].")
+	if outputType != 'float32' and (castTo8bit or doBilateralFilter):
+		raise ValueError("outputType {} cannot be used with castTo8bit or doBilateralFilter, which write 8bit data".format(outputType))
+	if volumeStats is not None and volumeStats.histRange is None and not (castTo8bit or doBilateralFilter):
+		# float chunks need a histogram range, VolumeStats only finds one for integer data
+		volumeStats.histRange = (float(outputMin), float(outputMax))
 	start_time = time.time()
 	print("Start {} at:".format(filename)+time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.localtime()))
 	
@@ -154,7 +174,16 @@ def recon(
 
 	outputFilename = filename if outputFilename is None else outputFilename
 	tempfilenames = [outputPath+'tmp0.h5',outputPath+'tmp1.h5']
+	pyramid = None
 	filenametowrite = outputPath+'/rec'+filename.strip(".h5")+'/'+outputFilename		
+	binning = 1 if not preview else int(preview)
+	if buildPyramid or outputType != 'float32':
+		try:
+			from . import image_processing
+		except (ImportError, ValueError, SystemError):
+			import image_processing
+	if binning > 1:
+		filenametowrite += '_preview'
 	#filenametowrite = outputPath+'/rec'+filename+'/'+outputFilename		
 	
 	print("cleaning up previous temp files", end="")
@@ -166,7 +195,12 @@ def recon(
 	
 	print(", reading metadata")
 	
-	datafile = h5py.File(inputPath+filename, 'r')
+	if inputData is None:
+		datafile = h5py.File(inputPath+filename, 'r')
+		datasource = inputPath+filename
+	else:
+		datafile = open_h5source(inputData)
+		datasource = datafile
 	gdata = dict(dxchange.reader._find_dataset_group(datafile).attrs) 
 	pxsize = float(gdata['pxsize'])/10 # /10 to convert unites from mm to cm
 	numslices = int(gdata['nslices'])
@@ -218,6 +252,8 @@ def recon(
 		print("we cannot currently do doOutliers1D and doOutliers2D at the same time, turning off doOutliers1D")
 	
 	#figure out how user can pass to do central x number of slices, or set of slices dispersed throughout (without knowing a priori the value of numslices)
+	if roiZ is not None:
+		sinoused = (roiZ[0], numslices if roiZ[1] is None else roiZ[1], 1)
 	if sinoused is None:
 		sinoused = (0,numslices,1)
 	elif sinoused[0]<0:
@@ -230,6 +266,24 @@ def recon(
 	numprojused = (projused[1]-projused[0])//projused[2]
 	numsinoused = (sinoused[1]-sinoused[0])//sinoused[2]
 	
+	if binning > 1:
+		# preview: only every binning-th projection is read, slices are read in groups of binning and averaged with the detector pixels (bin_projections)
+		projindices = list(range(projused[0],projused[1],projused[2]*binning))
+		anglelist = np.asarray(anglelist)[projused[0]:projused[1]:projused[2]*binning]
+		numprojused = len(projindices)
+		num_proj_per_chunk = np.minimum(chunk_proj,numprojused)
+		numprojchunks = (numprojused-1)//num_proj_per_chunk+1
+		numsinoused = (sinoused[1]-sinoused[0])//binning
+		sinoused = (sinoused[0],sinoused[0]+numsinoused*binning,1)
+		num_sino_per_chunk = np.minimum(chunk_sino,numsinoused)
+		numsinochunks = (numsinoused-1)//num_sino_per_chunk+1
+		numslices = numslices//binning
+		numrays = numrays//binning
+		pxsize, npad, cor, tiltcenter_slice, tiltcenter_det = binned_geometry(binning, pxsize, npad, cor, tiltcenter_slice, tiltcenter_det)
+		roiX = None if roiX is None else tuple(None if v is None else v//binning for v in roiX)
+		roiY = None if roiY is None else tuple(None if v is None else v//binning for v in roiY)
+		print("preview: binning {}, {} projections, {} slices of {} pixels".format(binning, numprojused, numsinoused, numrays))
+
 	BeamHardeningCoefficients = (0, 1, 0, 0, 0, .1) if BeamHardeningCoefficients is None else BeamHardeningCoefficients
 
 	if cor is None:
@@ -241,7 +295,8 @@ def recon(
 		#I don't want to see the warnings about the reader using a deprecated variable in dxchange
 		with warnings.catch_warnings():
 			warnings.simplefilter("ignore")
-			tomo, flat, dark, floc = dxchange.read_als_832h5(inputPath+filename,ind_tomo=(0,lastcor))
+			tomo, flat, dark, floc = read_als_832h5(datasource,ind_tomo=(0,lastcor))
+		tomo, flat, dark = bin_projections(tomo, binning), bin_projections(flat, binning), bin_projections(dark, binning)
 		tomo = tomo.astype(np.float32)
 		if useNormalize_nf:
 			tomopy.normalize_nf(tomo, flat, dark, floc, out=tomo)
@@ -262,7 +317,10 @@ def recon(
 			cor = tomopy.find_center_pc(tomo[0], tomo[1], tol=0.25)
 		else:
 			raise ValueError("\'corFunction\' must be one of: [ pc, vo, nm ].")
-		print(", {}".format(cor))
+		if binning > 1:
+			print(", {} ({} at full resolution)".format(cor, cor*binning+(binning-1)/2.))
+		else:
+			print(", {}".format(cor))
 	else:
 		print("using user input center of {}".format(cor))
 		
@@ -321,17 +379,23 @@ def recon(
 			if curfunc==0:
 				with warnings.catch_warnings():
 					warnings.simplefilter("ignore")
-					if axis=='proj':
-						tomo, flat, dark, floc = dxchange.read_als_832h5(inputPath+filename,ind_tomo=range(y*num_proj_per_chunk+projused[0],np.minimum((y + 1)*num_proj_per_chunk+projused[0],numangles)),sino=(sinoused[0],sinoused[1], sinoused[2]) )
+					if binning > 1 and axis=='proj':
+						tomo, flat, dark, floc = read_als_832h5(datasource,ind_tomo=projindices[y*num_proj_per_chunk:(y + 1)*num_proj_per_chunk],sino=(sinoused[0],sinoused[1],1) )
+					elif binning > 1:
+						tomo, flat, dark, floc = read_als_832h5(datasource,ind_tomo=projindices,sino=sino_chunk(y,num_sino_per_chunk,sinoused,binning) )
+					elif axis=='proj':
+						tomo, flat, dark, floc = read_als_832h5(datasource,ind_tomo=range(y*num_proj_per_chunk+projused[0],np.minimum((y + 1)*num_proj_per_chunk+projused[0],numangles)),sino=(sinoused[0],sinoused[1], sinoused[2]) )
 					else:
-						tomo, flat, dark, floc = dxchange.read_als_832h5(inputPath+filename,ind_tomo=range(projused[0],projused[1],projused[2]),sino=(y*num_sino_per_chunk+sinoused[0],np.minimum((y + 1)*num_sino_per_chunk+sinoused[0],numslices),1) )
+						tomo, flat, dark, floc = read_als_832h5(datasource,ind_tomo=range(projused[0],projused[1],projused[2]),sino=sino_chunk(y,num_sino_per_chunk,sinoused) )
+				tomo, flat, dark = bin_projections(tomo, binning), bin_projections(flat, binning), bin_projections(dark, binning)
 			else:
 				if axis=='proj':
 					start, end = y * num_proj_per_chunk, np.minimum((y + 1) * num_proj_per_chunk,numprojused)
 					tomo = dxchange.reader.read_hdf5(tempfilenames[curtemp],'/tmp/tmp',slc=((start,end,1),(0,numslices,1),(0,numrays,1))) #read in intermediate file
 				else:
 					start, end = y * num_sino_per_chunk, np.minimum((y + 1) * num_sino_per_chunk,numsinoused)
-					tomo = dxchange.reader.read_hdf5(tempfilenames[curtemp],'/tmp/tmp',slc=((0,numangles,1),(start,end,1),(0,numrays,1)))
+					# a preview's intermediate file only holds the projections that were read
+					tomo = dxchange.reader.read_hdf5(tempfilenames[curtemp],'/tmp/tmp',slc=((0,numprojused if binning > 1 else numangles,1),(start,end,1),(0,numrays,1)))
 			dofunc = curfunc
 			keepvalues = None
 			while True: # Loop over operations to do in current chunking direction
@@ -379,7 +443,7 @@ def recon(
 						tiltcenter_slice = numslices/2.
 					if tiltcenter_det is None:
 						tiltcenter_det = tomo.shape[2]/2
-					new_center = tiltcenter_slice - 0.5 - sinoused[0]
+					new_center = tiltcenter_slice - 0.5 - sinoused[0]/float(binning)
 					center_det = tiltcenter_det - 0.5
 					
 					#add padding of 10 pixels, to be unpadded right after tilt correction. This makes the tilted image not have zeros at certain edges, which matters in cases where sample is bigger than the field of view. For the small amounts we are generally tilting the images, 10 pixels is sufficient.
@@ -403,7 +467,8 @@ def recon(
 					else:
 						tomo = sino_360_to_180(tomo[:,:,:], overlap=int(np.round((tomo.shape[2]-cor))*2), rotation='right')
 						angularrange = angularrange/2
-					numangles = int(numangles/2)
+					# a preview only read numprojused of the numangles projections
+					numangles = int((numprojused if binning > 1 else numangles)/2)
 					projused = (0,numangles-1,1)
 					num_proj_per_chunk = np.minimum(chunk_proj,projused[1]-projused[0])
 					numprojchunks = (projused[1]-projused[0]-1)//num_proj_per_chunk+1
@@ -422,18 +487,37 @@ def recon(
 							tomo[badproj] = 0
 
 					rec = tomopy.recon(tomo, anglelist, center=cor+npad, algorithm='gridrec', filter_name='butterworth', filter_par=[butterworth_cutoff, butterworth_order])
-					rec = rec[:, npad:-npad, npad:-npad]
-					rec /= pxsize  # convert reconstructed voxel values from 1/pixel to 1/cm
-					rec = tomopy.circ_mask(rec, 0)
+					if (roiX is None and roiY is None) or doPolarRing: # polar ring removal needs the whole slice, cropped to the roi after it
+						rec = rec[:, npad:-npad, npad:-npad]
+						rec /= pxsize  # convert reconstructed voxel values from 1/pixel to 1/cm
+						rec = tomopy.circ_mask(rec, 0)
+					else:
+						size = rec.shape[1]-2*npad
+						rows, cols = roi_ranges(size, roiX, roiY)
+						rec = np.ascontiguousarray(rec[:, npad+rows[0]:npad+rows[1], npad+cols[0]:npad+cols[1]])
+						rec /= pxsize  # convert reconstructed voxel values from 1/pixel to 1/cm
+						rec[:, ~roi_circ_mask(size, rows, cols)] = 0
 				elif func_name == 'polar_ring':
 					rec = np.ascontiguousarray(rec, dtype=np.float32)
 					rec = tomopy.remove_ring(rec, theta_min=Rarc, rwidth=Rmaxwidth, thresh_max=Rtmax, thresh=Rthr, thresh_min=Rtmin,out=rec)
+					if roiX is not None or roiY is not None:
+						rows, cols = roi_ranges(rec.shape[1], roiX, roiY)
+						rec = np.ascontiguousarray(rec[:, rows[0]:rows[1], cols[0]:cols[1]])
 				elif func_name == 'castTo8bit':
 					rec = convert8bit(rec, cast8bit_min, cast8bit_max)
 				elif func_name == 'bilateral_filter':
 					rec = pyF3D.run_BilateralFilter(rec, spatialRadius=bilateral_srad, rangeRadius=bilateral_rrad)
 				elif func_name == 'write_output':
-					dxchange.write_tiff_stack(rec, fname=filenametowrite, start=y*num_sino_per_chunk + sinoused[0])
+					if outputType != 'float32' and rec.dtype == np.float32:
+						image_processing.write_EncodedStack(rec, filenametowrite, start=y*num_sino_per_chunk + sinoused[0]//binning, outputType=outputType, data_min=outputMin, data_max=outputMax, unit='1/cm')
+					else:
+						dxchange.write_tiff_stack(rec, fname=filenametowrite, start=y*num_sino_per_chunk + sinoused[0]//binning)
+					if buildPyramid:
+						if pyramid is None:
+							pyramid = image_processing.PyramidBuilder(filenametowrite+'_pyramid.h5', start=sinoused[0]//binning)
+						pyramid.add(rec)
+					if volumeStats is not None:
+						volumeStats.update(rec)
 				print('(took {:.2f} seconds)'.format(time.time()-curtime))
 				dofunc+=1
 				if dofunc==len(function_list):
@@ -446,6 +530,9 @@ def recon(
 		if curfunc==len(function_list):
 			break
 		axis = slice_dir[function_list[curfunc]]
+	if pyramid is not None:
+		print("finishing pyramid")
+		pyramid.close()
 	print("cleaning up temp files")
 	for tmpfile in tempfilenames:
 		try:
@@ -458,6 +545,91 @@ def recon(
 
 
 
+def open_h5source(source):
+	#returns an open h5py.File for an h5py.File, a file-like object or bytes holding an HDF5 file
+	if isinstance(source, h5py.File):
+		return source
+	if isinstance(source, (bytes, bytearray, memoryview)):
+		source = io.BytesIO(source)
+	return h5py.File(source, 'r') #h5py 2.9 or newer reads from file-like objects
+
+
+def read_als_832h5(source, ind_tomo=None, sino=None):
+	#same as dxchange.read_als_832h5, but source can also be an open h5py.File (for example a dataset held in memory)
+	if not isinstance(source, h5py.File):
+		return dxchange.read_als_832h5(source, ind_tomo=ind_tomo, sino=sino)
+	dgroup = dxchange.reader._find_dataset_group(source)
+	dname = dgroup.name.split('/')[-1]
+	tomo_name = dname + '_0000_0000.tif'
+	flat_name = dname + 'bak_0000.tif'
+	dark_name = dname + 'drk_0000.tif'
+	nproj = int(dgroup.attrs['nangles'])
+	inter_bright = int(dgroup.attrs['i0cycle'])
+	nflat = int(dgroup.attrs['num_bright_field'])
+	ndark = int(dgroup.attrs['num_dark_fields'])
+	ind_tomo = list(range(0, nproj)) if ind_tomo is None else ind_tomo
+	ind_flat = list(range(0, nflat))
+	ind_dark = list(range(0, ndark))
+	group_dark = [nproj - 1]
+	if inter_bright > 0:
+		group_flat = list(range(0, nproj, inter_bright))
+		if group_flat[-1] != nproj - 1:
+			group_flat.append(nproj - 1)
+	elif inter_bright == 0:
+		group_flat = [0, nproj - 1]
+	else:
+		group_flat = None
+	tomo = dxchange.reader.read_hdf5_stack(dgroup, tomo_name, ind_tomo, slc=(None, sino))
+	flat = dxchange.reader.read_hdf5_stack(dgroup, flat_name, ind_flat, slc=(None, sino), out_ind=group_flat)
+	dark = dxchange.reader.read_hdf5_stack(dgroup, dark_name, ind_dark, slc=(None, sino), out_ind=group_dark)
+	return tomo, flat, dark, dxchange.reader._map_loc(ind_tomo, group_flat)
+
+
+def roi_ranges(size, roiX, roiY):
+	#(start, end) rows and columns of the region of interest in a size x size reconstructed slice
+	roiX = (0, None) if roiX is None else roiX
+	roiY = (0, None) if roiY is None else roiY
+	return slice(roiY[0], roiY[1]).indices(size)[:2], slice(roiX[0], roiX[1]).indices(size)[:2]
+
+
+def roi_circ_mask(size, rows, cols):
+	#the circle of tomopy.circ_mask(ratio=1) of a size x size slice, for the rows and columns (start, end) of a region of interest only
+	y = np.arange(rows[0], rows[1]) + 0.5 - size/2.
+	x = np.arange(cols[0], cols[1]) + 0.5 - size/2.
+	return y[:, np.newaxis]**2 + x[np.newaxis, :]**2 < (size/2.)**2
+
+
+def sino_chunk(y, num_sino_per_chunk, sinoused, binning=1):
+	#(start, end, 1) full resolution sinogram rows read for chunk y when reading in sinogram order, never past sinoused[1]
+	#(the end of roiZ); a preview reads binning rows for each of its num_sino_per_chunk binned slices
+	start = y*num_sino_per_chunk*binning+sinoused[0]
+	return (start, int(np.minimum(start+num_sino_per_chunk*binning, sinoused[1])), 1)
+
+
+def bin_projections(data, binning):
+	#averages blocks of binning x binning detector pixels (axes 1 and 2) of projections, flats or darks, as float32; leftover rows and columns are dropped
+	if data is None or binning <= 1:
+		return data
+	nproj, rows, cols = data.shape
+	rows, cols = rows//binning*binning, cols//binning*binning
+	data = data[:, :rows, :cols].reshape(nproj, rows//binning, binning, cols//binning, binning)
+	return data.mean(axis=(2, 4), dtype=np.float32)
+
+
+def binned_geometry(binning, pxsize, npad, cor=None, tiltcenter_slice=None, tiltcenter_det=None):
+	#pixel size, padding, center of rotation and tilt centers in the pixels of projections binned by bin_projections
+	#a binned pixel k covers full resolution pixels k*binning to (k+1)*binning-1
+	pxsize = pxsize*binning
+	npad = int(np.ceil(npad/float(binning)))
+	if cor is not None:
+		cor = (cor-(binning-1)/2.)/binning
+	if tiltcenter_slice is not None:
+		tiltcenter_slice = tiltcenter_slice/float(binning)
+	if tiltcenter_det is not None:
+		tiltcenter_det = tiltcenter_det/float(binning)
+	return pxsize, npad, cor, tiltcenter_slice, tiltcenter_det
+
+
 def convert8bit(rec,data_min,data_max):
 	rec = rec.astype(np.float32,copy=False)
 	df = np.float32(data_max-data_min)
@@ -608,11 +780,39 @@ def spreadsheet(filepath):
 	return(dataList)
 
 
+def recon_batch(functioninputs, scratchDir=None, scratchSize=None, prefetch=2):
+	#runs recon for a list of argument dictionaries. If scratchDir is given, the raw files are copied to
+	#scratchDir ahead of use (see data_management.ScratchCache) and read from there, output still goes to
+	#outputPath, or inputPath if outputPath is not set
+	if scratchDir is None:
+		for functioninput in functioninputs:
+			recon(**functioninput)
+		return
+	try:
+		from . import data_management
+	except (ImportError, ValueError, SystemError):
+		import data_management
+	cache = data_management.ScratchCache(scratchDir, prefetch=prefetch, maxBytes=data_management.ScratchCacheSize if scratchSize is None else scratchSize)
+	sources = [functioninput.get('inputPath','./')+functioninput['filename'] for functioninput in functioninputs]
+	try:
+		for functioninput, (source, path) in zip(functioninputs, cache.batch(sources)):
+			functioninput = dict(functioninput)
+			functioninput['outputPath'] = functioninput.get('outputPath', functioninput.get('inputPath','./'))
+			functioninput['inputPath'] = os.path.dirname(path)+'/'
+			functioninput['filename'] = os.path.basename(path)
+			recon(**functioninput)
+	finally:
+		cache.close()
+
+
 # D.Y.Parkinson's interpreter for text input files
+# an optional second argument is a scratch directory the raw files are copied to ahead of reconstruction
 def main():
 	parametersfile = 'input832.txt' if (len(sys.argv)<2) else sys.argv[1]
+	scratchDir = None if (len(sys.argv)<3) else sys.argv[2]
 
 	if parametersfile.split('.')[-1] == 'txt':
+		functioninputs = []
 		with open(parametersfile,'r') as theinputfile:
 			theinput = theinputfile.read()
 			inputlist = theinput.splitlines()
@@ -631,13 +831,13 @@ def main():
 					functioninput[inputlisttabsplit[inputcounter*2+1]] = inputcommasplitconverted
 				print("Read user input:")
 				print(functioninput)
-				recon(**functioninput)
+				functioninputs.append(functioninput)
+		recon_batch(functioninputs, scratchDir=scratchDir)
 
 # H.S.Barnard Spreadsheet interpreter
 	if parametersfile.split('.')[-1]=='xlsx':
 		functioninput = spreadsheet(parametersfile)
-		for i in range(len(functioninput)):
-			recon(**functioninput[i])
+		recon_batch(functioninput, scratchDir=scratchDir)
 
 if __name__ == '__main__':
 	main()
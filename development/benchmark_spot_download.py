@@ -0,0 +1,39 @@
+#benchmark_spot_download.py
+# Measures SpotSession.download throughput against the local SPOT stand-in
+# server (tests/spot_server.py) for different numbers of connections.
+#
+# python benchmark_spot_download.py [size in MB]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+import data_management as dm
+from spot_server import SpotTestServer
+
+sizeMB = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+dataset = "benchmark_dataset"
+
+dataDir = tempfile.mkdtemp()
+outDir = tempfile.mkdtemp()
+with open(os.path.join(dataDir, dataset + ".h5"), "wb") as f:
+    for i in range(sizeMB):
+        f.write(os.urandom(1024 ** 2))
+
+try:
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        for connections in (1, 2, 4, 8):
+            start = time.time()
+            fileLocation = s.download(dataset, downloadPath=outDir, connections=connections, resume=False)
+            elapsed = time.time() - start
+            print("{} connections: {:.1f} MB/s".format(connections, sizeMB / elapsed))
+            os.remove(fileLocation)
+finally:
+    shutil.rmtree(dataDir)
+    shutil.rmtree(outDir)
@@ -10,7 +10,14 @@ class MpiArray(object):
     #    set arr and root
     # initialize array from remote sources using local_arr
     #    set local_arr and axis
-    def __init__(self, arr=None, local_arr=None, axis=0, sizes=None, offsets=None, root=0, comm=None):
+    # shared: keep the distributed array in an MPI-3 shared memory window
+    #    when all MPI processes run on the same node, so scatter, gather,
+    #    swapaxes_01, redistribute and exchange_halo are memory copies
+    #    instead of messages. Off by default (False), True turns it on if
+    #    the processes share a node.
+    #    NOTE: in shared mode local_arr is a view into the window, only
+    #    valid until the next scatter/gather/swapaxes_01/redistribute.
+    def __init__(self, arr=None, local_arr=None, axis=0, sizes=None, offsets=None, root=0, comm=None, rank_weights=None, shared=False):
         # lazy load mpi4py 
         from mpi4py import MPI
         # initialize variables
@@ -24,13 +31,33 @@ class MpiArray(object):
         self.root = root # root mpi_rank that stores full arr
         self.shape = None # shape of the whole ndarray
         self.dtype = None # dtype of ndarray
+        self.rank_weights = rank_weights # relative capacity of each MPI process, None for equal
+        self.halo = (0, 0) # ghost rows added below/above local_arr by the last exchange_halo
+        # detect MPI processes running on the same node
+        self.node_comm = self.comm.Split_type(MPI.COMM_TYPE_SHARED) # comm of processes sharing memory
+        colocated = self.node_comm.Get_size() == self.mpi_size
+        if shared and not colocated:
+            logger.warning("MpiArray shared memory needs all MPI processes on one node, using messages")
+        self.shared = bool(shared) and colocated and self.mpi_size > 1 # use shared memory window
+        self._win = None # MPI shared memory window
+        self._shared_arr = None # whole distributed array (distributed axis first) in self._win
         # calculate parameters for distributed array or global array
-        if self.local_arr:
+        if self.local_arr is not None:
             #combine all shapes to get overall shape
+            # NOTE: local_arr is always split along its axis 0, axis gives the
+            # axis of the whole array that it corresponds to
             self.axis = axis
-            total_axis_size = np.zeros(1, dtype=np.int)
-            self.comm.Allreduce(np.array(data=local_arr.shape[axis], dtype=np.int), total_axis_size, op=MPI.SUM)
-            self.shape = local_arr.shape[:axis]+(total_axis_size[0],)+local_arr.shape[axis:]
+            local_sizes = np.array(self.comm.allgather(local_arr.shape[0]), dtype=int)
+            if self.sizes is None:
+                self.sizes = local_sizes
+            if self.offsets is None:
+                self.offsets = np.zeros(self.mpi_size, dtype=int)
+                self.offsets[1:] = np.cumsum(self.sizes)[:-1]
+            total_axis_size = int(local_sizes.sum())
+            if axis == 0:
+                self.shape = (total_axis_size,)+local_arr.shape[1:]
+            else:
+                self.shape = (local_arr.shape[1], total_axis_size)+local_arr.shape[2:]
             self.dtype = self.local_arr.dtype
         else:
             # take size from root rank that has array (usually zero) 
@@ -70,29 +97,39 @@ class MpiArray(object):
         return MPI._typedict[dtype.char]
     
     @staticmethod
-    def fromglobalarray(arr, root=0, comm=None):
-        return MpiArray(arr, root=root, comm=comm)
+    def fromglobalarray(arr, root=0, comm=None, rank_weights=None, shared=False):
+        return MpiArray(arr, root=root, comm=comm, rank_weights=rank_weights, shared=shared)
 
 
     @staticmethod
-    def fromlocalarrays(local_arr, axis=0, sizes=None, offsets=None, comm=None):
-        return MpiArray(loacl_arr=local_arr, axis=axis, sizes=sizes, offsets=offsets, comm=comm)
+    def fromlocalarrays(local_arr, axis=0, sizes=None, offsets=None, comm=None, rank_weights=None, shared=False):
+        return MpiArray(local_arr=local_arr, axis=axis, sizes=sizes, offsets=offsets, comm=comm, rank_weights=rank_weights, shared=shared)
 
 
     # scatter data to MPI nodes
     # axis determines which axis to scatter along
+    # weights optionally gives the cost of each row along axis 0, used to
+    # balance the split (see split_array_indicies)
     # returns self.local_arr
-    def scatter(self, axis=0):
+    def scatter(self, axis=0, weights=None):
         if axis not in (0,1):
             raise Exception("MpiArray can only scatter on axis 0 or 1, not %s" % str(axis))
         if self.axis is None:
             # scatter data to nodes
             # nodes calculate offsets and sizes for sharing
-            self.sizes, self.offsets = self.split_array_indicies(self.shape, self.mpi_size)
-            local_shape = (self.sizes[self.mpi_rank],)+self.shape[1:]
-            self.local_arr = np.empty(local_shape, dtype=self.dtype)
-            #TODO: compare to mpi4py Scatterv
-            self._Scatterv(self.sizes, self.offsets)
+            self.sizes, self.offsets = self.split_array_indicies(self.shape, self.mpi_size, weights, self.rank_weights)
+            if self.shared:
+                # root copies into the node's shared memory, the rest is offsets
+                self._allocate_shared(self.shape)
+                if self.mpi_rank == self.root:
+                    self._shared_arr[...] = self.arr
+                self.comm.Barrier()
+                self.local_arr = self._shared_arr[self.offset:self.offset+self.size]
+            else:
+                local_shape = (self.sizes[self.mpi_rank],)+self.shape[1:]
+                self.local_arr = np.empty(local_shape, dtype=self.dtype)
+                #TODO: compare to mpi4py Scatterv
+                self._Scatterv(self.sizes, self.offsets)
             self.axis = 0 # always scatter on axis 0
         if self.axis != axis:
             # swapaxis 0 and 1 in a distributed manner
@@ -155,9 +192,16 @@ class MpiArray(object):
                 arr_shape = (self.shape[1], self.shape[0]) + self.shape[2:] 
             if self.arr is None or self.arr.shape != arr_shape:
                 self.arr = np.empty(arr_shape, dtype=self.dtype)
-        self._Gatherv()
+        if self._sync_shared():
+            # whole array is already in shared memory, root takes a copy
+            if self.mpi_rank == root:
+                self.arr[...] = self._shared_arr
+            self.comm.Barrier()
+        else:
+            self._Gatherv()
         
         if delete_local:
+            self._free_shared()
             self.local_arr = None
             self.axis = None
         return self.arr
@@ -186,7 +230,8 @@ class MpiArray(object):
     #     np.swapaxes(mpiarray.arr, 0, 1)
     # mpiarray.scatter()
     # NOTE: must already be scattered to work.
-    def swapaxes_01(self):
+    # weights optionally gives the cost of each row along the new axis 0
+    def swapaxes_01(self, weights=None):
         if self.axis not in (0, 1):
             raise Exception("Array must already be scattered along axis 0 or 1 for swapaxes_01, not %s" % str(self.axis))
         # calculate the shape of the whole array after swapaxes
@@ -198,7 +243,24 @@ class MpiArray(object):
             new_shape = self.shape
         
         # planned distribution of data
-        sizes, offsets = self.split_array_indicies(new_shape, self.mpi_size)
+        sizes, offsets = self.split_array_indicies(new_shape, self.mpi_size, weights, self.rank_weights)
+        if self._shared_usable():
+            # every process writes its transposed rows into a new shared
+            # array and takes a view of its new rows, no messages needed
+            old_win, old_shared_arr = self._win, self._shared_arr
+            self._win, self._shared_arr = None, None
+            self._allocate_shared(new_shape)
+            self._shared_arr[:, self.offset:self.offset+self.size] = np.swapaxes(self.local_arr, 0, 1)
+            self.local_arr = None
+            self.comm.Barrier()
+            if old_win is not None:
+                del old_shared_arr
+                old_win.Free()
+            self.local_arr = self._shared_arr[offsets[self.mpi_rank]:offsets[self.mpi_rank]+sizes[self.mpi_rank]]
+            self.axis ^= 1 # switched axis
+            self.sizes = sizes
+            self.offsets = offsets
+            return
         # swap axes for sending local data and require alignment
         # NOTE: will create a copy.
         swapped_local_arr = np.require(np.swapaxes(self.local_arr, 0, 1), requirements='C')
@@ -206,13 +268,13 @@ class MpiArray(object):
         # create flat array for recv data
         recv_stride = np.prod(new_shape[1:])
         local_arr_recv = np.empty(sizes[self.mpi_rank]*recv_stride, dtype=self.dtype)
-        # calculate where to send data
-        swapped_sizes, swapped_offsets = self.split_array_indicies(swapped_local_arr.shape, self.mpi_size)
+        # send data using the same split that the receivers planned
+        swapped_sizes, swapped_offsets = sizes, offsets
         # calculate data being received in units of elements (recv is flat array)
-        recv_sizes = np.empty(self.mpi_size, dtype=np.int)
+        recv_sizes = np.empty(self.mpi_size, dtype=int)
         for i in range(self.mpi_size):
             recv_sizes[i] = sizes[self.mpi_rank] * self.sizes[i] * np.prod(new_shape[2:])
-        recv_offsets = np.zeros(self.mpi_size, dtype=np.int)
+        recv_offsets = np.zeros(self.mpi_size, dtype=int)
         recv_offsets[1:] = np.cumsum(recv_sizes)[:-1]
         
         # send and receive data
@@ -232,18 +294,363 @@ class MpiArray(object):
         self.offsets = offsets
         
         
+    # Move rows between MPI processes so that each process ends up with
+    # the rows given by sizes/offsets (or by a split balanced on weights).
+    # Stays distributed along the current axis; only the rows that change
+    # owner are sent.
+    # NOTE: must already be scattered to work.
+    def redistribute(self, sizes=None, offsets=None, weights=None):
+        if self.axis not in (0, 1):
+            raise Exception("Array must already be scattered along axis 0 or 1 for redistribute, not %s" % str(self.axis))
+        # global shape of the distributed layout (distributed axis first)
+        if self.axis == 0:
+            dist_shape = self.shape
+        else:
+            dist_shape = (self.shape[1], self.shape[0])+self.shape[2:]
+        if sizes is None:
+            sizes, offsets = self.split_array_indicies(dist_shape, self.mpi_size, weights, self.rank_weights)
+        elif offsets is None:
+            offsets = np.zeros(self.mpi_size, dtype=int)
+            offsets[1:] = np.cumsum(sizes)[:-1]
+        sizes = np.asarray(sizes, dtype=int)
+        offsets = np.asarray(offsets, dtype=int)
+        if sizes.sum() != dist_shape[0]:
+            raise Exception("MpiArray redistribute sizes sum to %d, not %d" % (sizes.sum(), dist_shape[0]))
+        if np.array_equal(sizes, self.sizes) and np.array_equal(offsets, self.offsets):
+            return self.local_arr
+        if self._sync_shared():
+            # rows are already in shared memory, just move the views
+            self.sizes = sizes
+            self.offsets = offsets
+            self.local_arr = self._shared_arr[self.offset:self.offset+self.size]
+            return self.local_arr
+        # rows overlapping between the old and new split of every process
+        stride = int(np.prod(dist_shape[1:]))
+        send_sizes, send_offsets = self._overlap_indicies(self.offset, self.size, offsets, sizes)
+        recv_sizes, recv_offsets = self._overlap_indicies(offsets[self.mpi_rank], sizes[self.mpi_rank], self.offsets, self.sizes)
+        send_arr = np.require(self.local_arr, requirements='C')
+        local_arr = np.empty((sizes[self.mpi_rank],)+tuple(dist_shape[1:]), dtype=self.dtype)
+        self.comm.Alltoallv([send_arr, send_sizes*stride, send_offsets*stride, self.mpi_dtype],
+                            [local_arr, recv_sizes*stride, recv_offsets*stride, self.mpi_dtype])
+        self.local_arr = local_arr
+        self.sizes = sizes
+        self.offsets = offsets
+        return self.local_arr
+
+
+    # Rebalance the distributed rows between stages using measured cost.
+    # local_costs gives the cost of each local row (e.g. seconds per row),
+    # elapsed gives the time this process spent on its rows in the last
+    # stage, which is spread evenly across them.
+    # NOTE: must already be scattered to work.
+    def rebalance(self, local_costs=None, elapsed=None):
+        # lazy load mpi4py 
+        from mpi4py import MPI
+        if local_costs is None:
+            if elapsed is None:
+                raise Exception("MpiArray rebalance needs local_costs or elapsed")
+            local_costs = np.full(self.size, float(elapsed) / max(self.size, 1))
+        local_costs = np.require(local_costs, dtype=np.float64, requirements='C')
+        if local_costs.shape != (self.size,):
+            raise Exception("MpiArray rebalance needs one cost per local row (%d), not %s" % (self.size, str(local_costs.shape)))
+        # share costs, every process computes the same split
+        weights = np.empty(int(self.sizes.sum()), dtype=np.float64)
+        self.comm.Allgatherv(local_costs, [weights, self.sizes, self.offsets, MPI.DOUBLE])
+        return self.redistribute(weights=weights)
+
+
+    # Fetch k ghost rows from the neighbouring MPI processes along the
+    # distributed axis, for stages that need neighbouring rows (filters).
+    # Returns a copy of local_arr with up to k rows added on each side
+    # (none past the ends of the whole array). The number of rows added
+    # is stored in self.halo, so the result can be cut back with trim_halo.
+    # Uses non-blocking sends/recvs, so slabs smaller than k also work.
+    # NOTE: must already be scattered to work.
+    def exchange_halo(self, k):
+        # lazy load mpi4py 
+        from mpi4py import MPI
+        if self.axis not in (0, 1):
+            raise Exception("Array must already be scattered along axis 0 or 1 for exchange_halo, not %s" % str(self.axis))
+        k = int(k)
+        nrows = int(self.sizes.sum())
+        # ghost rows below/above each process' slab
+        halo_lo = np.minimum(k, self.offsets)
+        halo_hi = np.minimum(k, nrows - (self.offsets + self.sizes))
+        lo, hi = int(halo_lo[self.mpi_rank]), int(halo_hi[self.mpi_rank])
+        if self._sync_shared():
+            # neighbouring rows are in shared memory, copy them directly
+            padded = self._shared_arr[self.offset-lo:self.offset+self.size+hi].copy()
+            # neighbours may change their rows in place once we return
+            self.comm.Barrier()
+            self.halo = (lo, hi)
+            return padded
+        local_arr = np.require(self.local_arr, requirements='C')
+        padded = np.empty((lo+self.size+hi,)+local_arr.shape[1:], dtype=self.dtype)
+        padded[lo:lo+self.size] = local_arr
+        reqs = []
+        for i in range(self.mpi_size):
+            if i == self.mpi_rank:
+                continue
+            # tag 1 fills the lower halo, tag 2 fills the upper halo
+            # receive my halos from the rows rank i owns
+            for tag, start, n, pos in ((1, self.offset-lo, lo, 0), (2, self.offset+self.size, hi, lo+self.size)):
+                rsizes, roffsets = self._overlap_indicies(start, n, self.offsets[i:i+1], self.sizes[i:i+1])
+                if rsizes[0] > 0:
+                    reqs.append(self.comm.Irecv(padded[pos+roffsets[0]:pos+roffsets[0]+rsizes[0]], source=i, tag=tag))
+            # send the rows I own that fall in rank i's halos
+            for tag, start, n in ((1, self.offsets[i]-halo_lo[i], halo_lo[i]), (2, self.offsets[i]+self.sizes[i], halo_hi[i])):
+                ssizes, soffsets = self._overlap_indicies(self.offset, self.size, np.array([start]), np.array([n]))
+                if ssizes[0] > 0:
+                    reqs.append(self.comm.Isend(local_arr[soffsets[0]:soffsets[0]+ssizes[0]], dest=i, tag=tag))
+        MPI.Request.Waitall(reqs)
+        self.halo = (lo, hi)
+        return padded
+
+
+    # Remove the ghost rows added by exchange_halo from arr
+    def trim_halo(self, arr):
+        lo, hi = self.halo
+        return arr[lo:arr.shape[0]-hi]
+
+
+    # Run func on local_arr padded with k ghost rows on each side and keep
+    # only this process' rows of the result, i.e.
+    # local_arr = trim_halo(func(exchange_halo(k), *args, **kwargs))
+    # If func works in place and returns None, the padded array is used.
+    def apply_halo(self, func, k, *args, **kwargs):
+        padded = self.exchange_halo(k)
+        result = func(padded, *args, **kwargs)
+        if result is None:
+            result = padded
+        self.local_arr = self.trim_halo(result)
+        return self.local_arr
+
+
+    # Apply an elementwise function to the data of this process, i.e.
+    # local_arr = func(local_arr, *args, **kwargs)
+    # If func works in place and returns None, local_arr is kept.
+    def map(self, func, *args, **kwargs):
+        result = func(self._local_data(), *args, **kwargs)
+        if result is not None:
+            if self.axis is None:
+                self.arr = result
+            else:
+                self.local_arr = result
+        return self._local_data()
+
+
+    # Distributed reductions, computed on the data of every process and
+    # combined with Allreduce, so nothing is gathered. Every process
+    # returns the result. Also work before scatter (root holds the data).
+    def min(self):
+        data = self._local_data()
+        return self._allreduce_scalar(data.min() if data.size else np.inf, 'MIN')
+
+    def max(self):
+        data = self._local_data()
+        return self._allreduce_scalar(data.max() if data.size else -np.inf, 'MAX')
+
+    def sum(self):
+        return self._allreduce_scalar(self._local_data().sum(dtype=np.float64), 'SUM')
+
+    def count(self):
+        return int(self._allreduce_scalar(self._local_data().size, 'SUM'))
+
+    def mean(self):
+        return self.sum() / self.count()
+
+    def std(self):
+        data = self._local_data()
+        mean = self.mean()
+        sq_dev = np.sum(np.square(data - mean, dtype=np.float64)) if data.size else 0.0
+        return np.sqrt(self._allreduce_scalar(sq_dev, 'SUM') / self.count())
+
+
+    # Histogram of the whole array, local histograms are summed with Allreduce.
+    # range defaults to the global (min, max). Same return as np.histogram.
+    def histogram(self, bins=256, range=None):
+        # lazy load mpi4py 
+        from mpi4py import MPI
+        if range is None:
+            range = (self.min(), self.max())
+        local_hist, edges = np.histogram(self._local_data(), bins=bins, range=range)
+        hist = np.empty_like(local_hist, dtype=np.int64)
+        self.comm.Allreduce(local_hist.astype(np.int64), hist, op=MPI.SUM)
+        return hist, edges
+
+
+    # Percentile(s) q (0-100) of the whole array from a merged histogram,
+    # the value where the cumulative count reaches q percent (numpy's
+    # 'inverted_cdf' method). Accurate to within a bin, (max-min)/bins.
+    def percentile(self, q, bins=4096, range=None):
+        hist, edges = self.histogram(bins=bins, range=range)
+        cdf = np.cumsum(hist, dtype=np.float64)
+        target = np.asarray(q, dtype=np.float64) / 100.0 * cdf[-1]
+        # bin holding each target and linear interpolation inside it
+        ind = np.clip(np.searchsorted(cdf, target), 0, len(hist)-1)
+        below = np.where(ind > 0, cdf[ind-1], 0.0)
+        frac = np.where(hist[ind] > 0, (target - below) / np.maximum(hist[ind], 1), 0.0)
+        return edges[ind] + np.clip(frac, 0.0, 1.0) * (edges[ind+1] - edges[ind])
+
+
+    # data held by this process, local_arr once distributed
+    def _local_data(self):
+        if self.axis is not None:
+            return self.local_arr
+        elif self.mpi_rank == self.root:
+            return self.arr
+        else:
+            return np.empty((0,)+tuple(self.shape[1:]), dtype=self.dtype)
+
+
+    # combine one value from every process with MPI op (by name)
+    def _allreduce_scalar(self, value, op):
+        # lazy load mpi4py 
+        from mpi4py import MPI
+        result = np.empty(1, dtype=np.float64)
+        self.comm.Allreduce(np.array([value], dtype=np.float64), result, op=getattr(MPI, op))
+        return result[0]
+
+
+    # Allocate the shared memory window holding the whole distributed array
+    # (distributed axis first). The memory belongs to the first process of
+    # the node, the others map it. Replaces any previous window.
+    def _allocate_shared(self, shape):
+        # lazy load mpi4py 
+        from mpi4py import MPI
+        self._free_shared()
+        itemsize = np.dtype(self.dtype).itemsize
+        nbytes = int(np.prod(shape)) * itemsize if self.node_comm.Get_rank() == 0 else 0
+        self._win = MPI.Win.Allocate_shared(nbytes, itemsize, comm=self.node_comm)
+        buf, itemsize = self._win.Shared_query(0)
+        self._shared_arr = np.ndarray(buffer=buf, dtype=self.dtype, shape=shape)
+        return self._shared_arr
+
+
+    # Free the shared memory window, local_arr is copied out of it first
+    # NOTE: collective, all processes must call it
+    def _free_shared(self):
+        if self._win is None:
+            return
+        if self.local_arr is not None and np.may_share_memory(self.local_arr, self._shared_arr):
+            self.local_arr = self.local_arr.copy()
+        self._shared_arr = None
+        self.comm.Barrier()
+        self._win.Free()
+        self._win = None
+
+
+    # Check (on all processes) that local_arr can be stored in a shared
+    # window: shared mode is on and every local_arr still has the dtype and
+    # row shape of the distributed array (stages may replace local_arr).
+    def _shared_usable(self):
+        # lazy load mpi4py 
+        from mpi4py import MPI
+        if not self.shared:
+            return False
+        if self.axis == 0:
+            row_shape = self.shape[1:]
+        else:
+            row_shape = (self.shape[0],)+self.shape[2:]
+        usable = (self.local_arr is not None and self.local_arr.dtype == self.dtype
+                  and self.local_arr.shape == (self.size,)+tuple(row_shape))
+        return self.comm.allreduce(usable, op=MPI.LAND)
+
+
+    # Make sure the shared window holds the current local_arr of every
+    # process, copying in local_arr where a stage replaced the view.
+    # Returns False (on all processes) if there is no usable shared window,
+    # in which case the window is freed and messages must be used.
+    def _sync_shared(self):
+        # lazy load mpi4py 
+        from mpi4py import MPI
+        usable = self.comm.allreduce(self._win is not None, op=MPI.LAND) and self._shared_usable()
+        if not usable:
+            self._free_shared()
+            return False
+        slot = self._shared_arr[self.offset:self.offset+self.size]
+        if self.local_arr.__array_interface__['data'][0] != slot.__array_interface__['data'][0] or self.local_arr.strides != slot.strides:
+            slot[...] = self.local_arr
+            self.local_arr = slot
+        self.comm.Barrier()
+        return True
+
+
+    # Calculate sizes and offsets of the rows in [start, start+size) that
+    # fall in each of the intervals given by offsets/sizes.
+    # Returned offsets are relative to start.
+    @staticmethod
+    def _overlap_indicies(start, size, offsets, sizes):
+        lo = np.maximum(offsets, start)
+        hi = np.minimum(offsets+sizes, start+size)
+        overlap_sizes = np.maximum(hi-lo, 0)
+        overlap_offsets = np.where(overlap_sizes > 0, lo-start, 0)
+        return overlap_sizes.astype(int), overlap_offsets.astype(int)
+
+
     # Calculate offsets and indicies to split an array 
     # to send/recv from all of the MPI nodes
+    # weights: optional cost of each row along axis 0, rows are split into
+    #   contiguous blocks of (approximately) equal total cost
+    # rank_weights: optional relative capacity of each MPI process, e.g.
+    #   give rank 0 less work since it also does I/O
+    @staticmethod
+    def split_array_indicies(shape, mpi_size, weights=None, rank_weights=None):
+        if weights is None and rank_weights is None:
+            return MpiArray._split_array_indicies_even(shape, mpi_size)
+        nrows = shape[0]
+        if weights is None:
+            weights = np.ones(nrows)
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != (nrows,):
+            raise Exception("MpiArray needs one weight per row (%d), not %s" % (nrows, str(weights.shape)))
+        if nrows == 0 or weights.sum() <= 0:
+            # nothing to balance on
+            weights = np.ones(nrows)
+        if rank_weights is None:
+            rank_weights = np.ones(mpi_size)
+        rank_weights = np.asarray(rank_weights, dtype=np.float64)
+        if rank_weights.shape != (mpi_size,):
+            raise Exception("MpiArray needs one rank weight per MPI process (%d), not %s" % (mpi_size, str(rank_weights.shape)))
+        # cumulative cost at each row boundary
+        boundary_cost = np.zeros(nrows+1)
+        np.cumsum(weights, out=boundary_cost[1:])
+        # walk the ranks in order: each one gets its share of the cost that
+        # is left, ending at the closest row boundary. Shares are recomputed
+        # after every rank, so a row heavier than a share does not leave the
+        # following ranks empty, and every rank with capacity gets at least
+        # one row while there are enough rows left.
+        bounds = np.zeros(mpi_size+1, dtype=int)
+        bounds[-1] = nrows
+        for i in range(mpi_size-1):
+            start = bounds[i]
+            share = rank_weights[i] / rank_weights[i:].sum() if rank_weights[i:].sum() > 0 else 0.0
+            target = boundary_cost[start] + share * (boundary_cost[-1] - boundary_cost[start])
+            end = int(np.searchsorted(boundary_cost, target))
+            end = min(max(end, start), nrows)
+            if end > start and (target - boundary_cost[end-1]) < (boundary_cost[end] - target):
+                end -= 1
+            # rows still needed by the following ranks with capacity
+            later = int(np.count_nonzero(rank_weights[i+1:] > 0))
+            if rank_weights[i] > 0 and nrows - start > later:
+                end = max(end, start+1)
+            bounds[i+1] = min(end, max(nrows - later, start))
+        sizes = np.diff(bounds)
+        offsets = bounds[:-1]
+        return sizes, offsets
+
+
+    # split rows in near-equal counts
     @staticmethod
-    def split_array_indicies(shape, mpi_size):
+    def _split_array_indicies_even(shape, mpi_size):
         # nodes calculate offsets and sizes for sharing
         chunk_size = shape[0] // mpi_size
         leftover = shape[0] % mpi_size
-        sizes = np.ones(mpi_size, dtype=np.int) * chunk_size
+        sizes = np.ones(mpi_size, dtype=int) * chunk_size
         # evenly distribute leftover across workers
         # NOTE: currently doesn't add leftover to rank 0, 
         # since rank 0 usually has extra work to perform already
         sizes[1:leftover+1] += 1
-        offsets = np.zeros(mpi_size, dtype=np.int)
+        offsets = np.zeros(mpi_size, dtype=int)
         offsets[1:] = np.cumsum(sizes)[:-1]
         return sizes, offsets
@@ -9,8 +9,6 @@ size = comm.Get_size()
 import numpy as np
 import os
 import time
-import tomopy
-import dxchange
 from mpiarray import MpiArray
 
 import logging
@@ -26,64 +24,165 @@ logger.setLevel(logging.INFO)
 working_dir = "/mnt/ssd0/xray/20151216_APS_32ID/rs64_5X_9200eV_2s"
 filename = 'rs64_241proj_5X_9200eV_2_.h5'
 
-os.chdir(working_dir)
-start = time.time()
-
-# Read HDF5 file.
-logger.info("Reading data from H5 file %s" % filename)
-#TODO: read directly into different mpi processes
-if rank == 0:
-    # read data into root node
-    proj, flat, dark, theta = dxchange.read_aps_32id(filename, dtype=np.float32)
-else:
-    proj, flat, dark, theta = None, None, None, None
-
-# create MpiArray from Proj data
-proj = MpiArray.fromglobalarray(proj)
-proj.scatter(0)
-proj.arr = None # remove full array to save memory
-
-# share flats, darks, and theta to all MPI nodes
-flat = comm.bcast(flat, root=0)
-dark = comm.bcast(dark, root=0)
-theta = comm.bcast(theta, root=0)
-
-# Flat field correct data
-logger.info("Flat field correcting data")
-proj.scatter(0)
-tomopy.normalize(proj.local_arr, flat, dark, ncore=1, out=proj.local_arr)
-np.clip(proj.local_arr, 1e-6, 1.0, proj.local_arr)
-del flat, dark
-
-# Remove Stripe
-# NOTE: we need to change remove_strip_fw to take sinogram order data, since it internally rotates the data
-#proj.scatter(1)
-#proj.local_arr = tomopy.remove_stripe_fw(proj.local_arr, ncore=1)
-
-# Take the minus log to prepare for reconstruction
-#NOTE: no scatter required since minus_log doesn't care about order
-tomopy.minus_log(proj.local_arr, ncore=1, out=proj.local_arr)
-
-# Find rotation center per set of sinograms
-logger.info("Finding center of rotation")
-proj.scatter(1)
-# NOTE: center finding doesn't work for my datasets :-(
-#center = tomopy.find_center(proj.local_arr, theta, sinogram_order=True)
-center = proj.shape[2] // 2
-logger.info("Center for sinograms [%d:%d] is %f" % (proj.offset, proj.offset+proj.size, center))
-
-alg = 'gridrec'
-logger.info("Reconstructing using: %s" % alg)
-# Reconstruct object using algorithm
-proj.scatter(1)
-rec = tomopy.recon(proj.local_arr,
-                   theta,
-                   center=center,
-                   algorithm=alg,                           
-                   sinogram_order=True,
-                   ncore=1)
-logger.info("Writing result to file")
-dxchange.write_tiff_stack(rec, fname='%s(mpi)/recon' % (alg), start=proj.offset, overwrite=True)
-
-logger.info("Done in %0.2f seconds"%(time.time() - start))
-
+do_outliers2d = False # outlier removal, standard 2d on each projection
+outlier_diff2d = 750 # difference between good data and outlier data
+outlier_size2d = 3 # size of the median filter
+
+cor_rows_per_rank = 2 # sinogram rows each rank searches for the center of rotation
+cor_fit = 'median' # combine center estimates: 'median' or 'linear' (linear also measures axis tilt)
+
+# ghost rows each stage needs from the neighbouring slabs (its footprint),
+# indexed by the distributed axis: (projections, sinograms)
+halo_footprint = {
+    'remove_outlier2d': (0, outlier_size2d // 2), # 2-D median within each projection
+}
+
+# run a stage on the local slab, exchanging ghost rows if its footprint
+# crosses the slab boundaries
+def run_stage(mpiarray, stage, func, *args, **kwargs):
+    k = halo_footprint.get(stage, (0, 0))[mpiarray.axis]
+    if k > 0:
+        return mpiarray.apply_halo(func, k, *args, **kwargs)
+    result = func(mpiarray.local_arr, *args, **kwargs)
+    if result is not None:
+        mpiarray.local_arr = result
+    return mpiarray.local_arr
+
+# Combine (sinogram row, center) estimates into center = intercept + slope * row.
+# fit='median' uses the median of all estimates (slope 0), fit='linear' fits the
+# center against the sinogram row, which also gives the tilt of the rotation
+# axis, and refits without outliers. default_center is used if there are no
+# estimates. Returns (intercept, slope).
+def fit_center(estimates, fit='median', default_center=0.0):
+    estimates = np.asarray(estimates, dtype=np.float64).reshape(-1, 2)
+    if len(estimates) == 0:
+        logger.warning("No center found, using the middle of the detector")
+        return (default_center, 0.0)
+    if fit == 'linear' and len(estimates) > 2:
+        sino_rows, centers = estimates[:, 0], estimates[:, 1]
+        slope, intercept = np.polyfit(sino_rows, centers, 1)
+        # refit without outliers (more than 3 median absolute deviations)
+        resid = np.abs(centers - (intercept + slope * sino_rows))
+        keep = resid <= 3 * max(np.median(resid), 0.25)
+        if keep.sum() > 2:
+            slope, intercept = np.polyfit(sino_rows[keep], centers[keep], 1)
+        logger.info("Center %f + %f * sinogram from %d estimates, axis tilt %f degrees"
+                    % (intercept, slope, keep.sum(), np.degrees(np.arctan(slope))))
+        return (intercept, slope)
+    center = np.median(estimates[:, 1])
+    logger.info("Center %f (median of %d estimates)" % (center, len(estimates)))
+    return (center, 0.0)
+
+# Find the center of rotation on a few sinogram rows of every rank's slab
+# (sinogram order) in parallel, then combine the estimates of all ranks
+# with fit_center. Returns the center of each local sinogram.
+def find_center_mpi(proj, rows_per_rank=1, fit='median'):
+    # lazy load tomopy
+    import tomopy
+    # evenly spaced rows inside this slab
+    n = min(rows_per_rank, proj.size)
+    rows = np.unique(((np.arange(n) + 0.5) * proj.size / max(n, 1)).astype(int))
+    estimates = []
+    for row in rows:
+        # find_center_vo expects projection order
+        tomo = np.swapaxes(proj.local_arr[row:row+1], 0, 1)
+        try:
+            center = tomopy.find_center_vo(tomo, ind=0)
+        except Exception as e:
+            logger.warning("Center search failed on sinogram %d: %s" % (proj.offset+row, e))
+            continue
+        if np.isfinite(center):
+            estimates.append((proj.offset+row, center))
+    estimates = comm.gather(estimates, root=0)
+    params = None
+    if rank == 0:
+        estimates = [e for rank_estimates in estimates for e in rank_estimates]
+        params = fit_center(estimates, fit, default_center=proj.shape[2] // 2)
+    intercept, slope = comm.bcast(params, root=0)
+    if slope == 0.0:
+        return intercept
+    return intercept + slope * (proj.offset + np.arange(proj.size))
+
+def main():
+    # lazy load tomopy and dxchange, only needed to run the reconstruction
+    import tomopy
+    import dxchange
+
+    os.chdir(working_dir)
+    start = time.time()
+
+    # Read HDF5 file.
+    logger.info("Reading data from H5 file %s" % filename)
+    #TODO: read directly into different mpi processes
+    if rank == 0:
+        # read data into root node
+        proj, flat, dark, theta = dxchange.read_aps_32id(filename, dtype=np.float32)
+    else:
+        proj, flat, dark, theta = None, None, None, None
+
+    # create MpiArray from Proj data
+    proj = MpiArray.fromglobalarray(proj)
+    proj.scatter(0)
+    proj.arr = None # remove full array to save memory
+
+    # share flats, darks, and theta to all MPI nodes
+    flat = comm.bcast(flat, root=0)
+    dark = comm.bcast(dark, root=0)
+    theta = comm.bcast(theta, root=0)
+
+    # Remove outliers
+    if do_outliers2d:
+        logger.info("Removing outliers")
+        # median is taken within each projection, which is local axis 0 in
+        # projection order and local axis 1 in sinogram order
+        run_stage(proj, 'remove_outlier2d', tomopy.remove_outlier, outlier_diff2d,
+                  size=outlier_size2d, axis=proj.axis, ncore=1)
+
+    # Flat field correct data
+    logger.info("Flat field correcting data")
+    proj.scatter(0)
+    tomopy.normalize(proj.local_arr, flat, dark, ncore=1, out=proj.local_arr)
+    np.clip(proj.local_arr, 1e-6, 1.0, proj.local_arr)
+    del flat, dark
+
+    # Remove Stripe
+    # NOTE: we need to change remove_strip_fw to take sinogram order data, since it internally rotates the data
+    #proj.scatter(1)
+    #proj.local_arr = tomopy.remove_stripe_fw(proj.local_arr, ncore=1)
+
+    # Take the minus log to prepare for reconstruction
+    #NOTE: no scatter required since minus_log doesn't care about order
+    tomopy.minus_log(proj.local_arr, ncore=1, out=proj.local_arr)
+
+    # Find rotation center per set of sinograms
+    logger.info("Finding center of rotation")
+    proj.scatter(1)
+    center = find_center_mpi(proj, rows_per_rank=cor_rows_per_rank, fit=cor_fit)
+    logger.info("Center for sinograms [%d:%d] is %f" % (proj.offset, proj.offset+proj.size, np.mean(center)))
+
+    alg = 'gridrec'
+    logger.info("Reconstructing using: %s" % alg)
+    # Reconstruct object using algorithm
+    proj.scatter(1)
+    rec = tomopy.recon(proj.local_arr,
+                       theta,
+                       center=center,
+                       algorithm=alg,                           
+                       sinogram_order=True,
+                       ncore=1)
+
+    # Recon statistics over all ranks, without gathering the volume
+    rec = MpiArray.fromlocalarrays(rec, axis=0)
+    rec_min, rec_max = rec.min(), rec.max()
+    window = rec.percentile([0.1, 99.9], range=(rec_min, rec_max))
+    logger.info("Recon min %f, max %f, mean %f, std %f" % (rec_min, rec_max, rec.mean(), rec.std()))
+    logger.info("Suggested 8bit window (0.1-99.9 percentile): %f to %f" % (window[0], window[1]))
+    rec = rec.local_arr
+
+    logger.info("Writing result to file")
+    dxchange.write_tiff_stack(rec, fname='%s(mpi)/recon' % (alg), start=proj.offset, overwrite=True)
+
+    logger.info("Done in %0.2f seconds"%(time.time() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import inspect
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+import tifffile
+
+MPI_RANKS = 4
+
+
+def make_dir(*parts):
+    """Creates the directory os.path.join(*parts) if needed, returns its path."""
+    directory = os.path.join(*[str(part) for part in parts])
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return directory
+
+
+def write_dataset(directory, name, size=1024):
+    """Writes a raw dataset [name].h5 of size random bytes, returns its path."""
+    path = os.path.join(str(directory), name + ".h5")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def random_stack(shape, low=0.0, high=1.0, dtype=np.float32):
+    """Uniformly distributed values in [low, high) as dtype."""
+    return (np.random.rand(*shape) * (high - low) + low).astype(dtype)
+
+
+def write_images(directory, stack, pattern="rec_{}.tif", **layout):
+    """Writes each image of stack as a tiff file named pattern.format(index), returns the directory.
+
+    layout is passed to tifffile.imwrite (ex. compression, rowsperstrip, tile).
+    """
+    directory = make_dir(directory)
+    for i, image in enumerate(stack):
+        tifffile.imwrite(os.path.join(directory, pattern.format(i)), image, **layout)
+    return directory
+
+
+def random_images(directory, shape, low=0.0, high=1.0, dtype=np.float32, pattern="rec_{}.tif", **layout):
+    """Writes a random_stack as tiff files (see write_images), returns (directory, stack)."""
+    stack = random_stack(shape, low, high, dtype)
+    return write_images(directory, stack, pattern, **layout), stack
+
+
+def run_tests(*tests):
+    """Runs test functions without pytest, those taking tmp_path get a temporary directory removed afterwards."""
+    for test in tests:
+        if "tmp_path" in inspect.signature(test).parameters:
+            with tempfile.TemporaryDirectory() as directory:
+                test(pathlib.Path(directory))
+        else:
+            test()
+
+
+def run_mpi(script, check, ranks=MPI_RANKS):
+    """Runs python script check on ranks MPI processes, each must print "ok [check]"."""
+    if shutil.which("mpirun") is None:
+        pytest.skip("mpirun not available")
+    pytest.importorskip("mpi4py")
+    env = dict(os.environ, OMPI_ALLOW_RUN_AS_ROOT="1", OMPI_ALLOW_RUN_AS_ROOT_CONFIRM="1",
+               OMPI_MCA_rmaps_base_oversubscribe="1")
+    result = subprocess.run(["mpirun", "-n", str(ranks), sys.executable, os.path.abspath(script), check],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+    output = result.stdout.decode(errors="replace")
+    assert result.returncode == 0, output
+    assert output.count("ok " + check) == ranks, output
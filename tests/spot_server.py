@@ -0,0 +1,266 @@
+"""
+Local stand-in for the SPOT API, used by the tests and benchmarks.
+
+Serves raw datasets (.h5 files) from a local directory under the same URL
+layout as https://portal-auth.nersc.gov so that a SpotSession can be pointed
+at it with baseURL=server.url.
+
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username='testuser', password='test', baseURL=server.url)
+        s.download('dataset_name')
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class SpotTestServer(object):
+    """Threaded HTTP server implementing the SPOT endpoints used by SpotSession.
+
+    Attributes
+        ----------
+        dataDir : str
+            Directory holding the raw datasets, one [dataset].h5 per dataset,
+            and optionally a directory [dataset] with its images as .tif files.
+        url : str
+            Base URL of the running server.
+        requests : list
+            (method, path) of every request received.
+        connections : set
+            Client addresses of all connections, one per TCP connection.
+        failDownloads : int
+            Number of download responses to cut off halfway (to test resume).
+        failOffset : int
+            Only responses starting at or after this byte offset are cut off.
+        stageDelay : dict
+            Number of stage requests for a dataset that answer "staging"
+            before it is reported as staged (datasets not listed are online).
+        stageError : dict
+            HTTP status to answer the stage requests of a dataset with.
+        failStatus : int
+            Number of GET requests to answer with 503 (to test retries).
+        delay : float
+            Seconds every GET request waits before it is answered.
+
+    """
+
+    def __init__(self, dataDir, username='testuser', password='test', port=0):
+        self.dataDir = dataDir
+        self.username = username
+        self.password = password
+        self.requests = []
+        self.connections = set()
+        self.failDownloads = 0
+        self.failOffset = 0
+        self.stageDelay = {}
+        self.stageError = {}
+        self.failStatus = 0
+        self.delay = 0.0
+        self.sessionId = 1
+        self.sessionCookies = True  # False: login sets no cookie and none is needed (token authentication)
+        self.lock = threading.Lock()
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def expire_sessions(self):
+        """Invalidates the session cookies handed out so far."""
+        with self.lock:
+            self.sessionId += 1
+
+    def count(self, pattern):
+        """Number of requests whose path matches the regular expression pattern."""
+        return len([path for method, path in self.requests if re.search(pattern, path)])
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                self._record()
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                if self.path.startswith("/als/auth"):
+                    auth = form.get("password", [None])[0] == server.password
+                    headers = {"Set-Cookie": "newt_sessionid={}; Path=/".format(server.sessionId)} \
+                        if auth and server.sessionCookies else {}
+                    return self._send_json({"auth": auth}, headers=headers)
+                self._send_json({"error": "not found"}, status=404)
+
+            def do_GET(self):
+                self._record()
+                if server.delay:
+                    time.sleep(server.delay)
+                with server.lock:
+                    fail = server.failStatus > 0
+                    if fail:
+                        server.failStatus -= 1
+                if fail:
+                    return self._send_json({"error": "unavailable"}, status=503)
+                url = urlparse(self.path)
+                path = url.path
+                if path.startswith("/als/auth"):
+                    return self._send_json({"auth": self._authenticated()})
+                if not self._authenticated():
+                    return self._send_json({"error": "not authenticated"}, status=401)
+                m = re.match(r"/als/hdf/download/als/bl832/([^/]+)/([^/]+)/raw/([^/]+)$", path)
+                if m:
+                    return self._send_file(os.path.join(server.dataDir, m.group(2) + ".h5"))
+                m = re.match(r"/als/hdf/stageifneeded/als/bl832/([^/]+)/([^/]+)/raw/([^/]+)$", path)
+                if m:
+                    return self._send_stage(m.group(2))
+                if path == "/als/hdf/search":
+                    return self._send_search(parse_qs(url.query))
+                if path == "/als/hdf/dataset":
+                    return self._send_json(self._derived(parse_qs(url.query).get("dataset", [""])[0]))
+                m = re.match(r"/als/hdf/rawdata/als/bl832/([^/]+)/([^/]+)/raw/([^/]+)$", path)
+                if m:
+                    image = parse_qs(url.query).get("group", [""])[0]
+                    return self._send_file(os.path.join(server.dataDir, m.group(2), os.path.basename(image)))
+                m = re.match(r"/als/hdf/(attributes|listimages)/als/bl832/([^/]+)/([^/]+)/raw/([^/]+)$", path)
+                if m:
+                    if not os.path.exists(os.path.join(server.dataDir, m.group(3) + ".h5")):
+                        return self._send_json({"error": "not found"}, status=404)
+                    if m.group(1) == "attributes":
+                        return self._send_json({"dataset": m.group(3), "size": self._size(m.group(3))})
+                    return self._send_json(self._images(m.group(3)))
+                self._send_json({"error": "not found"}, status=404)
+
+            def _record(self):
+                with server.lock:
+                    server.requests.append((self.command, self.path))
+                    server.connections.add(self.client_address)
+
+            def _authenticated(self):
+                if not server.sessionCookies:
+                    return True
+                cookie = "newt_sessionid={}".format(server.sessionId)
+                return re.search(cookie + "(;|$)", self.headers.get("Cookie", "")) is not None
+
+            def _send_json(self, data, status=200, headers=None):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _datasets(self):
+                return sorted(os.path.splitext(name)[0] for name in os.listdir(server.dataDir)
+                              if name.endswith(".h5"))
+
+            def _size(self, dataset):
+                return os.path.getsize(os.path.join(server.dataDir, dataset + ".h5"))
+
+            def _dataset(self, dataset):
+                return {"name": dataset, "fs": {"size": self._size(dataset)}} if dataset in self._datasets() else {}
+
+            def _derived(self, dataset):
+                if dataset not in self._datasets():
+                    return []
+                return [{"name": dataset, "path": "/als/bl832/{}/{}/raw/{}.h5".format(server.username, dataset, dataset)}]
+
+            def _images(self, dataset):
+                # images are the .tif files in the directory [dataset], three dummy names if there is none
+                imageDir = os.path.join(server.dataDir, dataset)
+                if os.path.isdir(imageDir):
+                    names = sorted(name for name in os.listdir(imageDir) if name.endswith(".tif"))
+                else:
+                    names = ["{}_{:04d}.tif".format(dataset, i) for i in range(3)]
+                return [dataset + "/" + name for name in names]
+
+            def _send_search(self, query):
+                term = query.get("search", [""])[0]
+                skip = int(query.get("skipnum", [0])[0])
+                limit = int(query.get("limitnum", [10])[0])
+                found = [self._dataset(name) for name in self._datasets() if term in name]
+                self._send_json(found[skip:skip + limit])
+
+            def _send_stage(self, dataset):
+                if dataset in server.stageError:
+                    return self._send_json({"error": "stage failed"}, status=server.stageError[dataset])
+                with server.lock:
+                    remaining = server.stageDelay.get(dataset, 0)
+                    server.stageDelay[dataset] = max(remaining - 1, 0)
+                if remaining > 0:
+                    return self._send_json({"status": "staging"})
+                self._send_json({"status": "staged", "location": os.path.join(server.dataDir, dataset + ".h5")})
+
+            def _send_file(self, filePath):
+                if not os.path.exists(filePath):
+                    return self._send_json({"error": "not found"}, status=404)
+                size = os.path.getsize(filePath)
+                start, end = 0, size - 1
+                status = 200
+                m = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+                if m:
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header("Content-Range", "bytes */{}".format(size))
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status = 206
+                length = end - start + 1
+                with server.lock:
+                    fail = server.failDownloads > 0 and length > 1 and start >= server.failOffset
+                    if fail:
+                        server.failDownloads -= 1
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(length))
+                if status == 206:
+                    self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+                self.end_headers()
+                with open(filePath, "rb") as f:
+                    f.seek(start)
+                    remaining = length // 2 if fail else length
+                    while remaining > 0:
+                        data = f.read(min(remaining, 1024 ** 2))
+                        if not data:
+                            break
+                        self.wfile.write(data)
+                        remaining -= len(data)
+                if fail:
+                    # drop the connection halfway through the body
+                    self.close_connection = True
+                    self.wfile.flush()
+                    self.connection.shutdown(2)
+
+        return Handler
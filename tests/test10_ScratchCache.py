@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from helpers import make_dir, read_file, run_tests, write_dataset
+
+
+def make_datasets(sourceDir, number=5, size=1024 ** 2):
+    return [write_dataset(sourceDir, "dataset{}".format(i), size) for i in range(number)]
+
+
+def cached_files(cacheDir):
+    return [name for root, dirs, names in os.walk(cacheDir) for name in names]
+
+
+def test_batch_prefetch_and_evict(tmp_path):
+    sourceDir, cacheDir = make_dir(tmp_path, "source"), make_dir(tmp_path, "cache")
+    sources = make_datasets(sourceDir)
+    cache = dm.ScratchCache(cacheDir, maxBytes=3 * 1024 ** 2, prefetch=1)
+    for source, path in cache.batch(sources):
+        assert path.startswith(cacheDir) and os.path.basename(path) == os.path.basename(source)
+        assert read_file(source) == read_file(path)
+        time.sleep(0.2)  # processing, the next dataset is copied meanwhile
+        assert len(cached_files(cacheDir)) <= 3
+    cache.close()
+    assert cache.hits + cache.misses == len(sources)
+    assert cache.hits >= len(sources) - 1
+    assert cache.savedTime > 0
+
+
+def test_too_large_reads_in_place(tmp_path):
+    sourceDir, cacheDir = make_dir(tmp_path, "source"), make_dir(tmp_path, "cache")
+    sources = make_datasets(sourceDir, number=2)
+    cache = dm.ScratchCache(cacheDir, maxBytes=1024, prefetch=1)
+    assert cache.get(sources[0]) == sources[0]
+    cache.close()
+    assert os.listdir(cacheDir) == []
+
+
+def test_prefetch_waits_for_room(tmp_path):
+    sourceDir, cacheDir = make_dir(tmp_path, "source"), make_dir(tmp_path, "cache")
+    sources = make_datasets(sourceDir)
+    cache = dm.ScratchCache(cacheDir, maxBytes=2 * 1024 ** 2, prefetch=2)
+    for source, path in cache.batch(sources):
+        # every dataset is read from the cache, the ones not fitting are copied after a release
+        assert path != source
+        time.sleep(0.2)
+        assert len(cached_files(cacheDir)) <= 2
+    cache.close()
+    assert cache.hits == len(sources) - 1 and cache.misses == 1
+
+
+def test_same_file_names(tmp_path):
+    sourceDirs = [make_dir(tmp_path, "a", "data"), make_dir(tmp_path, "b", "data")]
+    sources = [make_datasets(sourceDir, number=1, size=1024)[0] for sourceDir in sourceDirs]
+    assert os.path.basename(sources[0]) == os.path.basename(sources[1])
+    cache = dm.ScratchCache(make_dir(tmp_path, "cache"), maxBytes=1024 ** 2, prefetch=1)
+    paths = [cache.get(source) for source in sources]
+    cache.close()
+    assert paths[0] != paths[1]
+    for source, path in zip(sources, paths):
+        assert read_file(source) == read_file(path)
+
+
+def test_leftovers_counted_and_evicted(tmp_path):
+    sourceDir, cacheDir = make_dir(tmp_path, "source"), make_dir(tmp_path, "cache")
+    sources = make_datasets(sourceDir, number=2)
+    leftover = write_dataset(make_dir(cacheDir, "earlier"), "old", 1024 ** 2)
+    write_dataset(cacheDir, "unfinished", 1024)
+    os.rename(os.path.join(cacheDir, "unfinished.h5"), os.path.join(cacheDir, "unfinished.h5.part"))
+    cache = dm.ScratchCache(cacheDir, maxBytes=2 * 1024 ** 2, prefetch=1)
+    assert cache.used == 1024 ** 2
+    assert not os.path.exists(os.path.join(cacheDir, "unfinished.h5.part"))
+    for source, path in cache.batch(sources):
+        assert path != source
+        assert len(cached_files(cacheDir)) <= 2
+    cache.close()
+    assert not os.path.exists(leftover)
+
+
+def test_leftover_copy_reused(tmp_path):
+    sourceDir, cacheDir = make_dir(tmp_path, "source"), make_dir(tmp_path, "cache")
+    source = make_datasets(sourceDir, number=1)[0]
+    cache = dm.ScratchCache(cacheDir, maxBytes=2 * 1024 ** 2)
+    path = cache.get(source)
+    cache.close()
+    # same size and modification time: reused without reading the source again
+    checksum = dm.file_checksum
+    dm.file_checksum = None
+    try:
+        cache = dm.ScratchCache(cacheDir, maxBytes=2 * 1024 ** 2)
+        assert cache.used == 1024 ** 2
+        assert cache.get(source) == path
+        cache.close()
+    finally:
+        dm.file_checksum = checksum
+    assert cache.used == 1024 ** 2
+    # changed source of the same size: copied again
+    with open(source, "r+b") as f:
+        f.write(b"changed")
+    os.utime(source, (time.time() + 10, time.time() + 10))
+    cache = dm.ScratchCache(cacheDir, maxBytes=2 * 1024 ** 2)
+    assert cache.get(source) == path
+    cache.close()
+    assert read_file(source) == read_file(path)
+
+
+if __name__ == "__main__":
+    run_tests(test_batch_prefetch_and_evict, test_too_large_reads_in_place, test_prefetch_waits_for_room,
+              test_same_file_names, test_leftovers_counted_and_evicted, test_leftover_copy_reused)
+    print("scratch cache tests passed")
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+
+import h5py
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from helpers import make_dir, run_tests
+
+
+def make_dataset(directory, name, nangles, arange=180):
+    with h5py.File(os.path.join(directory, name + ".h5"), "w") as f:
+        group = f.create_group(name)
+        group.attrs["nangles"] = str(nangles).encode()
+        group.attrs["nslices"] = 2160
+        group.attrs["nrays"] = 2560
+        group.attrs["arange"] = float(arange)
+        group.attrs["pxsize"] = b"0.00065"
+        group.attrs["i0cycle"] = 0
+
+
+def test_scan_and_find(tmp_path):
+    dataDir = make_dir(tmp_path, "data")
+    make_dir(dataDir, "sub")
+    make_dataset(dataDir, "20160610_150949_parrotfish_10x_35keV", 2049)
+    make_dataset(dataDir, "20160610_182027_parrotfish_2x_24keV", 1025)
+    make_dataset(os.path.join(dataDir, "sub"), "20160712_101010_coral_10x_24keV", 2625, arange=360)
+    with open(os.path.join(dataDir, "broken.h5"), "wb") as f:
+        f.write(b"not hdf5")
+
+    catalog = dm.DatasetCatalog(str(tmp_path / "catalog.db"))
+    counts = catalog.scan(dataDir, maxWorkers=2)
+    assert counts["added"] == 3 and counts["failed"] == 1
+
+    rows = catalog.find(name="%10x%", after="2016-06", before="2016-07", nangles=(2001, None))
+    assert [row["name"] for row in rows] == ["20160610_150949_parrotfish_10x_35keV"]
+    assert rows[0]["nangles"] == 2049 and abs(rows[0]["pxsize"] - 0.00065) < 1e-9
+    assert rows[0]["date"] == "2016-06-10 15:09:49"
+    assert len(catalog.find(arange=(300, None))) == 1
+    assert len(catalog.find(where="nrays = ?", params=(2560,))) == 3
+
+    inputs = catalog.recon_inputs(catalog.find(name="%coral%"), outputPath="/tmp/rec/")
+    assert inputs == [{"filename": "20160712_101010_coral_10x_24keV.h5",
+                       "inputPath": os.path.join(dataDir, "sub") + "/", "outputPath": "/tmp/rec/"}]
+
+    # only changed files are read again
+    counts = catalog.scan(dataDir)
+    assert counts["unchanged"] == 3 and counts["added"] == 0
+    time.sleep(0.01)
+    make_dataset(dataDir, "20160610_182027_parrotfish_2x_24keV", 3000)
+    os.remove(os.path.join(dataDir, "sub", "20160712_101010_coral_10x_24keV.h5"))
+    counts = catalog.scan(dataDir)
+    assert counts["updated"] == 1 and counts["removed"] == 1
+    assert catalog.find(name="%2x%")[0]["nangles"] == 3000
+    catalog.close()
+
+
+if __name__ == "__main__":
+    run_tests(test_scan_and_find)
+    print("catalog tests passed")
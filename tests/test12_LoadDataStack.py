@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import image_processing as ip
+from helpers import random_images, run_tests
+
+
+def test_natural_order_and_dtype(tmp_path):
+    directory, stack = random_images(tmp_path / "rec", (12, 20, 30), 0, 100)  # no zero padding
+    assert [os.path.basename(f) for f in ip.get_fileList(directory)][:3] == ["rec_0.tif", "rec_1.tif", "rec_2.tif"]
+    data = ip.load_DataStack(directory, maxWorkers=4)
+    assert data.dtype == np.float32
+    assert np.array_equal(data, stack)
+    data = ip.load_DataStack(directory, imagerange=(3, 9))
+    assert np.array_equal(data, stack[3:9])
+
+
+def test_out_and_memmap(tmp_path):
+    directory, stack = random_images(tmp_path / "rec", (12, 20, 30), 0, 100, np.uint16)
+    out = np.zeros(stack.shape, dtype=np.float32)
+    assert ip.load_DataStack(directory, out=out) is out
+    assert np.array_equal(out, stack)
+    memmap = str(tmp_path / "stack.npy")
+    data = ip.load_DataStack(directory, memmap=memmap)
+    data.flush()
+    assert np.array_equal(np.load(memmap, mmap_mode='r'), stack)
+    try:
+        ip.load_DataStack(directory, out=np.zeros((2, 20, 30)))
+        assert False, "wrong out shape should raise"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    run_tests(test_natural_order_and_dtype, test_out_and_memmap)
+    print("load tests passed")
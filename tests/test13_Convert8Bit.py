@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+import tifffile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import image_processing as ip
+from helpers import random_images, run_tests
+
+
+def reference_8bit(rec, data_min, data_max):
+    # same float32 arithmetic as convert_ArrayTo8bit, values next to a rounding step would differ in float64
+    scl = np.float32(0.5) + np.float32(255) * (rec.astype(np.float32) - np.float32(data_min)) / np.float32(data_max - data_min)
+    return np.clip(scl, 0, 255).astype(np.uint8)
+
+
+def test_convert_array():
+    rec = (np.random.rand(64, 64) * 30 - 15).astype(np.float32)
+    assert np.array_equal(ip.convert_ArrayTo8bit(rec, -10.0, 10.0), reference_8bit(rec, -10.0, 10.0))
+    out = np.empty(rec.shape, dtype=np.uint8)
+    assert ip.convert_ArrayTo8bit(rec, -10.0, 10.0, out=out) is out
+
+
+def test_convert_directory(tmp_path):
+    directory, stack = random_images(tmp_path / "rec", (10, 16, 24), -15, 15, pattern="rec_{:04d}.tif")
+    outputpath = str(tmp_path / "out8")
+    ip.convert_DirectoryTo8Bit(directory, data_min=-10.0, data_max=10.0, outputpath=outputpath, filename="rec8",
+                               maxWorkers=3)
+    fileList = ip.get_fileList(outputpath)
+    assert len(fileList) == len(stack)
+    for i in range(len(stack)):
+        assert np.array_equal(tifffile.imread(fileList[i]), reference_8bit(stack[i], -10.0, 10.0))
+
+
+def test_convert_directory_stack(tmp_path):
+    directory, stack = random_images(tmp_path / "rec", (13, 16, 24), -15, 15, pattern="rec_{:04d}.tif")
+    outputpath = str(tmp_path)
+    ip.convert_DirectoryTo8Bit(directory, data_min=-10.0, data_max=10.0, outputpath=outputpath, filename="rec8",
+                               maxWorkers=2, stack=True)
+    data = tifffile.imread(os.path.join(outputpath, "rec8.tiff"))
+    assert np.array_equal(data, reference_8bit(stack, -10.0, 10.0))
+
+
+if __name__ == "__main__":
+    run_tests(test_convert_array, test_convert_directory, test_convert_directory_stack)
+    print("8 bit conversion tests passed")
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import image_processing as ip
+from helpers import random_images, run_tests
+
+
+def test_indexing(tmp_path):
+    directory, stack = random_images(tmp_path, (20, 16, 24), -15, 15)
+    volume = ip.TiffVolume(directory)
+    assert volume.shape == stack.shape and volume.dtype == np.float32 and len(volume) == 20
+    for key in [5, -1, (3, 4), (3, 4, 5), slice(2, 9), (slice(None, None, 3), slice(2, 10), slice(None, None, -2)),
+                (Ellipsis, 7), ([1, 4, 2], slice(None), 3), (stack[:, 0, 0] > 0,), (slice(5, 5),)]:
+        assert np.array_equal(volume[key], stack[key]), key
+    assert np.array_equal(np.asarray(volume), stack)
+    assert np.array_equal(ip.crop_Array(volume, xRange=(2, 10), yRange=(5, None), zRange=(3, 8)),
+                          stack[3:8, 2:10, 5:])
+    assert np.array_equal(ip.convert_ArrayTo8bit(volume, -10, 10), ip.convert_ArrayTo8bit(stack, -10, 10))
+
+
+def test_lru_cache(tmp_path):
+    directory, stack = random_images(tmp_path, (20, 16, 24), -15, 15)
+    sliceBytes = stack[0].nbytes
+    volume = ip.TiffVolume(directory, cacheSize=4 * sliceBytes)
+    volume[0:10]
+    assert volume.cacheBytes <= 4 * sliceBytes
+    assert sorted(volume.cache.keys()) == [6, 7, 8, 9]
+    hits = volume.hits
+    volume[8, 2:4]
+    assert volume.hits == hits + 1
+    volume[0]
+    assert 6 not in volume.cache and 0 in volume.cache
+    try:
+        volume[9][0, 0] = 1
+        assert False, "cached slices are read only"
+    except ValueError:
+        pass
+    try:
+        volume[20]
+        assert False, "out of range should raise"
+    except IndexError:
+        pass
+
+
+if __name__ == "__main__":
+    run_tests(test_indexing, test_lru_cache)
+    print("volume tests passed")
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import numpy as np
+import tifffile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import image_processing as ip
+from helpers import random_images, random_stack, run_tests
+
+LAYOUTS = [{}, {"compression": "zlib", "rowsperstrip": 5}, {"compression": "zlib", "tile": (16, 16)},
+           {"byteorder": ">"}]
+
+
+def test_read_region(tmp_path):
+    for layout in LAYOUTS:
+        path = str(tmp_path / "image.tif")
+        image = random_stack((45, 70), 0, 60000, np.uint16)
+        tifffile.imwrite(path, image, **layout)
+        for xRange, yRange in [((0, None), (0, None)), ((7, 23), (3, 50)), ((40, None), (60, 70)),
+                               ((16, 32), (16, 32)), ((0, 1), (69, None)), ((10, 10), (0, None)), ((-5, None), (0, -3))]:
+            region = ip.read_Region(path, xRange, yRange)
+            assert region.dtype == image.dtype
+            assert np.array_equal(region, image[xRange[0]:xRange[1], yRange[0]:yRange[1]]), (layout, xRange, yRange)
+
+
+def make_directory(tmp_path):
+    return random_images(tmp_path / "rec", (12, 30, 40), -10, 10, compression="zlib", rowsperstrip=4)
+
+
+def test_crop_directory(tmp_path):
+    directory, stack = make_directory(tmp_path)
+    xRange, yRange, zRange = (5, 21), (10, None), (2, 9)
+    ip.crop_Directory(directory, xRange, yRange, zRange, filename="crop", maxWorkers=3)
+    output = directory.rstrip('/') + "_cropped/"
+    files = ip.get_fileList(output)
+    assert [os.path.basename(f) for f in files] == ["crop_{:04d}.tiff".format(i) for i in range(2, 9)]
+    assert np.array_equal(ip.load_DataStack(output), stack[2:9, 5:21, 10:])
+    assert xRange == (5, 21) and zRange == (2, 9)
+
+
+def test_crop_directory_stack(tmp_path):
+    directory, stack = make_directory(tmp_path)
+    output = str(tmp_path / "crop")
+    ip.crop_Directory(directory, (0, 12), (0, None), (3, None), outputpath=output, filename="crop", stack=True)
+    assert np.array_equal(tifffile.imread(os.path.join(output, "crop.tiff")), stack[3:, :12])
+
+
+if __name__ == "__main__":
+    run_tests(test_read_region, test_crop_directory, test_crop_directory_stack)
+    print("crop directory tests passed")
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import numpy as np
+import tifffile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import image_processing as ip
+from helpers import make_dir, random_images, run_tests
+
+
+def make_directory(tmp_path):
+    return random_images(tmp_path / "rec", (15, 20, 30), 0, 1000, np.uint16)
+
+
+def test_directory_to_stack(tmp_path):
+    directory, stack = make_directory(tmp_path)
+    ip.convert_DirectoryToTiffStack(directory, maxWorkers=3)
+    outputFile = directory.rstrip('/') + ".tiff"
+    with tifffile.TiffFile(outputFile) as tif:
+        assert tif.is_bigtiff and len(tif.pages) == len(stack)
+    assert np.array_equal(tifffile.imread(outputFile), stack)
+
+
+def test_stack_from_generator(tmp_path):
+    directory, stack = make_directory(tmp_path)
+    outputFile = str(tmp_path / "stack.tiff")
+    assert ip.write_TiffStack((image * 2 for image in stack), outputFile) == len(stack)
+    assert np.array_equal(tifffile.imread(outputFile), stack * 2)
+    outputPath = make_dir(tmp_path, "volume")
+    ip.save_TiffStack(ip.TiffVolume(directory), filename="volume.tif", outputPath=outputPath)
+    assert np.array_equal(tifffile.imread(os.path.join(outputPath, "volume.tiff")), stack)
+    ip.save_TiffStack(stack[0], filename="fit", outputPath=outputPath)
+    assert np.array_equal(tifffile.imread(os.path.join(outputPath, "fit.tiff")), stack[0])
+
+
+def test_array_to_directory(tmp_path):
+    directory, stack = make_directory(tmp_path)
+    outputFile = str(tmp_path / "stack.tiff")
+    ip.write_TiffStack(stack, outputFile)
+    outputPath = str(tmp_path / "slices")
+    ip.convert_ArrayToDirectory(tifffile.memmap(outputFile, mode='r'), filename="slice", outputPath=outputPath,
+                                maxWorkers=4)
+    files = ip.get_fileList(outputPath)
+    assert [os.path.basename(f) for f in files] == ["slice_{:04d}.tiff".format(i) for i in range(len(stack))]
+    assert np.array_equal(ip.load_DataStack(outputPath), stack)
+
+
+if __name__ == "__main__":
+    run_tests(test_directory_to_stack, test_stack_from_generator, test_array_to_directory)
+    print("tiff stack tests passed")
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import h5py
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import image_processing as ip
+from helpers import random_images, run_tests
+
+
+def block_mean(volume, factor):
+    z, y, x = (n // factor * factor for n in volume.shape)
+    volume = volume[:z, :y, :x].astype(np.float64)
+    return volume.reshape(z // factor, factor, y // factor, factor, x // factor, factor).mean(axis=(1, 3, 5))
+
+
+def test_pyramid_from_slabs(tmp_path):
+    volume = np.random.rand(32, 40, 48).astype(np.float32)
+    outputFile = str(tmp_path / "pyramid.h5")
+    with ip.PyramidBuilder(outputFile, levels=3, queueSize=1) as pyramid:
+        z = 0
+        for size in [3, 1, 7, 5, 16]:  # slab sizes do not need to line up with the blocks
+            pyramid.add(volume[z:z + size])
+            z += size
+    with h5py.File(outputFile, 'r') as h5:
+        for level in range(1, 4):
+            dataset = h5['level{}'.format(level)]
+            assert dataset.attrs['factor'] == 2 ** level and dataset.dtype == np.float32
+            assert dataset.chunks is not None
+            assert np.allclose(dataset[...], block_mean(volume, 2 ** level), atol=1e-5)
+        assert h5.attrs['slices'] == 32
+
+
+def test_pyramid_odd_sizes(tmp_path):
+    volume = (np.random.rand(13, 21, 30) * 200).astype(np.uint8)
+    outputFile = str(tmp_path / "pyramid.h5")
+    pyramid = ip.PyramidBuilder(outputFile, levels=2)
+    for image in volume:
+        pyramid.add(image)
+    assert pyramid.close() == [(7, 11, 15), (4, 6, 8)]
+    with h5py.File(outputFile, 'r') as h5:
+        level1 = h5['level1'][...]
+    assert level1.dtype == np.uint8
+    assert np.array_equal(level1[:6, :10], np.rint(block_mean(volume[:12, :20], 2)).astype(np.uint8))
+    # the last slice is averaged with itself
+    assert np.array_equal(level1[6, :10], np.rint(block_mean(volume[[12, 12], :20], 2)[0]).astype(np.uint8))
+
+
+def test_build_pyramid_directory(tmp_path):
+    directory, volume = random_images(tmp_path / "rec", (24, 16, 16))
+    outputFile = ip.build_Pyramid(directory, slabSize=5, maxWorkers=2)
+    assert outputFile == directory.rstrip('/') + "_pyramid.h5"
+    with h5py.File(outputFile, 'r') as h5:
+        assert np.allclose(h5['level3'][...], block_mean(volume, 8), atol=1e-5)
+
+
+if __name__ == "__main__":
+    run_tests(test_pyramid_from_slabs, test_pyramid_odd_sizes, test_build_pyramid_directory)
+    print("pyramid tests passed")
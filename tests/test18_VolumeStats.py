@@ -0,0 +1,84 @@
+import os
+import pickle
+import sys
+
+import h5py
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import image_processing as ip
+from helpers import run_tests, write_images
+
+
+def make_volume():
+    volume = np.random.normal(2.0, 4.0, (20, 32, 40)).astype(np.float32)
+    volume[3, 4, 5] = np.nan
+    return volume
+
+
+def check_stats(stats, volume, histRange):
+    finite = volume[np.isfinite(volume)].astype(np.float64)
+    assert stats.count == finite.size and stats.skipped == volume.size - finite.size
+    assert stats.min == finite.min() and stats.max == finite.max()
+    assert np.isclose(stats.mean, finite.mean()) and np.isclose(stats.std, finite.std())
+    histogram, edges = np.histogram(finite[(finite >= histRange[0]) & (finite < histRange[1])], bins=stats.bins,
+                                    range=histRange)
+    assert np.array_equal(stats.histogram, histogram)
+    assert stats.underflow == np.count_nonzero(finite < histRange[0])
+    assert stats.overflow == np.count_nonzero(finite >= histRange[1])
+    binWidth = (histRange[1] - histRange[0]) / stats.bins
+    assert np.allclose(stats.percentile([5, 50, 95]), np.percentile(finite, [5, 50, 95]), atol=2 * binWidth)
+
+
+def test_update_and_merge():
+    volume = make_volume()
+    histRange = (-5.0, 10.0)
+    whole = ip.VolumeStats(bins=300, histRange=histRange).update(volume)
+    check_stats(whole, volume, histRange)
+    # partial results from separate workers (pickled as between processes or MPI ranks) combine to the same counts
+    merged = ip.VolumeStats(bins=300, histRange=histRange)
+    for part in np.array_split(volume, 6):
+        partial = ip.VolumeStats(bins=300, histRange=histRange).update(part)
+        merged.merge(pickle.loads(pickle.dumps(partial)))
+    assert np.array_equal(merged.histogram, whole.histogram)
+    assert (merged.count, merged.min, merged.max, merged.underflow, merged.overflow) == \
+        (whole.count, whole.min, whole.max, whole.underflow, whole.overflow)
+    assert np.isclose(merged.mean, whole.mean) and np.isclose(merged.m2, whole.m2)
+    try:
+        merged.merge(ip.VolumeStats(bins=10, histRange=histRange).update(volume[0]))
+        assert False, "different bins should not merge"
+    except ValueError:
+        pass
+
+
+def test_integer_default_range():
+    volume = (np.random.rand(5, 10, 10) * 255).astype(np.uint8)
+    stats = ip.VolumeStats().update(volume)
+    assert stats.bins == 256 and stats.histRange == (0.0, 256.0)
+    assert np.array_equal(stats.histogram, np.bincount(volume.ravel(), minlength=256))
+    try:
+        ip.VolumeStats().update(volume.astype(np.float32))
+        assert False, "float data needs a histRange"
+    except ValueError:
+        pass
+
+
+def test_volume_stats_sources(tmp_path):
+    volume = make_volume()
+    histRange = (-5.0, 10.0)
+    directory = write_images(tmp_path / "rec", volume)
+    check_stats(ip.volume_Stats(directory, bins=300, histRange=histRange, slabSize=3, maxWorkers=4), volume, histRange)
+    h5path = str(tmp_path / "volume.h5")
+    with h5py.File(h5path, 'w') as h5:
+        h5.create_dataset("exchange/data", data=volume, chunks=(4, 32, 40))
+    check_stats(ip.volume_Stats(h5path, bins=300, histRange=histRange, slabSize=4), volume, histRange)
+    summary = ip.volume_Stats(volume, bins=300, histRange=histRange).summary()
+    assert summary['count'] == volume.size - 1 and summary['p1'] < summary['p50'] < summary['p99']
+
+
+if __name__ == "__main__":
+    run_tests(test_update_and_merge, test_integer_default_range, test_volume_stats_sources)
+    print("volume statistics tests passed")
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+import numpy as np
+import tifffile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import image_processing as ip
+from helpers import run_tests
+
+
+def make_stack():
+    stack = np.random.uniform(-5, 20, (6, 24, 32)).astype(np.float32)
+    stack[0, 0, 0] = -50  # clipped to data_min
+    stack[0, 0, 1] = 50  # clipped to data_max
+    return stack
+
+
+def test_uint16_roundtrip(tmp_path):
+    stack = make_stack()
+    fname = str(tmp_path / "rec" / "sample")
+    ip.write_EncodedStack(stack, fname, start=100, outputType='uint16', data_min=-10, data_max=30, unit='1/cm',
+                          maxWorkers=3)
+    files = ip.get_fileList(os.path.dirname(fname))
+    assert [os.path.basename(f) for f in files] == ["sample_{:05d}.tiff".format(i) for i in range(100, 106)]
+    with tifffile.TiffFile(files[0]) as tif:
+        assert tif.pages[0].dtype == np.uint16
+        calibration = json.loads(tif.pages[0].description)['calibration']
+        assert calibration['unit'] == '1/cm' and calibration['offset'] == -10
+    assert ip.read_Image(files[0], calibrated=False).dtype == np.uint16
+    expected = np.clip(stack, -10, 30)
+    step = 40.0 / 65535
+    # the loaders return the physical values
+    loaded = ip.load_DataStack(os.path.dirname(fname))
+    assert loaded.dtype == np.float32 and np.abs(loaded - expected).max() <= step / 2 + 1e-5
+    volume = ip.TiffVolume(os.path.dirname(fname))
+    assert volume.dtype == np.float32 and np.allclose(volume[2:4], loaded[2:4])
+    assert np.array_equal(ip.read_Region(files[1], (3, 9), (5, 20)), loaded[1, 3:9, 5:20])
+
+
+def test_float16_roundtrip(tmp_path):
+    stack = make_stack()
+    fname = str(tmp_path / "sample")
+    ip.write_EncodedStack(stack, fname, outputType='float16')
+    files = ip.get_fileList(os.path.dirname(fname))
+    loaded = ip.load_DataStack(os.path.dirname(fname))
+    assert loaded.dtype == np.float32 and np.allclose(loaded, stack, rtol=1e-3)
+    assert os.path.getsize(files[0]) < stack[0].nbytes * 0.6
+    try:
+        ip.encode_Array(stack, outputType='uint12')
+        assert False, "unknown encodings should raise"
+    except ValueError:
+        pass
+
+
+def test_plain_images_unchanged(tmp_path):
+    image = (np.random.rand(10, 10) * 1000).astype(np.uint16)
+    path = str(tmp_path / "image.tif")
+    tifffile.imwrite(path, image)
+    assert ip.read_Image(path).dtype == np.uint16 and np.array_equal(ip.read_Image(path), image)
+
+
+if __name__ == "__main__":
+    run_tests(test_uint16_roundtrip, test_float16_roundtrip, test_plain_images_unchanged)
+    print("encoding tests passed")
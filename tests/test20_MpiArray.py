@@ -0,0 +1,182 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "development"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mpiarray import MpiArray
+import helpers
+
+
+def test_split_even():
+    sizes, offsets = MpiArray.split_array_indicies((10, 3), 3)
+    assert list(sizes) == [3, 4, 3] and list(offsets) == [0, 3, 7]
+
+
+def test_split_weighted():
+    # a row heavier than a rank's share gets a rank of its own, the rest is split over the others
+    sizes, offsets = MpiArray.split_array_indicies((10,), 3, weights=[100] + [1] * 9)
+    assert list(sizes) == [1, 5, 4] and list(offsets) == [0, 1, 6]
+    weights = np.arange(1, 41, dtype=np.float64)
+    sizes, offsets = MpiArray.split_array_indicies((40,), 4, weights=weights)
+    assert sizes.sum() == 40 and list(offsets) == [0] + list(np.cumsum(sizes)[:-1])
+    costs = [weights[o:o + s].sum() for s, o in zip(sizes, offsets)]
+    assert max(costs) - min(costs) <= weights.max()
+    # rank weights: a rank without capacity gets no rows
+    sizes, offsets = MpiArray.split_array_indicies((10,), 3, rank_weights=[0, 1, 1])
+    assert list(sizes) == [0, 5, 5]
+    # fewer rows than ranks, every row is used once
+    sizes, offsets = MpiArray.split_array_indicies((2,), 4, weights=[1, 1])
+    assert sizes.sum() == 2 and sizes.max() == 1
+    with pytest.raises(Exception):
+        MpiArray.split_array_indicies((10,), 3, weights=np.ones(9))
+
+
+def test_overlap_indicies():
+    sizes, offsets = MpiArray._overlap_indicies(5, 10, np.array([0, 4, 8, 20]), np.array([4, 4, 12, 5]))
+    assert list(sizes) == [0, 3, 7, 0] and list(offsets) == [0, 0, 3, 0]
+
+
+def run_mpi(check):
+    helpers.run_mpi(__file__, check)
+
+
+def test_mpi_redistribute():
+    run_mpi("redistribute")
+
+
+def test_mpi_halo():
+    run_mpi("halo")
+
+
+def test_mpi_shared():
+    run_mpi("shared")
+
+
+def test_mpi_reductions():
+    run_mpi("reductions")
+
+
+# checks run on every rank by run_mpi, they raise on failure
+def mpi_check_redistribute(comm):
+    full = np.arange(23 * 5 * 3, dtype=np.float32).reshape(23, 5, 3)
+    arr = MpiArray.fromglobalarray(full if comm.Get_rank() == 0 else None, shared=False)
+    weights = np.linspace(1, 10, 23)
+    arr.scatter(0, weights=weights)
+    assert np.array_equal(arr.local_arr, full[arr.offset:arr.offset + arr.size])
+    # to an uneven split and back
+    arr.redistribute(sizes=[2, 10, 0, 11])
+    assert np.array_equal(arr.local_arr, full[arr.offset:arr.offset + arr.size])
+    arr.redistribute()
+    assert list(arr.sizes) == list(MpiArray.split_array_indicies(full.shape, 4)[0])
+    arr.rebalance(local_costs=weights[arr.offset:arr.offset + arr.size])
+    assert np.array_equal(arr.local_arr, full[arr.offset:arr.offset + arr.size])
+    # along axis 1
+    arr.swapaxes_01()
+    arr.redistribute(weights=np.arange(5) + 1.0)
+    gathered = arr.gather(1)
+    if comm.Get_rank() == 0:
+        assert np.array_equal(gathered, np.swapaxes(full, 0, 1))
+
+
+def mpi_check_halo(comm):
+    from scipy import ndimage
+    full = np.random.RandomState(0).rand(17, 6, 4)
+    arr = MpiArray.fromglobalarray(full if comm.Get_rank() == 0 else None, shared=False)
+    arr.scatter(0, weights=np.linspace(1, 5, 17))
+    for k in (0, 1, 3, 6):
+        padded = arr.exchange_halo(k)
+        lo, hi = arr.halo
+        assert lo == min(k, arr.offset) and hi == min(k, 17 - arr.offset - arr.size)
+        assert np.array_equal(padded, full[arr.offset - lo:arr.offset + arr.size + hi])
+        assert np.array_equal(arr.trim_halo(padded), arr.local_arr)
+    # a stencil run on the slabs with their halos equals the stencil on the whole array
+    arr.apply_halo(ndimage.median_filter, 2, size=(5, 1, 1), mode='nearest')
+    expected = ndimage.median_filter(full, size=(5, 1, 1), mode='nearest')
+    assert np.array_equal(arr.local_arr, expected[arr.offset:arr.offset + arr.size])
+    # sinogram order
+    arr.swapaxes_01()
+    padded = arr.exchange_halo(2)
+    lo, hi = arr.halo
+    assert np.array_equal(padded, np.swapaxes(expected, 0, 1)[arr.offset - lo:arr.offset + arr.size + hi])
+
+
+def mpi_check_shared(comm):
+    full = np.random.RandomState(1).rand(19, 7, 3).astype(np.float32)
+    results = {}
+    for shared in (False, True):
+        # gather writes into the array the MpiArray was made from, give each run its own
+        arr = MpiArray.fromglobalarray(full.copy() if comm.Get_rank() == 0 else None, shared=shared)
+        assert arr.shared == shared
+        steps = [arr.scatter(0, weights=np.linspace(1, 3, 19)).copy()]
+        arr.local_arr = arr.local_arr * 2  # a stage replacing local_arr
+        arr.swapaxes_01()
+        steps.append(arr.local_arr.copy())
+        arr.redistribute(weights=np.arange(7) + 1.0)
+        steps.append(arr.local_arr.copy())
+        steps.append(arr.exchange_halo(2))
+        arr.local_arr += 1  # a stage working in place
+        steps.append(arr.gather(0))
+        arr.gather(0, delete_local=True)
+        results[shared] = steps
+    for plain, shared in zip(results[False], results[True]):
+        assert (plain is None and shared is None) or np.array_equal(plain, shared)
+    if comm.Get_rank() == 0:
+        assert np.allclose(results[True][-1], full * 2 + 1)
+
+
+def mpi_check_reductions(comm):
+    full = np.random.RandomState(2).normal(3.0, 2.0, (23, 5, 4))
+    arr = MpiArray.fromglobalarray(full if comm.Get_rank() == 0 else None, shared=False)
+    for stage in ("unscattered", "scattered", "empty rank"):
+        if stage == "scattered":
+            arr.scatter(0)
+        elif stage == "empty rank":
+            # the second process holds no rows
+            sizes = np.array([8, 0] + [0] * (comm.Get_size() - 2))
+            sizes[2:] = 15 // (comm.Get_size() - 2)
+            sizes[-1] += 15 - sizes[2:].sum()
+            arr.redistribute(sizes=sizes)
+            assert arr.local_arr.shape[0] == sizes[comm.Get_rank()]
+        # the reductions must match numpy on the gathered array
+        assert arr.min() == full.min() and arr.max() == full.max()
+        assert np.isclose(arr.sum(), full.sum())
+        assert arr.count() == full.size
+        assert np.isclose(arr.mean(), full.mean())
+        assert np.isclose(arr.std(), full.std())
+        hist, edges = arr.histogram(bins=17)
+        expected_hist, expected_edges = np.histogram(full, bins=17)
+        assert np.array_equal(hist, expected_hist) and np.allclose(edges, expected_edges)
+        hist, edges = arr.histogram(bins=8, range=(0.0, 4.0))
+        expected_hist, expected_edges = np.histogram(full, bins=8, range=(0.0, 4.0))
+        assert np.array_equal(hist, expected_hist) and np.allclose(edges, expected_edges)
+        q = [0, 1, 25, 50, 99, 100]
+        bin_width = (full.max() - full.min()) / 4096
+        expected = np.percentile(full, q, method="inverted_cdf")
+        assert np.allclose(arr.percentile(q), expected, rtol=0, atol=bin_width)
+    gathered = arr.gather(0)
+    if comm.Get_rank() == 0:
+        assert np.array_equal(gathered, full)
+
+
+def run_mpi_check(check):
+    from mpi4py import MPI
+    globals()["mpi_check_" + check](MPI.COMM_WORLD)
+    print("ok " + check)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run_mpi_check(sys.argv[1])
+    else:
+        test_split_even()
+        test_split_weighted()
+        test_overlap_indicies()
+        test_mpi_redistribute()
+        test_mpi_halo()
+        test_mpi_shared()
+        test_mpi_reductions()
+        print("mpiarray tests passed")
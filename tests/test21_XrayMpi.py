@@ -0,0 +1,92 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "development"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+pytest.importorskip("mpi4py")
+
+import helpers
+import xray_mpi
+from mpiarray import MpiArray
+
+
+def test_fit_center_median():
+    estimates = [(0, 100.0), (10, 101.0), (20, 140.0)]
+    assert xray_mpi.fit_center(estimates) == (101.0, 0.0)
+    # too few estimates for a linear fit
+    assert xray_mpi.fit_center(estimates[:2], fit='linear') == (100.5, 0.0)
+
+
+def test_fit_center_no_estimates():
+    assert xray_mpi.fit_center([], fit='linear', default_center=64) == (64, 0.0)
+
+
+def test_fit_center_linear():
+    rows = np.arange(0, 200, 10, dtype=np.float64)
+    centers = 120.0 + 0.05 * rows + np.random.RandomState(0).uniform(-0.1, 0.1, rows.size)
+    intercept, slope = xray_mpi.fit_center(np.column_stack([rows, centers]), fit='linear')
+    assert abs(intercept - 120.0) < 0.2 and abs(slope - 0.05) < 0.002
+
+
+def test_fit_center_linear_outliers():
+    rows = np.arange(0, 200, 10, dtype=np.float64)
+    centers = 120.0 + 0.05 * rows
+    # failed searches far from the axis
+    centers[[3, 11]] = [40.0, 250.0]
+    estimates = np.column_stack([rows, centers])
+    intercept, slope = xray_mpi.fit_center(estimates, fit='linear')
+    assert np.isclose(intercept, 120.0) and np.isclose(slope, 0.05)
+    # the first fit alone is pulled off by the outliers
+    first_slope, first_intercept = np.polyfit(rows, centers, 1)
+    assert abs(first_intercept - 120.0) > 1.0
+
+
+def test_mpi_run_stage_halo():
+    helpers.run_mpi(__file__, "run_stage")
+
+
+def remove_outlier(arr, dif, size=3, axis=0):
+    # tomopy.remove_outlier: median of size x size within each slice of axis, replaces values dif above it
+    from scipy import ndimage
+    footprint = tuple(1 if a == axis else size for a in range(arr.ndim))
+    filtered = ndimage.median_filter(arr, size=footprint, mode='nearest')
+    return np.where(arr - filtered >= dif, filtered, arr)
+
+
+# run on every rank by test_mpi_run_stage_halo
+def mpi_check_run_stage(comm):
+    full = np.random.RandomState(3).rand(9, 23, 5)
+    full[::4, ::3, ::2] += 5  # outliers
+    expected = remove_outlier(full, 1.0, size=xray_mpi.outlier_size2d, axis=0)
+    arr = MpiArray.fromglobalarray(full if comm.Get_rank() == 0 else None, shared=False)
+    # projection order: the median stays inside the local projections
+    arr.scatter(0)
+    arr.halo = None
+    xray_mpi.run_stage(arr, 'remove_outlier2d', remove_outlier, 1.0, size=xray_mpi.outlier_size2d, axis=arr.axis)
+    assert arr.halo is None
+    assert np.array_equal(arr.local_arr, expected[arr.offset:arr.offset + arr.size])
+    # sinogram order: the median of each projection spans the sinogram rows of the neighbouring ranks
+    arr = MpiArray.fromglobalarray(full if comm.Get_rank() == 0 else None, shared=False)
+    arr.scatter(1)
+    xray_mpi.run_stage(arr, 'remove_outlier2d', remove_outlier, 1.0, size=xray_mpi.outlier_size2d, axis=arr.axis)
+    k = xray_mpi.outlier_size2d // 2
+    assert arr.halo == (min(k, arr.offset), min(k, 23 - arr.offset - arr.size))
+    assert np.array_equal(arr.local_arr, np.swapaxes(expected, 0, 1)[arr.offset:arr.offset + arr.size])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        from mpi4py import MPI
+        globals()["mpi_check_" + sys.argv[1]](MPI.COMM_WORLD)
+        print("ok " + sys.argv[1])
+        sys.exit()
+    test_fit_center_median()
+    test_fit_center_no_estimates()
+    test_fit_center_linear()
+    test_fit_center_linear_outliers()
+    test_mpi_run_stage_halo()
+    print("xray_mpi tests passed")
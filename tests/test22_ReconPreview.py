@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+pytest.importorskip("tomopy")
+
+import reconstruction
+
+
+def test_bin_projections():
+    data = np.arange(2 * 4 * 6, dtype=np.uint16).reshape(2, 4, 6)
+    binned = reconstruction.bin_projections(data, 2)
+    assert binned.dtype == np.float32 and binned.shape == (2, 2, 3)
+    assert binned[1, 1, 2] == data[1, 2:4, 4:6].mean()
+    # binning 1 and missing flats/darks are passed through
+    assert reconstruction.bin_projections(data, 1) is data
+    assert reconstruction.bin_projections(None, 2) is None
+
+
+def test_bin_projections_not_divisible():
+    data = np.random.RandomState(0).rand(3, 7, 11)
+    binned = reconstruction.bin_projections(data, 3)
+    # leftover rows and columns are dropped
+    assert binned.shape == (3, 2, 3)
+    expected = data[:, :6, :9].reshape(3, 2, 3, 3, 3).mean(axis=(2, 4))
+    assert np.allclose(binned, expected)
+    assert reconstruction.bin_projections(data, 8).shape == (3, 0, 1)
+
+
+def test_binned_geometry():
+    pxsize, npad, cor, tiltslice, tiltdet = reconstruction.binned_geometry(4, 0.65, 10, cor=101.5, tiltcenter_slice=40,
+                                                                         tiltcenter_det=80)
+    assert np.isclose(pxsize, 2.6) and npad == 3
+    assert np.isclose(cor, 25.0) and tiltslice == 10 and tiltdet == 20
+    assert reconstruction.binned_geometry(2, 1.0, 0)[2:] == (None, None, None)
+
+
+@pytest.mark.parametrize("binning", [2, 3, 4])
+def test_binned_cor_matches_binned_data(binning):
+    # a profile symmetric about the center of rotation stays symmetric about the binned center
+    cor = 101.5
+    x = np.arange(240)
+    profile = np.exp(-(x - cor) ** 2 / 200.)
+    binned = reconstruction.bin_projections(np.tile(profile, (1, binning, 1)), binning)[0, 0]
+    binned_cor = reconstruction.binned_geometry(binning, 1.0, 0, cor=cor)[2]
+    centroid = np.sum(np.arange(binned.size) * binned) / np.sum(binned)
+    assert abs(centroid - binned_cor) < 1e-3
+
+
+if __name__ == "__main__":
+    test_bin_projections()
+    test_bin_projections_not_divisible()
+    test_binned_geometry()
+    for binning in (2, 3, 4):
+        test_binned_cor_matches_binned_data(binning)
+    print("preview tests passed")
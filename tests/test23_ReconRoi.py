@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+tomopy = pytest.importorskip("tomopy")
+
+import reconstruction
+
+
+def test_roi_ranges():
+    assert reconstruction.roi_ranges(100, None, None) == ((0, 100), (0, 100))
+    # roiX selects columns, roiY rows
+    assert reconstruction.roi_ranges(100, (10, 30), (40, None)) == ((40, 100), (10, 30))
+    # negative and out of range values are clipped like slices
+    assert reconstruction.roi_ranges(100, (-20, None), (0, 500)) == ((0, 100), (80, 100))
+
+
+@pytest.mark.parametrize("size", [64, 65])
+def test_roi_circ_mask_matches_full_slice(size):
+    full = tomopy.circ_mask(np.ones((1, size, size), dtype=np.float32), 0)[0] > 0
+    for roiX, roiY in [(None, None), ((10, 40), (0, 20)), ((0, 5), (size - 5, None)), ((30, 34), (30, 34))]:
+        rows, cols = reconstruction.roi_ranges(size, roiX, roiY)
+        mask = reconstruction.roi_circ_mask(size, rows, cols)
+        assert mask.shape == (rows[1] - rows[0], cols[1] - cols[0])
+        assert np.array_equal(mask, full[rows[0]:rows[1], cols[0]:cols[1]])
+
+
+@pytest.mark.parametrize("binning, chunk_sino", [(1, 100), (1, 250), (4, 25)])
+def test_sino_chunks_stay_in_roi_z(binning, chunk_sino):
+    # roiZ=(500, 750) becomes sinoused, the span is not a multiple of chunk_sino
+    sinoused = (500, 750, 1)
+    numsinoused = (sinoused[1] - sinoused[0]) // binning
+    if binning > 1:
+        sinoused = (sinoused[0], sinoused[0] + numsinoused * binning, 1)
+    num_sino_per_chunk = min(chunk_sino, numsinoused)
+    numsinochunks = (numsinoused - 1) // num_sino_per_chunk + 1
+    chunks = [reconstruction.sino_chunk(y, num_sino_per_chunk, sinoused, binning) for y in range(numsinochunks)]
+    assert chunks[0][0] == 500 and chunks[-1][1] == sinoused[1] <= 750
+    for (start, end, step), (nextStart, nextEnd, nextStep) in zip(chunks, chunks[1:]):
+        assert end == nextStart
+    # each chunk holds whole binned slices
+    assert all((end - start) % binning == 0 for start, end, step in chunks)
+    if binning == 1 and chunk_sino == 100:
+        assert chunks == [(500, 600, 1), (600, 700, 1), (700, 750, 1)]
+
+
+def test_roi_z_and_sinoused():
+    with pytest.raises(ValueError):
+        reconstruction.recon(filename="missing.h5", inputPath="/nonexistent/", roiZ=(0, 10), sinoused=(0, 10, 1))
+
+
+if __name__ == "__main__":
+    test_roi_ranges()
+    for size in (64, 65):
+        test_roi_circ_mask_matches_full_slice(size)
+    for binning, chunk_sino in [(1, 100), (1, 250), (4, 25)]:
+        test_sino_chunks_stay_in_roi_z(binning, chunk_sino)
+    test_roi_z_and_sinoused()
+    print("region of interest tests passed")
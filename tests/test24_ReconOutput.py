@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+pytest.importorskip("tomopy")
+
+import image_processing
+import reconstruction
+
+
+def recon_missing(**kwargs):
+    # options are checked before the dataset is opened
+    return reconstruction.recon(filename="missing.h5", inputPath="/nonexistent/", **kwargs)
+
+
+@pytest.mark.parametrize("outputType", ["uint8", "float64", None])
+def test_unknown_output_type(outputType):
+    with pytest.raises(ValueError):
+        recon_missing(outputType=outputType)
+
+
+@pytest.mark.parametrize("option", ["castTo8bit", "doBilateralFilter"])
+def test_encoded_output_with_8bit(option):
+    with pytest.raises(ValueError):
+        recon_missing(outputType="uint16", **{option: True})
+
+
+def test_volume_stats_range():
+    stats = image_processing.VolumeStats()
+    with pytest.raises(OSError):
+        recon_missing(volumeStats=stats, outputMin=-5, outputMax=20)
+    # float chunks are counted in the output range
+    assert stats.histRange == (-5.0, 20.0)
+    stats = image_processing.VolumeStats(histRange=(0, 1))
+    with pytest.raises(OSError):
+        recon_missing(volumeStats=stats)
+    assert stats.histRange == (0.0, 1.0)
+    # 8bit chunks get the uint8 range from VolumeStats
+    stats = image_processing.VolumeStats()
+    with pytest.raises(OSError):
+        recon_missing(volumeStats=stats, castTo8bit=True)
+    assert stats.histRange is None
+
+
+if __name__ == "__main__":
+    for outputType in ("uint8", "float64", None):
+        test_unknown_output_type(outputType)
+    for option in ("castTo8bit", "doBilateralFilter"):
+        test_encoded_output_with_8bit(option)
+    test_volume_stats_range()
+    print("reconstruction output tests passed")
@@ -0,0 +1,101 @@
+import os
+import sys
+import hashlib
+
+import numpy as np
+import h5py
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from spot_server import SpotTestServer
+from helpers import make_dir, read_file, run_tests, write_dataset
+
+testData = "20160309_091927_sample06_650C_00"
+
+
+def make_dirs(tmp_path):
+    dataDir, outDir = make_dir(tmp_path, "data"), make_dir(tmp_path, "out")
+    content = read_file(write_dataset(dataDir, testData, size=5 * 1024 ** 2 + 123))
+    return dataDir, outDir, content
+
+
+def test_download_parallel(tmp_path):
+    dataDir, outDir, content = make_dirs(tmp_path)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        fileLocation = dm.download_file(s.session, s.URL_base + "/als/hdf/download/als/bl832/testuser/" + testData +
+                                        "/raw/" + testData + ".h5", outDir + "/" + testData + ".h5",
+                                        connections=4, blockSize=1024 ** 2,
+                                        checksum=("md5", hashlib.md5(content).hexdigest()))
+        assert server.count("/als/hdf/download/") == 1 + 6  # probe + one request per block
+    assert read_file(fileLocation) == content
+    assert not os.path.exists(fileLocation + ".part")
+
+
+def test_download_resume(tmp_path):
+    dataDir, outDir, content = make_dirs(tmp_path)
+    url = "/als/hdf/download/als/bl832/testuser/" + testData + "/raw/" + testData + ".h5"
+    fileLocation = outDir + "/" + testData + ".h5"
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        # connection drops for every block after the third, the download gives up
+        server.failDownloads = 100
+        server.failOffset = 3 * 1024 ** 2
+        try:
+            dm.download_file(s.session, server.url + url, fileLocation, connections=1, blockSize=1024 ** 2,
+                             retries=1)
+            assert False, "download should have failed"
+        except IOError:
+            pass
+        assert os.path.exists(fileLocation + ".part")
+        # second attempt only fetches the missing blocks
+        server.failDownloads = 0
+        server.requests = []
+        dm.download_file(s.session, server.url + url, fileLocation, connections=2, blockSize=1024 ** 2)
+        assert server.count("/als/hdf/download/") == 1 + 3
+    assert read_file(fileLocation) == content
+
+
+def test_download_checksum_mismatch(tmp_path):
+    dataDir, outDir, content = make_dirs(tmp_path)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        try:
+            s.download(testData, downloadPath=outDir, checksum=("md5", "0" * 32))
+            assert False, "checksum mismatch should raise"
+        except IOError:
+            pass
+    assert not os.path.exists(outDir + "/" + testData + ".h5")
+
+
+def test_download_to_memory(tmp_path):
+    dataDir, outDir, content = make_dirs(tmp_path)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        data = dm.download_to_memory(s.session, server.url + "/als/hdf/download/als/bl832/testuser/" + testData +
+                                     "/raw/" + testData + ".h5", connections=3, blockSize=1024 ** 2)
+        assert data.getvalue() == content
+
+
+def test_open_dataset(tmp_path):
+    dataDir, outDir = make_dir(tmp_path, "data"), make_dir(tmp_path, "out")
+    image = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    with h5py.File(os.path.join(dataDir, testData + ".h5"), "w") as f:
+        f.create_dataset(testData + "/" + testData + "_0000_0000.tif", data=image)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        with s.open_dataset(testData, username="testuser", downloadPath=outDir) as f:
+            assert np.array_equal(f[testData + "/" + testData + "_0000_0000.tif"][...], image)
+        assert os.listdir(outDir) == []
+        # too large for memory, written to downloadPath
+        with s.open_dataset(testData, username="testuser", downloadPath=outDir, maxMemory=100) as f:
+            assert np.array_equal(f[testData + "/" + testData + "_0000_0000.tif"][...], image)
+        assert os.listdir(outDir) == [testData + ".h5"]
+
+
+if __name__ == "__main__":
+    run_tests(test_download_parallel, test_download_resume, test_download_checksum_mismatch,
+              test_download_to_memory, test_open_dataset)
+    print("download tests passed")
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from spot_server import SpotTestServer
+from helpers import run_tests
+
+testData = ["20160309_091927_sample06_650C_00",
+            "20160309_093629_sample06_650C_01",
+            "20160309_095337_sample06_650C_02"]
+
+
+def test_stage_iter_yields_as_online(tmp_path):
+    with SpotTestServer(str(tmp_path)) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        server.stageDelay = {testData[0]: 4, testData[1]: 0, testData[2]: 2}
+        staged = [dataset for dataset, r in s.stage_iter(testData, pollInterval=0.05, maxInterval=0.2)]
+        # first dataset online is yielded first, the slowest one last
+        assert staged == [testData[1], testData[2], testData[0]]
+        assert server.count("/stageifneeded/") == 3 + 4 + 2
+
+
+def test_stage_iter_timeout(tmp_path):
+    with SpotTestServer(str(tmp_path)) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        server.stageDelay = {testData[0]: 1000}
+        start = time.time()
+        staged = [dataset for dataset, r in s.stage_iter(testData, pollInterval=0.05, timeout=0.5)]
+        assert sorted(staged) == sorted(testData[1:])
+        assert time.time() - start < 2
+
+
+def test_stage_many(tmp_path):
+    with SpotTestServer(str(tmp_path)) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        server.stageDelay = {testData[1]: 1}
+        r_list = s.stage_many(testData)
+        assert [r["status"] for r in r_list] == ["staged", "staging", "staged"]
+
+
+def test_stage_errors_are_not_online(tmp_path):
+    with SpotTestServer(str(tmp_path)) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        server.stageError = {testData[0]: 404, testData[2]: 403}
+        r_list = s.stage_many(testData)
+        assert [r.get("status_code") for r in r_list] == [404, None, 403]
+        assert [dm.stage_complete(r) for r in r_list] == [False, True, False]
+        staged = [dataset for dataset, r in s.stage_iter(testData, pollInterval=0.05, timeout=5)]
+        assert staged == [testData[1]]
+        # failed datasets are not polled again
+        assert server.count("/stageifneeded/") == 3 + 3
+
+
+def test_stage_complete():
+    assert dm.stage_complete({"status": "staged"})
+    assert not dm.stage_complete({"status": "Staging"})
+    assert not dm.stage_complete({"error": "no such file"})
+    assert not dm.stage_complete({"status_code": 500})
+    assert not dm.stage_complete(None)
+
+
+if __name__ == "__main__":
+    run_tests(test_stage_iter_yields_as_online, test_stage_iter_timeout, test_stage_many,
+              test_stage_errors_are_not_online, test_stage_complete)
+    print("staging tests passed")
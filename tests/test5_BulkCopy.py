@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from helpers import make_dir, read_file, run_tests, write_dataset
+
+
+def make_files(tmp_path, n=4, size=3 * 1024 ** 2 + 17):
+    sourceDir, destinationDir = make_dir(tmp_path, "source"), make_dir(tmp_path, "destination")
+    sourceList = [write_dataset(sourceDir, "dataset{}".format(i), size + i) for i in range(n)]
+    destinationList = [os.path.join(destinationDir, os.path.basename(source)) for source in sourceList]
+    return sourceList, destinationList
+
+
+def test_copy_files(tmp_path):
+    sourceList, destinationList = make_files(tmp_path)
+    status = dm.copy_files(sourceList, destinationList, maxWorkers=3)
+    assert status == ['copied'] * 4
+    for source, destination in zip(sourceList, destinationList):
+        assert read_file(source) == read_file(destination)
+        assert not os.path.exists(destination + ".part")
+
+
+def test_copy_files_skips_identical(tmp_path):
+    sourceList, destinationList = make_files(tmp_path)
+    dm.copy_files(sourceList[:2], destinationList[:2])
+    # same size, different content: copied again
+    with open(destinationList[1], "r+b") as f:
+        f.write(b"corrupt")
+    status = dm.copy_files(sourceList, destinationList)
+    assert status == ['skipped', 'copied', 'copied', 'copied']
+    assert read_file(sourceList[1]) == read_file(destinationList[1])
+
+
+def test_copy_file_small_blocks(tmp_path):
+    sourceList, destinationList = make_files(tmp_path, n=1)
+    dm.copy_file(sourceList[0], destinationList[0], blockSize=1000)
+    assert read_file(sourceList[0]) == read_file(destinationList[0])
+
+
+if __name__ == "__main__":
+    run_tests(test_copy_files, test_copy_files_skips_identical, test_copy_file_small_blocks)
+    print("bulk copy tests passed")
@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from spot_server import SpotTestServer
+from helpers import make_dir, run_tests, write_dataset
+
+testData = "20160309_091927_sample06_650C_00"
+
+
+def test_cache_hits(tmp_path):
+    dataDir = make_dir(tmp_path, "data")
+    write_dataset(dataDir, testData)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url, cache=True)
+        for i in range(3):
+            assert s.search("sample06")[0]["name"] == testData
+            assert s.list_images(testData, "testuser")[0].endswith("_0000.tif")
+            assert s.attributes(testData, "testuser")["size"] == 1024
+        assert server.count("/als/hdf/search") == 1
+        assert server.count("/als/hdf/listimages/") == 1
+        assert server.count("/als/hdf/attributes/") == 1
+        assert s.cache.hits == 6 and s.cache.misses == 3
+        # different parameters are different entries
+        s.search("sample06", skipnum=1)
+        assert server.count("/als/hdf/search") == 2
+        # staging is never cached
+        s.stage(testData, "testuser")
+        s.stage(testData, "testuser")
+        assert server.count("/als/hdf/stageifneeded/") == 2
+
+
+def test_cache_ttl_and_invalidate(tmp_path):
+    dataDir = make_dir(tmp_path, "data")
+    write_dataset(dataDir, testData)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url, cache=True,
+                           cacheTTL={"search": 0.2, "dataset": 0})
+        s.search("sample06")
+        s.search("sample06")
+        assert server.count("/als/hdf/search") == 1
+        time.sleep(0.3)
+        s.search("sample06")
+        assert server.count("/als/hdf/search") == 2
+        # a TTL of 0 turns caching off for that endpoint
+        s.derived_datasets(testData)
+        s.derived_datasets(testData)
+        assert server.count("/als/hdf/dataset") == 2
+        s.list_images(testData, "testuser")
+        s.cache.invalidate("listimages")
+        s.list_images(testData, "testuser")
+        assert server.count("/als/hdf/listimages/") == 2
+        # failed requests are not cached
+        s.attributes("missing", "testuser")
+        s.attributes("missing", "testuser")
+        assert server.count("/als/hdf/attributes/") == 2
+
+
+def test_cache_disk_and_eviction(tmp_path):
+    dataDir, cacheDir = make_dir(tmp_path, "data"), make_dir(tmp_path, "cache")
+    for i in range(3):
+        write_dataset(dataDir, "dataset{}".format(i))
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url, cacheDir=cacheDir)
+        s.attributes("dataset0", "testuser")
+        # a new session reads the responses written by the first
+        s2 = dm.SpotSession(username="testuser", password="test", baseURL=server.url, cacheDir=cacheDir)
+        s2.attributes("dataset0", "testuser")
+        assert server.count("/als/hdf/attributes/") == 1
+        s2.cache.invalidate()
+        assert os.listdir(cacheDir) == []
+
+        s3 = dm.SpotSession(username="testuser", password="test", baseURL=server.url, cache=True, cacheSize=2)
+        for i in range(3):
+            s3.attributes("dataset{}".format(i), "testuser")
+        assert len(s3.cache.entries) == 2
+        s3.attributes("dataset0", "testuser")
+        assert server.count("/als/hdf/attributes/") == 1 + 4
+
+
+def test_cache_per_account_and_copies(tmp_path):
+    dataDir = make_dir(tmp_path, "data")
+    write_dataset(dataDir, testData)
+    with SpotTestServer(dataDir) as server:
+        cacheDir = make_dir(tmp_path, "cache")
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url, cacheDir=cacheDir)
+        s2 = dm.SpotSession(username="otheruser", password="test", baseURL=server.url, cacheDir=cacheDir)
+        s.search("sample06")
+        s2.search("sample06")
+        # the same request by another account is not answered from the cache
+        assert server.count("/als/hdf/search") == 2
+        # changing a returned response does not change the cache
+        s.search("sample06")[0]["name"] = "changed"
+        assert s.search("sample06")[0]["name"] == testData
+        assert server.count("/als/hdf/search") == 2
+
+
+def test_cache_disk_limit_and_expiry(tmp_path):
+    cacheDir = str(tmp_path)
+    cache = dm.ResponseCache(ttl={"attributes": 60, "search": 0.2}, cacheDir=cacheDir, maxDiskBytes=3000)
+    for i in range(10):
+        cache.put("attributes", dm.ResponseCache.key("url{}".format(i)), {"data": "x" * 500})
+        time.sleep(0.01)
+    size = sum(os.path.getsize(os.path.join(cacheDir, name)) for name in os.listdir(cacheDir))
+    assert 0 < size <= 3000 and len(os.listdir(cacheDir)) < 10
+    # the newest responses are kept on disk
+    cache2 = dm.ResponseCache(cacheDir=cacheDir)
+    assert cache2.get("attributes", dm.ResponseCache.key("url9"))[0]
+    assert not cache2.get("attributes", dm.ResponseCache.key("url0"))[0]
+    # expired responses are removed from disk
+    cache.invalidate()
+    cache.put("search", dm.ResponseCache.key("search"), [1, 2])
+    assert len(os.listdir(cacheDir)) == 1
+    time.sleep(0.3)
+    assert cache.get("search", dm.ResponseCache.key("search")) == (False, None)
+    assert os.listdir(cacheDir) == []
+    cache.put("search", dm.ResponseCache.key("search"), [1, 2])
+    time.sleep(0.3)
+    dm.ResponseCache(cacheDir=cacheDir)
+    assert os.listdir(cacheDir) == []
+
+
+if __name__ == "__main__":
+    run_tests(test_cache_hits, test_cache_ttl_and_invalidate, test_cache_disk_and_eviction,
+              test_cache_per_account_and_copies, test_cache_disk_limit_and_expiry)
+    print("cache tests passed")
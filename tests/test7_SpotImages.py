@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import tifffile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from spot_server import SpotTestServer
+from helpers import make_dir, random_stack, run_tests, write_dataset, write_images
+
+testData = "20160309_091927_sample06_650C_00"
+
+
+def make_dataset(dataDir, numImages=12):
+    # the server lists and sends the images in the directory [dataset]
+    write_dataset(dataDir, testData)
+    images = random_stack((numImages, 32, 48), 0, 65535, np.uint16)
+    write_images(os.path.join(dataDir, testData), images, testData + "_{:04d}.tif")
+    return images
+
+
+def test_download_images_array(tmp_path):
+    dataDir = str(tmp_path)
+    images = make_dataset(dataDir)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        data = s.download_images(testData, numbers=range(2, 10, 2), username="testuser", asArray=True,
+                                 connections=4)
+        assert data.dtype == np.uint16
+        assert np.array_equal(data, images[2:10:2])
+        # path discovery happens once for the whole request
+        assert server.count("/als/hdf/dataset") == 1
+        assert server.count("/als/hdf/listimages/") == 1
+        assert server.count("/als/hdf/rawdata/") == 4
+
+
+def test_download_images_files(tmp_path):
+    dataDir, outDir = make_dir(tmp_path, "data"), make_dir(tmp_path, "out")
+    images = make_dataset(dataDir)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        fileList = s.download_images(testData, username="testuser", downloadPath=outDir, connections=8)
+        assert len(fileList) == len(images)
+        for i, fileLocation in enumerate(fileList):
+            assert np.array_equal(tifffile.imread(fileLocation), images[i])
+        # single image download shares the path lookup
+        fileLocation = s.download_image(testData, username="testuser", number=3, downloadPath=outDir,
+                                        downloadName="single")
+        assert np.array_equal(tifffile.imread(fileLocation), images[3])
+
+
+if __name__ == "__main__":
+    run_tests(test_download_images_array, test_download_images_files)
+    print("image download tests passed")
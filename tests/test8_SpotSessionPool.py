@@ -0,0 +1,90 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from spot_server import SpotTestServer
+from helpers import run_tests, write_dataset
+
+testData = "20160309_091927_sample06_650C_00"
+
+
+def test_keep_alive_and_latency(tmp_path):
+    dataDir = str(tmp_path)
+    write_dataset(dataDir, testData)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        server.connections = set()
+        for i in range(10):
+            assert s.search("sample06")[0]["name"] == testData
+            s.attributes(testData, "testuser")
+        assert len(server.connections) == 1
+        stats = s.latency_stats()
+        assert stats["search"]["count"] == 10
+        assert stats["attributes"]["count"] == 10
+        assert stats["auth"]["count"] == 2
+        assert stats["search"]["max"] >= stats["search"]["mean"] > 0
+
+
+def test_retry_transient_errors(tmp_path):
+    dataDir = str(tmp_path)
+    write_dataset(dataDir, testData)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url, retries=3, backoff=0.01)
+        server.failStatus = 2
+        assert s.search("sample06")[0]["name"] == testData
+        assert server.count("/als/hdf/search") == 3
+
+
+def test_reauthentication(tmp_path):
+    dataDir = str(tmp_path)
+    write_dataset(dataDir, testData)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        assert server.count("/als/auth") == 2
+        # server side expiry: 401, log in again and repeat the request
+        server.expire_sessions()
+        assert s.search("sample06")[0]["name"] == testData
+        assert server.count("/als/auth") == 3
+        assert server.count("/als/hdf/search") == 2
+        # cookie expired on the client: sent without it, 401, log in again
+        server.expire_sessions()
+        s.session.cookies.clear()
+        assert s.attributes(testData, "testuser")["size"] == 1024
+        assert server.count("/als/auth") == 4
+        assert server.count("/als/hdf/attributes/") == 2
+
+
+def test_no_session_cookie(tmp_path):
+    dataDir = str(tmp_path)
+    write_dataset(dataDir, testData)
+    with SpotTestServer(dataDir) as server:
+        server.sessionCookies = False
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        assert len(s.session.cookies) == 0
+        for i in range(3):
+            assert s.search("sample06")[0]["name"] == testData
+        # an empty cookie jar alone does not log in again
+        assert server.count("/als/auth") == 2
+        assert server.count("/als/hdf/search") == 3
+
+
+def test_pool_size_grows_only(tmp_path):
+    dataDir = str(tmp_path)
+    write_dataset(dataDir, testData)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url, poolSize=4)
+        adapter = s.session.get_adapter(server.url)
+        s.session.set_pool_size(2)
+        assert s.session.poolSize == 4 and s.session.get_adapter(server.url) is adapter
+        s.session.set_pool_size(8)
+        assert s.session.poolSize == 8 and s.session.get_adapter(server.url) is not adapter
+        assert s.search("sample06")[0]["name"] == testData
+
+
+if __name__ == "__main__":
+    run_tests(test_keep_alive_and_latency, test_retry_transient_errors, test_reauthentication, test_no_session_cookie,
+              test_pool_size_grows_only)
+    print("session tests passed")
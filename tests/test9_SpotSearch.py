@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "als-microct-toolbox"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_management as dm
+from spot_server import SpotTestServer
+from helpers import run_tests, write_dataset
+
+
+def make_datasets(dataDir, number=23):
+    names = ["2016_sample{:03d}".format(i) for i in range(number)]
+    for name in names:
+        write_dataset(dataDir, name, size=1)
+    return names
+
+
+def test_search_iter(tmp_path):
+    dataDir = str(tmp_path)
+    names = make_datasets(dataDir)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url)
+        results = [r["name"] for r in s.search_iter("sample", pageSize=5, prefetch=3)]
+        assert results == names
+        # 5 pages with results, at most prefetch - 1 requested past the end
+        assert 5 <= server.count("/als/hdf/search") <= 5 + 2
+
+
+def test_search_iter_stop(tmp_path):
+    dataDir = str(tmp_path)
+    names = make_datasets(dataDir)
+    with SpotTestServer(dataDir) as server:
+        s = dm.SpotSession(username="testuser", password="test", baseURL=server.url, cache=True)
+        results = [r["name"] for r in s.search_iter("sample", pageSize=4, prefetch=2,
+                                                     stop=lambda r: r["name"] == names[6])]
+        assert results == names[:6]
+        assert server.count("/als/hdf/search") <= 3
+        assert len(list(s.search_iter("sample", pageSize=4, prefetch=2, maxResults=9))) == 9
+        # the first pages come from the cache on the second sweep
+        assert server.count("/als/hdf/search") <= 4
+
+
+if __name__ == "__main__":
+    run_tests(test_search_iter, test_search_iter_stop)
+    print("search tests passed")